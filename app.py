@@ -1,16 +1,24 @@
-from flask import Flask, jsonify, request, render_template, g
+from flask import Flask, Response, jsonify, request, render_template, g
 from functools import wraps
 import storage
-import pandas as pd
+import cache
+import compression
+from writer import writer
+import sessions
 import secrets
 import time
+import threading
 import validation
-from datetime import datetime
+from datetime import datetime, timedelta
+from werkzeug.exceptions import HTTPException
 import services.transactions as transactions_service
 import services.categories as categories_service
 import services.budgets as budgets_service
 import services.graphs as graphs_service
-import services.uploads as uploads_service
+import services.upload_jobs as upload_jobs_service
+import services.rules as rules_service
+import services.exports as exports_service
+import services.changes as changes_service
 import services.setup as setup_service
 import logging
 import sys
@@ -18,7 +26,27 @@ import os
 
 # --- Flask App Setup ---
 app = Flask(__name__)
-setup_service.initialize_database()
+_startup_lock = threading.Lock()
+_started = False
+
+
+def start_app():
+    """Migrate the database and resume background work, once per serving process."""
+    global _started
+    if _started:
+        return
+    with _startup_lock:
+        if _started:
+            return
+        setup_service.initialize_database()
+        upload_jobs_service.resume_pending_jobs()
+        changes_service.compact()
+        _started = True
+
+
+app.before_request(start_app)
+app.before_request(storage.open_request_scope)
+app.teardown_request(storage.close_request_scope)
 os.makedirs('logs', exist_ok=True)
 log_file = 'logs/app.log'
 handler = logging.StreamHandler(sys.stdout)
@@ -37,7 +65,7 @@ def require_session_token(f):
             app.logger.warning("Missing session token")
             return jsonify({"error": "Missing session token"}), 403
 
-        validation_result = storage.validate_and_track_token(token)
+        validation_result = sessions.validate_and_track_token(token)
 
         if validation_result == "expired":
             app.logger.warning("Session token expired")
@@ -54,11 +82,207 @@ def require_session_token(f):
 
 def get_or_create_session_token():
     ip_address = request.remote_addr
-    token = storage.get_active_token_for_ip(ip_address)
-    if not token:
-        token = storage.create_session_token(ip_address)
-        app.logger.info(f"Session token created for IP {ip_address}")
-    g.session_token = token
+    g.session_token = sessions.create_session_token(ip_address)
+    app.logger.debug(f"Session token issued for IP {ip_address}")
+
+# ---------------- Request Helpers ----------------
+
+MAX_PAGE_SIZE = 500
+MAX_BULK_IDS = 10000
+MAX_PATTERN_LENGTH = 200
+MAX_REGEX_LENGTH = 100
+TRANSACTION_FORMATS = ("records", "columnar")
+SEARCH_SORTS = ("relevance", "date")
+
+def json_object():
+    """The request's JSON body if it is an object, else an empty dict (which then fails validation)."""
+    data = request.get_json(silent=True)
+    return data if isinstance(data, dict) else {}
+
+def parse_transaction_filters(args):
+    """
+    Build a transaction filters dict from query arguments.
+    Returns (filters, error) where error is a message when validation fails.
+    """
+    filters = {}
+
+    month = args.get("month")
+    if month and month != "all":
+        if not validation.validate_month(month):
+            return None, "Invalid month filter"
+        start = datetime.strptime(month, "%Y-%m")
+        end = datetime(start.year + start.month // 12, start.month % 12 + 1, 1)
+        filters["start_date"] = start.strftime("%Y-%m-%d")
+        filters["end_date"] = end.strftime("%Y-%m-%d")
+
+    start_date = args.get("start_date")
+    if start_date:
+        if not validation.validate_iso_date(start_date):
+            return None, "Invalid start date"
+        filters["start_date"] = max(start_date, filters.get("start_date", start_date))
+
+    # end_date is inclusive for callers; the query uses an exclusive bound.
+    end_date = args.get("end_date")
+    if end_date:
+        if not validation.validate_iso_date(end_date):
+            return None, "Invalid end date"
+        end_exclusive = (datetime.strptime(end_date, "%Y-%m-%d") + timedelta(days=1)).strftime("%Y-%m-%d")
+        filters["end_date"] = min(end_exclusive, filters.get("end_date", end_exclusive))
+
+    category = args.get("category")
+    if category:
+        if not category.isdigit() or not validation.validate_positive_int(int(category)):
+            return None, "Invalid category filter"
+        filters["category"] = int(category)
+
+    account_type = args.get("account_type")
+    if account_type:
+        account_type = validation.sanitize_string(account_type, 100)
+        if not account_type:
+            return None, "Invalid account type filter"
+        filters["account_type"] = account_type
+
+    for key in ("min_amount", "max_amount"):
+        value = args.get(key)
+        if value not in (None, ""):
+            if not validation.validate_number(value):
+                return None, f"Invalid {key.replace('_', ' ')}"
+            filters[key] = float(value)
+
+    description = args.get("description")
+    if description:
+        description = validation.sanitize_string(description, MAX_PATTERN_LENGTH)
+        if not description:
+            return None, "Invalid description filter"
+        filters["description"] = description
+
+    pattern = args.get("description_regex")
+    if pattern:
+        if len(pattern) > MAX_REGEX_LENGTH:
+            return None, "Description pattern is too long"
+        if not validation.validate_regex(pattern):
+            return None, "Invalid description pattern"
+        filters["description_regex"] = pattern
+
+    search = args.get("search")
+    if search:
+        search = validation.sanitize_string(search, 200)
+        if search:
+            filters["search"] = search
+
+    return filters, None
+
+def parse_rule(data):
+    """
+    Build a categorization rule dict from a JSON body.
+    Returns (rule, error) where error is a message when validation fails.
+    """
+    category_id = data.get("category_id")
+    if not validation.validate_positive_int(category_id):
+        return None, "Invalid category ID"
+
+    priority = data.get("priority", 0)
+    if not isinstance(priority, int) or isinstance(priority, bool):
+        return None, "Invalid priority"
+
+    is_regex = data.get("is_regex", False)
+    if not isinstance(is_regex, bool):
+        return None, "Invalid is_regex flag"
+
+    pattern = data.get("pattern") or None
+    if pattern is not None:
+        if not isinstance(pattern, str) or len(pattern) > MAX_PATTERN_LENGTH:
+            return None, "Invalid pattern"
+        if is_regex:
+            # Grouped so global inline flags like (?i) are rejected.
+            if not validation.validate_regex(f"(?:{pattern})"):
+                return None, "Invalid regular expression"
+        else:
+            pattern = validation.sanitize_string(pattern, MAX_PATTERN_LENGTH)
+            if not pattern:
+                return None, "Invalid pattern"
+
+    account_type = data.get("account_type") or None
+    if account_type is not None:
+        account_type = validation.sanitize_string(account_type)
+        if not account_type:
+            return None, "Invalid account type"
+
+    amounts = {}
+    for key in ("min_amount", "max_amount"):
+        value = data.get(key)
+        if value in (None, ""):
+            amounts[key] = None
+        elif isinstance(value, bool) or not validation.validate_number(value):
+            return None, f"Invalid {key.replace('_', ' ')}"
+        else:
+            amounts[key] = float(value)
+
+    if pattern is None and account_type is None and amounts["min_amount"] is None and amounts["max_amount"] is None:
+        return None, "A rule needs at least one condition"
+
+    return {
+        "category_id": category_id,
+        "priority": priority,
+        "pattern": pattern,
+        "is_regex": is_regex,
+        "account_type": account_type,
+        **amounts
+    }, None
+
+# Parsers for the single-row write endpoints, shared with /batch. Each takes
+# the JSON body (plus any path arguments) and returns (args, error).
+
+def parse_category_assignment(data):
+    transaction_id = data.get("transaction_id")
+    category_id = data.get("category_id")
+    if not validation.validate_positive_int(transaction_id) or not validation.validate_positive_int(category_id):
+        return None, "Invalid transaction or category ID"
+    return {"transaction_id": transaction_id, "category_id": category_id}, None
+
+def parse_description_update(data):
+    transaction_id = data.get("id")
+    description = data.get("description")
+    if not validation.validate_positive_int(transaction_id) or not validation.sanitize_string(description, 500):
+        return None, "Invalid input"
+    return {"transaction_id": transaction_id, "description": description}, None
+
+def parse_new_category(data):
+    name = data.get("name")
+    parent_id = data.get("parent_id")
+    if not validation.sanitize_string(name):
+        return None, "Invalid category name"
+    if parent_id is not None and not validation.validate_positive_int(parent_id):
+        return None, "Invalid parent ID"
+    return {"name": name, "parent_id": parent_id}, None
+
+def parse_category_rename(data):
+    category_id = data.get("id")
+    new_name = data.get("new_name")
+    if not validation.validate_positive_int(category_id) or not validation.sanitize_string(new_name):
+        return None, "Invalid input"
+    return {"category_id": category_id, "new_name": new_name}, None
+
+def parse_category_move(data):
+    category_id = data.get("id")
+    parent_id = data.get("parent_id")
+    if not validation.validate_positive_int(category_id):
+        return None, "Invalid category ID"
+    if parent_id is not None and not validation.validate_positive_int(parent_id):
+        return None, "Invalid parent ID"
+    return {"category_id": category_id, "parent_id": parent_id}, None
+
+def parse_category_delete(data):
+    if data["category_id"] == categories_service.DEFAULT_CATEGORY_ID:
+        return None, "The default category cannot be deleted"
+    return {"category_id": data["category_id"]}, None
+
+def parse_budget_update(data):
+    category_id = data.get("category_id")
+    amount = data.get("amount")
+    if not validation.validate_positive_int(category_id) or not validation.validate_number(amount):
+        return None, "Invalid input"
+    return {"category_id": category_id, "amount": amount}, None
 
 # ---------------- Index & Pages ----------------
 
@@ -67,8 +291,13 @@ def get_or_create_session_token():
 def index():
     get_or_create_session_token()
     app.logger.info("Index page accessed")
+    # Taken before the page's data is read, so the client's first sync
+    # can only repeat changes it already has, never miss one.
+    change_version = changes_service.current_version()
     categories = categories_service.get_categories_with_subcategories()
-    return render_template("index.html", categories=categories, session_token=g.session_token)
+    return render_template(
+        "index.html", categories=categories, change_version=change_version, session_token=g.session_token
+    )
 
 @app.route("/categories")
 def categories():
@@ -88,66 +317,214 @@ def graphs():
 def budget():
     get_or_create_session_token()
     app.logger.info("Budget page accessed")
-    month = transactions_service.get_most_recent_month()
-    categories = budgets_service.get_budget_status(month)
-    months = transactions_service.get_transaction_months()
+    month = request.args.get("month")
+    if not validation.validate_month(month):
+        month = None
+    month, months, categories = budgets_service.get_budget_page(month)
     return render_template("budget.html", categories=categories, month=month, months=months, session_token=g.session_token)
 
 # ---------------- Transactions ----------------
 
 @app.route("/transactions/get")
 @require_session_token
+@cache.cached_response("transactions", "categories")
+@compression.compressed
 def get_transactions():
-    df = transactions_service.get_transactions()
-    app.logger.info("Transactions retrieved")
-    return df.to_json(orient="records")
+    response_format = request.args.get("format", "records")
+    if response_format not in TRANSACTION_FORMATS:
+        app.logger.warning("Invalid transactions format")
+        return jsonify({"success": False, "error": "Invalid format"}), 400
+    columnar = response_format == "columnar"
+
+    # Without a limit the full table is returned, as before.
+    if "limit" not in request.args:
+        df = transactions_service.get_transactions()
+        app.logger.info("Transactions retrieved")
+        if columnar:
+            return jsonify(transactions_service.to_columnar(df))
+        return df.to_json(orient="records")
+
+    filters, error = parse_transaction_filters(request.args)
+    if error:
+        app.logger.warning(error)
+        return jsonify({"success": False, "error": error}), 400
+
+    sort = request.args.get("sort") or "transaction_date"
+    order = (request.args.get("order") or "desc").lower()
+    limit = request.args.get("limit", type=int)
+    offset = request.args.get("offset", default=0, type=int)
+    cursor = request.args.get("cursor")
+
+    if sort not in transactions_service.SORTABLE_COLUMNS or order not in ("asc", "desc"):
+        app.logger.warning("Invalid sort parameters")
+        return jsonify({"success": False, "error": "Invalid sort"}), 400
+
+    if limit is None or not 0 < limit <= MAX_PAGE_SIZE or offset < 0:
+        app.logger.warning("Invalid paging parameters")
+        return jsonify({"success": False, "error": "Invalid limit or offset"}), 400
+
+    try:
+        page = transactions_service.get_transactions_page(filters, sort, order, cursor, offset, limit, columnar)
+    except ValueError:
+        app.logger.warning("Invalid transactions cursor")
+        return jsonify({"success": False, "error": "Invalid cursor"}), 400
+
+    app.logger.info(f"Transactions page retrieved ({len(page['rows'])} of {page['total']})")
+    return jsonify(page)
+
+@app.route("/transactions/search")
+@require_session_token
+@cache.cached_response("transactions", "categories")
+@compression.compressed
+def search_transactions():
+    query = validation.sanitize_string(request.args.get("q"), MAX_PATTERN_LENGTH)
+    if not query:
+        app.logger.warning("Missing search query")
+        return jsonify({"success": False, "error": "Missing search query"}), 400
+
+    filters, error = parse_transaction_filters(request.args)
+    if error:
+        app.logger.warning(error)
+        return jsonify({"success": False, "error": error}), 400
+    filters["search"] = query
+
+    sort = request.args.get("sort") or "relevance"
+    limit = request.args.get("limit", default=50, type=int)
+    offset = request.args.get("offset", default=0, type=int)
+
+    if sort not in SEARCH_SORTS:
+        app.logger.warning("Invalid search sort")
+        return jsonify({"success": False, "error": "Invalid sort"}), 400
+
+    if limit is None or not 0 < limit <= MAX_PAGE_SIZE or offset is None or offset < 0:
+        app.logger.warning("Invalid paging parameters")
+        return jsonify({"success": False, "error": "Invalid limit or offset"}), 400
+
+    page = transactions_service.search_transactions(filters, sort, offset, limit)
+    app.logger.info(f"Transaction search returned {len(page['rows'])} of {page['total']}")
+    return jsonify(page)
+
+@app.route("/transactions/export")
+@require_session_token
+def export_transactions():
+    export_format = request.args.get("format", "csv")
+    if export_format not in exports_service.export_formats():
+        app.logger.warning(f"Unsupported export format {export_format}")
+        return jsonify({"success": False, "error": "Unsupported export format"}), 400
+
+    filters, error = parse_transaction_filters(request.args)
+    if error:
+        app.logger.warning(error)
+        return jsonify({"success": False, "error": error}), 400
+
+    # The body is generated while it is sent, after this request's scoped
+    # connection has been released; the export reads from its own.
+    return Response(
+        exports_service.stream_export(filters, export_format),
+        mimetype=exports_service.MIMETYPES[export_format],
+        headers={"Content-Disposition": f"attachment; filename=transactions.{export_format}"}
+    )
 
 @app.route("/transaction/update/category", methods=["POST"])
 @require_session_token
 def assign_category():
-    data = request.get_json()
-    transaction_id = data.get("transaction_id")
-    category_id = data.get("category_id")
+    args, error = parse_category_assignment(json_object())
+    if error:
+        app.logger.warning(error)
+        return jsonify({"success": False, "error": error}), 400
+    transaction_id, category_id = args["transaction_id"], args["category_id"]
 
-    if not validation.validate_positive_int(transaction_id) or not validation.validate_positive_int(category_id):
-        app.logger.warning("Invalid transaction or category ID")
-        return jsonify({"success": False, "error": "Invalid transaction or category ID"}), 400
+    try:
+        updated = transactions_service.update_transaction_category(transaction_id, category_id)
+    except storage.MissingReference:
+        app.logger.warning(f"Category {category_id} does not exist")
+        return jsonify({"success": False, "error": "Category does not exist"}), 404
 
-    if not transactions_service.transaction_exists(transaction_id):
+    if updated is None:
         app.logger.warning(f"Transaction {transaction_id} does not exist")
         return jsonify({"success": False, "error": "Transaction does not exist"}), 404
 
+    app.logger.info(f"Transaction {transaction_id} category updated to {category_id}")
+    return "", 204
+
+@app.route("/transactions/recategorize", methods=["POST"])
+@require_session_token
+def recategorize_transactions():
+    """
+    Move many transactions to one category. The body names the target
+    category_id and either `ids` (a list of transaction ids) or `filter`
+    (the /transactions/get filters plus description and description_regex).
+    With "preview": true only the number of affected rows is returned.
+    """
+    data = json_object()
+    category_id = data.get("category_id")
+    ids = data.get("ids")
+    filter_args = data.get("filter")
+
+    if not validation.validate_positive_int(category_id):
+        app.logger.warning("Invalid category ID for bulk update")
+        return jsonify({"success": False, "error": "Invalid category ID"}), 400
+
+    if (ids is None) == (filter_args is None):
+        app.logger.warning("Bulk update needs exactly one of ids or filter")
+        return jsonify({"success": False, "error": "Provide either ids or filter"}), 400
+
+    if ids is not None:
+        if not isinstance(ids, list) or not 0 < len(ids) <= MAX_BULK_IDS \
+                or not all(validation.validate_positive_int(i) for i in ids):
+            app.logger.warning("Invalid transaction IDs for bulk update")
+            return jsonify({"success": False, "error": f"ids must be 1 to {MAX_BULK_IDS} transaction IDs"}), 400
+        filters = {"ids": ids}
+    else:
+        if not isinstance(filter_args, dict):
+            return jsonify({"success": False, "error": "Invalid filter"}), 400
+        filters, error = parse_transaction_filters(
+            {key: str(value) for key, value in filter_args.items() if value is not None}
+        )
+        if error:
+            app.logger.warning(error)
+            return jsonify({"success": False, "error": error}), 400
+        if not filters:
+            app.logger.warning("Empty filter for bulk update")
+            return jsonify({"success": False, "error": "Filter matches every transaction"}), 400
+
     if not categories_service.category_exists(category_id):
         app.logger.warning(f"Category {category_id} does not exist")
         return jsonify({"success": False, "error": "Category does not exist"}), 404
 
-    transactions_service.update_transaction_category(transaction_id, category_id)
-    app.logger.info(f"Transaction {transaction_id} category updated to {category_id}")
-    return "", 204
+    if data.get("preview"):
+        count = transactions_service.recategorize_transactions(filters, category_id, dry_run=True)
+        return jsonify({"success": True, "count": count})
+
+    try:
+        updated = transactions_service.recategorize_transactions(filters, category_id)
+    except storage.MissingReference:
+        app.logger.warning(f"Category {category_id} does not exist")
+        return jsonify({"success": False, "error": "Category does not exist"}), 404
+
+    app.logger.info(f"{updated} transactions moved to category {category_id}")
+    return jsonify({"success": True, "updated": updated})
 
 @app.route("/transaction/update/description", methods=["POST"])
 @require_session_token
 def update_description():
-    data = request.get_json()
-    transaction_id = data.get("id")
-    description = data.get("description")
-
-    if not validation.validate_positive_int(transaction_id) or not validation.sanitize_string(description, 500):
+    args, error = parse_description_update(json_object())
+    if error:
         app.logger.warning("Invalid transaction ID or description")
-        return jsonify({"success": False, "error": "Invalid input"}), 400
+        return jsonify({"success": False, "error": error}), 400
+    transaction_id, description = args["transaction_id"], args["description"]
 
-    if not transactions_service.transaction_exists(transaction_id):
+    if transactions_service.update_transaction_description(transaction_id, description) is None:
         app.logger.warning(f"Transaction {transaction_id} does not exist")
         return jsonify({"success": False, "error": "Transaction does not exist"}), 404
 
-    transactions_service.update_transaction_description(transaction_id, description)
     app.logger.info(f"Transaction {transaction_id} description updated")
     return "", 204
 
 @app.route("/transaction/add", methods=["POST"])
 @require_session_token
 def add_transaction():
-    data = request.get_json()
+    data = json_object()
     amount = data.get("amount")
     description = data.get("description")
     transaction_date = data.get("transaction_date")
@@ -172,23 +549,37 @@ def add_transaction():
         app.logger.warning("Invalid account type")
         return jsonify({"success": False, "error": "Invalid account type"}), 400
 
-    if category is not None and not validation.validate_id(category):
+    # The form's select sends the category ID as a string.
+    if isinstance(category, str) and category.isdigit():
+        category = int(category)
+    if category is None:
+        category = categories_service.DEFAULT_CATEGORY_ID
+    elif not validation.validate_positive_int(category):
         app.logger.warning("Invalid category ID")
         return jsonify({"success": False, "error": "Invalid category"}), 400
 
-    new_id = transactions_service.add_transaction(data)
-    transaction = transactions_service.get_transaction(new_id)
-    app.logger.info(f"Transaction added with ID {new_id}")
+    try:
+        transaction = transactions_service.add_transaction({
+            "amount": amount,
+            "description": description,
+            "transaction_date": transaction_date,
+            "account_type": account_type,
+            "category": category
+        })
+    except storage.MissingReference:
+        app.logger.warning(f"Category {category} does not exist")
+        return jsonify({"success": False, "error": "Category does not exist"}), 404
+
+    app.logger.info(f"Transaction added with ID {transaction['id']}")
     return jsonify(transaction)
 
 @app.route("/transaction/delete/<int:transaction_id>", methods=["DELETE"])
 @require_session_token
 def delete_transaction(transaction_id):
-    if not transactions_service.transaction_exists(transaction_id):
+    if not transactions_service.delete_transaction(transaction_id):
         app.logger.warning(f"Transaction {transaction_id} does not exist")
         return jsonify({"success": False, "error": "Transaction does not exist"}), 404
 
-    transactions_service.delete_transaction(transaction_id)
     app.logger.info(f"Transaction {transaction_id} deleted")
     return "", 204
 
@@ -201,6 +592,7 @@ def clear_transactions():
 
 @app.route("/transactions/get/months", methods=["GET"])
 @require_session_token
+@cache.cached_response("transactions")
 def get_transaction_months():
     months = transactions_service.get_transaction_months()
     app.logger.info("Transaction months retrieved")
@@ -211,64 +603,83 @@ def get_transaction_months():
 @app.route("/categories/add", methods=["POST"])
 @require_session_token
 def add_category():
-    data = request.get_json()
-    name = data.get("name")
-    parent_id = data.get("parent_id")
-
-    if not validation.sanitize_string(name):
-        app.logger.warning("Invalid category name")
-        return jsonify({"success": False, "error": "Invalid category name"}), 400
-
-    if parent_id is not None and not validation.validate_positive_int(parent_id):
-        app.logger.warning("Invalid parent category ID")
-        return jsonify({"success": False, "error": "Invalid parent ID"}), 400
+    args, error = parse_new_category(json_object())
+    if error:
+        app.logger.warning(error)
+        return jsonify({"success": False, "error": error}), 400
+    name, parent_id = args["name"], args["parent_id"]
 
-    if parent_id and not categories_service.category_exists(parent_id):
+    try:
+        categories_service.add_category(name, parent_id)
+    except storage.MissingReference:
         app.logger.warning(f"Parent category {parent_id} does not exist")
         return jsonify({"success": False, "error": "Parent category does not exist"}), 404
 
-    categories_service.add_category(name, parent_id)
     app.logger.info(f"Category '{name}' added with parent {parent_id}")
     return "", 204
 
 @app.route("/categories/delete/<int:category_id>", methods=["DELETE"])
 @require_session_token
 def delete_category(category_id):
-    if not categories_service.category_exists(category_id):
+    _, error = parse_category_delete({"category_id": category_id})
+    if error:
+        app.logger.warning(error)
+        return jsonify({"success": False, "error": error}), 400
+
+    if not categories_service.delete_category(category_id):
         app.logger.warning(f"Category {category_id} does not exist")
         return jsonify({"success": False, "error": "Category does not exist"}), 404
 
-    categories_service.delete_category(category_id)
     app.logger.info(f"Category {category_id} deleted")
     return "", 204
 
 @app.route("/categories/update", methods=["POST"])
 @require_session_token
 def update_category():
-    data = request.get_json()
-    category_id = data.get("id")
-    new_name = data.get("new_name")
-
-    if not validation.validate_positive_int(category_id) or not validation.sanitize_string(new_name):
+    args, error = parse_category_rename(json_object())
+    if error:
         app.logger.warning("Invalid category ID or name")
-        return jsonify({"success": False, "error": "Invalid input"}), 400
+        return jsonify({"success": False, "error": error}), 400
+    category_id, new_name = args["category_id"], args["new_name"]
 
-    if not categories_service.category_exists(category_id):
+    if categories_service.update_category_name(category_id, new_name) is None:
         app.logger.warning(f"Category {category_id} does not exist")
         return jsonify({"success": False, "error": "Category does not exist"}), 404
 
-    categories_service.update_category_name(category_id, new_name)
     app.logger.info(f"Category {category_id} renamed to '{new_name}'")
     return "", 204
 
+@app.route("/categories/move", methods=["POST"])
+@require_session_token
+def move_category():
+    args, error = parse_category_move(json_object())
+    if error:
+        app.logger.warning(error)
+        return jsonify({"success": False, "error": error}), 400
+    category_id, parent_id = args["category_id"], args["parent_id"]
+
+    try:
+        moved = categories_service.move_category(category_id, parent_id)
+    except storage.MissingReference:
+        app.logger.warning(f"Parent category {parent_id} does not exist")
+        return jsonify({"success": False, "error": "Parent category does not exist"}), 404
+    except categories_service.CategoryCycle:
+        app.logger.warning(f"Category {category_id} can't move below itself")
+        return jsonify({"success": False, "error": "A category can't be moved below itself"}), 400
+    if moved is None:
+        app.logger.warning(f"Category {category_id} does not exist")
+        return jsonify({"success": False, "error": "Category does not exist"}), 404
+
+    app.logger.info(f"Category {category_id} moved under {parent_id}")
+    return "", 204
+
 @app.route("/categories/toggle_include/<int:category_id>", methods=["POST"])
 @require_session_token
 def toggle_include_in_budget(category_id):
-    if not categories_service.category_exists(category_id):
+    if categories_service.toggle_include_in_budget(category_id) is None:
         app.logger.warning(f"Category {category_id} does not exist")
         return jsonify({"success": False, "error": "Category does not exist"}), 404
 
-    categories_service.toggle_include_in_budget(category_id)
     app.logger.info(f"Category {category_id} include_in_budget toggled")
     return "", 204
 
@@ -277,28 +688,222 @@ def toggle_include_in_budget(category_id):
 @app.route("/budget/update", methods=["POST"])
 @require_session_token
 def update_budget():
-    data = request.get_json()
-    category_id = data.get("category_id")
-    amount = data.get("amount")
-
-    if not validation.validate_positive_int(category_id) or not validation.validate_number(amount):
+    args, error = parse_budget_update(json_object())
+    if error:
         app.logger.warning("Invalid budget input")
-        return jsonify({"success": False, "error": "Invalid input"}), 400
+        return jsonify({"success": False, "error": error}), 400
+    category_id, amount = args["category_id"], args["amount"]
 
-    if not categories_service.category_exists(category_id):
+    try:
+        budgets_service.update_budget(category_id, amount)
+    except storage.MissingReference:
         app.logger.warning(f"Category {category_id} does not exist")
         return jsonify({"success": False, "error": "Category does not exist"}), 404
 
-    budgets_service.update_budget(category_id, amount)
     app.logger.info(f"Budget for category {category_id} updated to {amount}")
     return "", 204
 
+@app.route("/budget/history")
+@require_session_token
+@cache.cached_response("transactions", "categories", "budgets")
+def get_budget_history():
+    end_month = request.args.get("end")
+    months = request.args.get("months", default=12, type=int)
+
+    if end_month and not validation.validate_month(end_month):
+        app.logger.warning("Invalid budget history end month")
+        return jsonify({"success": False, "error": "Invalid end month"}), 400
+
+    if months is None or not 1 <= months <= 60:
+        app.logger.warning("Invalid budget history length")
+        return jsonify({"success": False, "error": "Invalid number of months"}), 400
+
+    history = budgets_service.get_budget_history(end_month, months)
+    app.logger.info("Budget history retrieved")
+    return jsonify(history)
+
+# ---------------- Batch ----------------
+
+MAX_BATCH_OPERATIONS = 1000
+
+class BatchOperationFailed(Exception):
+    """Raised inside a batch to roll all of it back."""
+
+    def __init__(self, index, error):
+        super().__init__(error)
+        self.index = index
+        self.error = error
+
+def _batch_assign_category(args, uow):
+    return transactions_service.update_transaction_category(args["transaction_id"], args["category_id"], uow)
+
+def _batch_update_description(args, uow):
+    return transactions_service.update_transaction_description(args["transaction_id"], args["description"], uow)
+
+def _batch_delete_transaction(args, uow):
+    if transactions_service.delete_transaction(args["transaction_id"], uow):
+        return {"id": args["transaction_id"]}
+    return None
+
+def _batch_add_category(args, uow):
+    return categories_service.add_category(args["name"], args["parent_id"], uow)
+
+def _batch_delete_category(args, uow):
+    if categories_service.delete_category(args["category_id"], uow):
+        return {"id": args["category_id"]}
+    return None
+
+def _batch_update_category(args, uow):
+    return categories_service.update_category_name(args["category_id"], args["new_name"], uow)
+
+def _batch_move_category(args, uow):
+    return categories_service.move_category(args["category_id"], args["parent_id"], uow)
+
+def _batch_toggle_include(args, uow):
+    return categories_service.toggle_include_in_budget(args["category_id"], uow)
+
+def _batch_update_budget(args, uow):
+    return budgets_service.update_budget(args["category_id"], args["amount"], uow)
+
+# Endpoint -> (parse, apply, error when the target row doesn't exist). Path
+# arguments such as category_id are merged into the body before parsing.
+BATCH_OPERATIONS = {
+    "assign_category": (parse_category_assignment, _batch_assign_category, "Transaction does not exist"),
+    "update_description": (parse_description_update, _batch_update_description, "Transaction does not exist"),
+    "delete_transaction": (lambda data: (data, None), _batch_delete_transaction, "Transaction does not exist"),
+    "add_category": (parse_new_category, _batch_add_category, None),
+    "delete_category": (parse_category_delete, _batch_delete_category, "Category does not exist"),
+    "update_category": (parse_category_rename, _batch_update_category, "Category does not exist"),
+    "move_category": (parse_category_move, _batch_move_category, "Category does not exist"),
+    "toggle_include_in_budget": (lambda data: (data, None), _batch_toggle_include, "Category does not exist"),
+    "update_budget": (parse_budget_update, _batch_update_budget, None),
+}
+
+def parse_batch_operation(operation, urls):
+    """Resolve one batch entry to (apply, args, missing_error), or (None, error)."""
+    if not isinstance(operation, dict) or not isinstance(operation.get("path"), str):
+        return None, "Each operation needs a path"
+    method = operation.get("method", "POST")
+    if not isinstance(method, str):
+        return None, "Invalid method"
+    body = operation.get("body") or {}
+    if not isinstance(body, dict):
+        return None, "Invalid body"
+
+    try:
+        endpoint, path_args = urls.match(operation["path"], method=method.upper())
+    except HTTPException:
+        endpoint = None
+    if endpoint not in BATCH_OPERATIONS:
+        return None, "Unsupported operation"
+
+    parse, apply, missing = BATCH_OPERATIONS[endpoint]
+    args, error = parse({**body, **path_args})
+    if error:
+        return None, error
+    return (apply, args, missing), None
+
+@app.route("/batch", methods=["POST"])
+@require_session_token
+def batch():
+    """
+    Apply an ordered list of writes as one atomic command for the writer. Each operation is
+    {"method": "POST", "path": "/budget/update", "body": {...}}, with the
+    method (default POST), path and body the single endpoint takes. All of
+    them are validated before any is applied and if one fails none are.
+    Returns each operation's resulting row, in order; on failure, the index
+    of the operation that failed.
+    """
+    operations = json_object().get("operations")
+    if not isinstance(operations, list) or not 0 < len(operations) <= MAX_BATCH_OPERATIONS:
+        app.logger.warning("Invalid batch")
+        return jsonify({
+            "success": False, "error": f"operations must be a list of 1 to {MAX_BATCH_OPERATIONS} operations"
+        }), 400
+
+    urls = app.url_map.bind("localhost")
+    planned = []
+    for index, operation in enumerate(operations):
+        step, error = parse_batch_operation(operation, urls)
+        if error:
+            app.logger.warning(f"Invalid batch operation {index}: {error}")
+            return jsonify({"success": False, "error": error, "index": index}), 400
+        planned.append(step)
+
+    def apply_all(uow):
+        results = []
+        for index, (apply, args, missing) in enumerate(planned):
+            try:
+                result = apply(args, uow)
+            except storage.MissingReference:
+                result, missing = None, "Category does not exist"
+            except categories_service.CategoryCycle:
+                result, missing = None, "A category can't be moved below itself"
+            if result is None:
+                raise BatchOperationFailed(index, missing)
+            results.append(result)
+        return results
+
+    try:
+        results = writer.run(apply_all)
+    except BatchOperationFailed as e:
+        app.logger.warning(f"Batch operation {e.index} failed: {e.error}")
+        return jsonify({"success": False, "error": e.error, "index": e.index}), 404
+
+    app.logger.info(f"Batch of {len(results)} operations applied")
+    return jsonify({"success": True, "results": results})
+
+# ---------------- Changes ----------------
+
+def parse_change_version(value):
+    """A client's change log version, or None unless it is a non-negative integer."""
+    try:
+        version = int(value)
+    except (TypeError, ValueError):
+        return None
+    return version if version >= 0 else None
+
+@app.route("/changes")
+@require_session_token
+@compression.compressed
+def get_changes():
+    since = parse_change_version(request.args.get("since"))
+    if since is None:
+        app.logger.warning("Invalid change version")
+        return jsonify({"success": False, "error": "Invalid version"}), 400
+
+    try:
+        feed = changes_service.get_changes(since, cursor=request.args.get("cursor"))
+    except ValueError:
+        app.logger.warning("Invalid changes cursor")
+        return jsonify({"success": False, "error": "Invalid cursor"}), 400
+    app.logger.info(f"{len(feed['changes'])} changes since version {since} retrieved")
+    return jsonify({"success": True, **feed})
+
+@app.route("/changes/stream")
+@require_session_token
+def stream_changes():
+    # A reconnecting client resumes from the last event it received.
+    since = parse_change_version(request.headers.get("Last-Event-ID") or request.args.get("since"))
+    if since is None:
+        app.logger.warning("Invalid change version")
+        return jsonify({"success": False, "error": "Invalid version"}), 400
+
+    app.logger.info(f"Change stream opened at version {since}")
+    return Response(
+        changes_service.stream_changes(since),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 # ---------------- Graphs & Summaries ----------------
 
-@app.route("/graphs/get/monthly", methods=["POST"])
+@app.route("/graphs/get/monthly", methods=["GET", "POST"])
 @require_session_token
+@cache.cached_response("transactions", "categories")
 def get_graph_data():
-    data = request.get_json()
+    # GET lets the browser revalidate with ETags; POST is kept for older clients.
+    data = json_object() if request.method == "POST" else request.args
     month_filter = data.get("month")
 
     if month_filter and not validation.sanitize_string(month_filter, 10):
@@ -311,11 +916,66 @@ def get_graph_data():
 
 @app.route("/graphs/get/summary")
 @require_session_token
+@cache.cached_response("transactions")
 def get_income_expense():
-    summary = graphs_service.get_income_expense_summary()
+    periods = request.args.get("periods", default=12, type=int)
+    granularity = request.args.get("granularity", "month")
+
+    if granularity not in graphs_service.SUMMARY_GRANULARITIES:
+        app.logger.warning("Invalid summary granularity")
+        return jsonify({"success": False, "error": "Invalid granularity"}), 400
+
+    if periods is None or not 1 <= periods <= graphs_service.MAX_SUMMARY_PERIODS:
+        app.logger.warning("Invalid summary length")
+        return jsonify({"success": False, "error": "Invalid number of periods"}), 400
+
+    summary = graphs_service.get_income_expense_summary(periods, granularity)
     app.logger.info("Income/expense summary retrieved")
     return jsonify(summary)
 
+# ---------------- Categorization Rules ----------------
+
+@app.route("/rules", methods=["GET"])
+@require_session_token
+def get_rules():
+    rules = rules_service.get_rules()
+    app.logger.info("Categorization rules retrieved")
+    return jsonify(rules)
+
+@app.route("/rules/add", methods=["POST"])
+@require_session_token
+def add_rule():
+    rule, error = parse_rule(json_object())
+    if error:
+        app.logger.warning(f"Invalid rule: {error}")
+        return jsonify({"success": False, "error": error}), 400
+
+    try:
+        rule_id = rules_service.add_rule(rule)
+    except storage.MissingReference:
+        app.logger.warning(f"Category {rule['category_id']} does not exist")
+        return jsonify({"success": False, "error": "Category does not exist"}), 404
+
+    app.logger.info(f"Categorization rule {rule_id} added for category {rule['category_id']}")
+    return jsonify({"success": True, "id": rule_id})
+
+@app.route("/rules/delete/<int:rule_id>", methods=["DELETE"])
+@require_session_token
+def delete_rule(rule_id):
+    if not rules_service.delete_rule(rule_id):
+        app.logger.warning(f"Rule {rule_id} does not exist")
+        return jsonify({"success": False, "error": "Rule does not exist"}), 404
+
+    app.logger.info(f"Categorization rule {rule_id} deleted")
+    return "", 204
+
+@app.route("/rules/apply", methods=["POST"])
+@require_session_token
+def apply_rules():
+    checked, updated = rules_service.apply_rules_to_uncategorized()
+    app.logger.info(f"Rules applied: {updated} of {checked} uncategorized transactions updated")
+    return jsonify({"success": True, "checked": checked, "updated": updated})
+
 # ---------------- Uploads ----------------
 @app.route("/upload", methods=["POST"])
 @require_session_token
@@ -329,50 +989,26 @@ def upload():
             return jsonify({"success": False, "error": "Invalid file type"}), 400
 
         try:
-            df = uploads_service.parse_uploaded_csv(file)
-        except Exception as e:
-            app.logger.warning(f"CSV parsing failed: {e}")
-            return jsonify({"success": False, "error": "Invalid CSV format"}), 400
-
-        if df.empty:
-            return jsonify({"success": False, "error": "CSV is empty or invalid"}), 400
-
-        invalid_rows = []
-        for _, row in df.iterrows():
-            date_obj = row["transaction_date"]
-            amount = str(row["amount"]).strip()
-
-            if pd.isna(date_obj):
-                app.logger.warning(f"Missing or invalid date: {row.to_dict()}")
-                invalid_rows.append(row.to_dict())
-                continue
-
-            date_str = date_obj.strftime("%m/%d/%Y")
+            job_id = upload_jobs_service.submit_upload(file)
+        except upload_jobs_service.UploadQueueFull:
+            app.logger.warning("Upload rejected: job queue is full")
+            return jsonify({"success": False, "error": "Too many uploads in progress, try again shortly"}), 503
 
-            if not validation.validate_date(date_str):
-                app.logger.warning(f"Date failed validation: {row.to_dict()}")
-                invalid_rows.append(row.to_dict())
-                continue
-
-            if not validation.validate_number(amount):
-                app.logger.warning(f"Amount failed validation: {row.to_dict()}")
-                invalid_rows.append(row.to_dict())
-
-        if invalid_rows:
-            return jsonify({"success": False, "error": "Invalid data in CSV"}), 400
-
-        # Format date for DB insert
-        df["transaction_date"] = df["transaction_date"].dt.strftime("%Y-%m-%d")
-
-        inserted_count = uploads_service.insert_unique_transactions(df)
-        app.logger.info(f"Inserted {inserted_count} new transactions")
-
-        return jsonify({"success": True, "inserted": inserted_count})
+        app.logger.info(f"Upload job {job_id} queued for {file.filename}")
+        return jsonify({"success": True, "job_id": job_id}), 202
 
     except Exception as e:
         app.logger.error(f"Error processing CSV: {e}", exc_info=True)
         return jsonify({"success": False, "error": "Internal server error"}), 500
 
+@app.route("/upload/status/<job_id>")
+@require_session_token
+def upload_status(job_id):
+    job = upload_jobs_service.get_job_status(job_id)
+    if job is None:
+        return jsonify({"success": False, "error": "Upload job not found"}), 404
+    return jsonify({"success": True, **job})
+
 # ---------------- Settings ----------------
 
 @app.route("/settings")
@@ -383,10 +1019,48 @@ def settings():
 
 # ---------------- Jinja Helpers ----------------
 
-def has_children(categories, parent_id):
-    return any(c['parent_id'] == parent_id for c in categories)
-
-app.jinja_env.globals.update(has_children=has_children)
+def has_children(category_id):
+    return categories_service.get_tree().has_children(category_id)
+
+def category_children(category_id):
+    return categories_service.get_tree().child_nodes(category_id)
+
+def categories_in_tree_order():
+    return categories_service.get_tree().walk()
+
+def group_by_parent(rows):
+    """Map parent_id -> rows, so templates can look up children directly."""
+    groups = {}
+    for row in rows:
+        groups.setdefault(row["parent_id"], []).append(row)
+    return groups
+
+app.jinja_env.globals.update(
+    has_children=has_children,
+    category_children=category_children,
+    categories_in_tree_order=categories_in_tree_order,
+    group_by_parent=group_by_parent
+)
+
+# ---------------- CLI Commands ----------------
+
+@app.cli.command("rebuild-aggregates")
+def rebuild_aggregates_command():
+    """Recompute summary tables, the category closure and the search index from their sources."""
+    setup_service.initialize_database()
+    for table, count in setup_service.rebuild_aggregates().items():
+        print(f"Rebuilt {table} ({count} rows)")
+
+@app.cli.command("check-aggregates")
+def check_aggregates_command():
+    """Report summary, closure and search index rows that disagree with their source tables."""
+    setup_service.initialize_database()
+    mismatches = setup_service.check_aggregates()
+    for row in mismatches:
+        print(row)
+    print(f"{len(mismatches)} mismatched rows")
+    if mismatches:
+        sys.exit(1)
 
 # ---------------- Run ----------------
 
@@ -0,0 +1,146 @@
+import os
+import pickle
+import hashlib
+import logging
+import secrets
+import threading
+from functools import wraps
+from collections import OrderedDict
+from flask import request, make_response
+
+CACHE_MAX_BYTES = int(os.environ.get("CACHE_MAX_BYTES", 32 * 1024 * 1024))
+
+logger = logging.getLogger(__name__)
+
+# Data versions are per process and start at zero, so ETags also carry a
+# per-process epoch; a browser's tag from before a restart never matches.
+_EPOCH = secrets.token_hex(4)
+_versions = {}
+_versions_lock = threading.Lock()
+_versions_bumped = threading.Condition(_versions_lock)
+
+
+def bump(*tables):
+    """Mark tables as changed. Call after the write has been committed."""
+    with _versions_lock:
+        for table in tables:
+            _versions[table] = _versions.get(table, 0) + 1
+        _versions_bumped.notify_all()
+    logger.debug(f"Data version bumped for {', '.join(tables)}")
+
+
+def versions(*tables):
+    with _versions_lock:
+        return tuple(_versions.get(table, 0) for table in tables)
+
+
+def wait_for_bump(seen, *tables, timeout=None):
+    """Wait until versions(*tables) differs from `seen` or timeout passes; returns the versions."""
+    def current():
+        return tuple(_versions.get(table, 0) for table in tables)
+
+    with _versions_bumped:
+        _versions_bumped.wait_for(lambda: current() != seen, timeout)
+        return current()
+
+
+class LRUCache:
+    """Thread-safe LRU of (version, value) entries, bounded by total size in bytes."""
+
+    def __init__(self, max_bytes=CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version:
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, version, value, size):
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= old[2]
+            self._entries[key] = (version, value, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= evicted[2]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+store = LRUCache()
+
+
+def _request_key():
+    args = "&".join(f"{k}={v}" for k, v in sorted(request.args.items(multi=True)))
+    # Accept-Encoding is part of the key since responses may be compressed.
+    encoding = request.headers.get("Accept-Encoding", "")
+    return f"{request.method} {request.path}?{args}|{encoding}|{request.get_data(as_text=True)}"
+
+
+def _etag(key, version):
+    return hashlib.blake2b(f"{_EPOCH}|{key}|{version}".encode(), digest_size=16).hexdigest()
+
+
+def cached_response(*tables):
+    """Cache a view's 200 responses until one of `tables` changes; ETags allow 304s without running it."""
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            key = _request_key()
+            version = versions(*tables)
+            etag = _etag(key, version)
+
+            if etag in request.if_none_match:
+                response = make_response("", 304)
+            else:
+                cached = store.get(key, version)
+                if cached is not None:
+                    body, mimetype, headers = cached
+                    response = make_response(body)
+                    response.mimetype = mimetype
+                    response.headers.update(headers)
+                else:
+                    response = make_response(f(*args, **kwargs))
+                    if response.status_code != 200:
+                        return response
+                    body = response.get_data()
+                    headers = {h: response.headers[h] for h in ("Content-Encoding", "Vary") if h in response.headers}
+                    store.put(key, version, (body, response.mimetype, headers), len(body))
+
+            response.set_etag(etag)
+            response.headers["Cache-Control"] = "private, no-cache"
+            return response
+        return decorated
+    return decorator
+
+
+def memoized(*tables):
+    """Cache f(*args) until one of `tables` changes. Treat the result as read-only."""
+    def decorator(f):
+        name = f"{f.__module__}.{f.__qualname__}"
+
+        @wraps(f)
+        def decorated(*args):
+            key = (name, args)
+            version = versions(*tables)
+            cached = store.get(key, version)
+            if cached is not None:
+                return cached
+            value = f(*args)
+            store.put(key, version, value, len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL)))
+            return value
+        return decorated
+    return decorator
@@ -0,0 +1,200 @@
+import json
+import logging
+import threading
+import numpy as np
+from storage import get_connection
+
+LOAD_BATCH_SIZE = 50000
+
+logger = logging.getLogger(__name__)
+
+# Rows without a parseable date or an amount are left out, as they are from
+# monthly_category_totals. Days count from 1970-01-01.
+_SELECT = '''
+    SELECT id, CAST(julianday(transaction_date) - 2440587.5 AS INTEGER) AS day,
+           amount, IFNULL(category, 0) AS category, IFNULL(account_type, '') AS account_type
+    FROM transactions
+    WHERE {condition} AND amount IS NOT NULL AND julianday(transaction_date) IS NOT NULL
+'''
+
+
+def day_number(value):
+    """Date, datetime or 'YYYY-MM-DD' -> days since 1970-01-01."""
+    return int(np.datetime64(str(value)[:10], "D").astype(np.int64))
+
+
+def day_label(day):
+    return str(np.datetime64(int(day), "D"))
+
+
+class TransactionColumns:
+    """
+    Read-only NumPy copy of the transaction columns analytics need, in date order.
+    Amounts are cents, days count from 1970-01-01, category is 0 when unset
+    and account indexes into `accounts`.
+    """
+
+    def __init__(self, id, day, amount, category, account, accounts, max_id):
+        self.id = id
+        self.day = day
+        self.amount = amount
+        self.category = category
+        self.account = account
+        self.accounts = accounts
+        self.max_id = max_id
+
+        # Running income and expense totals in row order (length n + 1), so
+        # the total over rows [lo, hi) is total[hi] - total[lo].
+        self.income_total = np.concatenate(([0], np.cumsum(np.where(amount > 0, amount, 0))))
+        self.expense_total = np.concatenate(([0], np.cumsum(np.where(amount < 0, amount, 0))))
+
+    def __len__(self):
+        return len(self.id)
+
+    def latest_day(self):
+        return int(self.day[-1]) if len(self) else None
+
+    def income_expenses(self, boundaries):
+        """Income and expenses (cents) between consecutive day `boundaries`, and the net before the first."""
+        positions = np.searchsorted(self.day, np.asarray(boundaries, dtype=self.day.dtype))
+        income = np.diff(self.income_total[positions])
+        expenses = np.diff(self.expense_total[positions])
+        opening = int(self.income_total[positions[0]] + self.expense_total[positions[0]])
+        return income, expenses, opening
+
+
+def _read_rows(conn, condition, params):
+    """Rows matching condition as (ids, days, amounts, categories, account types)."""
+    columns = [[] for _ in range(5)]
+    cursor = conn.cursor()
+    cursor.row_factory = None  # plain tuples; Row objects cost more to build
+    cursor.execute(_SELECT.format(condition=condition), params)
+    while True:
+        rows = cursor.fetchmany(LOAD_BATCH_SIZE)
+        if not rows:
+            break
+        for column, values in zip(columns, zip(*rows)):
+            column.extend(values)
+
+    ids, days, amounts, categories, accounts = columns
+    return (
+        np.array(ids, dtype=np.int64),
+        np.array(days, dtype=np.int32),
+        np.array(amounts, dtype=np.int64),
+        np.array(categories, dtype=np.int32),
+        accounts
+    )
+
+
+def _encode_accounts(values, accounts):
+    """Dictionary-encode account types, extending a copy of `accounts`."""
+    accounts = list(accounts)
+    codes = {name: code for code, name in enumerate(accounts)}
+    for name in set(values) - codes.keys():
+        codes[name] = len(accounts)
+        accounts.append(name)
+    return np.fromiter(map(codes.__getitem__, values), dtype=np.int32, count=len(values)), accounts
+
+
+def _load():
+    conn = get_connection()
+    try:
+        max_id = conn.execute("SELECT IFNULL(MAX(id), 0) FROM transactions").fetchone()[0]
+        ids, days, amounts, categories, account_types = _read_rows(conn, "id <= ?", (max_id,))
+    finally:
+        conn.close()
+
+    order = np.argsort(days, kind="stable")
+    codes, names = _encode_accounts(account_types, [])
+    logger.info(f"Loaded {len(ids)} transactions into the columnar store")
+    return TransactionColumns(
+        ids[order], days[order], amounts[order], categories[order], codes[order], names, max_id
+    )
+
+
+def _sync(columns, changed):
+    """New columns with rows added since columns.max_id and the `changed` ids re-read."""
+    changed = [i for i in changed if i <= columns.max_id]
+    conn = get_connection()
+    try:
+        max_id = conn.execute("SELECT IFNULL(MAX(id), 0) FROM transactions").fetchone()[0]
+        ids, days, amounts, categories, account_types = _read_rows(conn, "id > ? AND id <= ?", (columns.max_id, max_id))
+        if changed:
+            reread = _read_rows(conn, "id IN (SELECT value FROM json_each(?))", (json.dumps(changed),))
+            ids, days, amounts, categories = (
+                np.concatenate(pair) for pair in zip((ids, days, amounts, categories), reread[:4])
+            )
+            account_types = account_types + reread[4]
+    finally:
+        conn.close()
+
+    keep = ~np.isin(columns.id, changed) if changed else slice(None)
+    base_day = columns.day[keep]
+
+    # Each new row goes after the rows already stored for its day.
+    order = np.argsort(days, kind="stable")
+    positions = np.searchsorted(base_day, days[order], side="right")
+    codes, names = _encode_accounts(account_types, columns.accounts)
+
+    logger.debug(f"Columnar store synced: {len(ids)} rows added or updated, {len(changed)} re-read")
+    return TransactionColumns(
+        np.insert(columns.id[keep], positions, ids[order]),
+        np.insert(base_day, positions, days[order]),
+        np.insert(columns.amount[keep], positions, amounts[order]),
+        np.insert(columns.category[keep], positions, categories[order]),
+        np.insert(columns.account[keep], positions, codes[order]),
+        names,
+        max_id
+    )
+
+
+_columns = None
+_changed = set()
+_stale = False
+_reload = False
+_changes_lock = threading.Lock()
+_sync_lock = threading.Lock()
+
+
+def mark_changed(ids=()):
+    """Record committed writes; `ids` of updated or deleted rows (inserts are found by id)."""
+    global _stale
+    with _changes_lock:
+        _stale = True
+        _changed.update(int(i) for i in ids)
+
+
+def reset():
+    """Discard the store after a bulk rewrite; it reloads on the next snapshot()."""
+    global _stale, _reload
+    with _changes_lock:
+        _stale = _reload = True
+        _changed.clear()
+
+
+def snapshot():
+    """The current TransactionColumns, loaded on first use. Treat as read-only."""
+    global _columns, _stale, _reload
+    columns = _columns
+    if columns is not None and not _stale:
+        return columns
+
+    with _sync_lock:
+        with _changes_lock:
+            changed, reload = set(_changed), _reload
+            _changed.clear()
+            _stale = _reload = False
+
+        try:
+            if _columns is None or reload:
+                _columns = _load()
+            else:
+                _columns = _sync(_columns, changed)
+        except Exception:
+            # Put the work back so the next call retries it.
+            with _changes_lock:
+                _changed.update(changed)
+                _stale = True
+                _reload = _reload or reload
+            raise
+        return _columns
@@ -0,0 +1,49 @@
+import gzip
+import logging
+from functools import wraps
+from flask import request, make_response
+
+try:
+    import brotli
+except ImportError:  # optional; gzip is always available
+    brotli = None
+
+MIN_COMPRESS_BYTES = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+logger = logging.getLogger(__name__)
+
+
+def _encoders():
+    encoders = {"gzip": lambda body: gzip.compress(body, compresslevel=GZIP_LEVEL)}
+    if brotli is not None:
+        encoders["br"] = lambda body: brotli.compress(body, quality=BROTLI_QUALITY)
+    return encoders
+
+
+def compressed(f):
+    """Compress a view's response with the best encoding the client accepts."""
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        response = make_response(f(*args, **kwargs))
+        response.vary.add("Accept-Encoding")
+
+        if response.status_code != 200 or response.direct_passthrough or "Content-Encoding" in response.headers:
+            return response
+
+        body = response.get_data()
+        if len(body) < MIN_COMPRESS_BYTES:
+            return response
+
+        encoders = _encoders()
+        # Prefer brotli when the client rates it as highly as gzip.
+        encoding = request.accept_encodings.best_match(sorted(encoders, key=lambda e: e != "br"))
+        if encoding is None:
+            return response
+
+        response.set_data(encoders[encoding](body))
+        response.headers["Content-Encoding"] = encoding
+        logger.debug(f"Compressed {len(body)} bytes to {response.content_length} with {encoding}")
+        return response
+    return decorated
@@ -1,16 +1,70 @@
 import pandas as pd
+import re
+import hashlib
 import logging
+import json
+import time
+from functools import wraps
 from storage import get_connection
+from writer import writer
+import cache
+import columnar
 
 logger = logging.getLogger(__name__)
 
+def to_cents(amount):
+    """Convert a dollar amount (number or numeric string) to integer cents."""
+    return int(round(float(amount) * 100))
+
+def _normalize_text(value):
+    if value is None or value != value:  # None or NaN
+        return ""
+    return " ".join(str(value).split()).upper()
+
+def fingerprint_base(account_type, transaction_date, description, amount):
+    """
+    Hash of a transaction's normalized identity (account type, ISO date,
+    description and amount in cents), without its occurrence ordinal.
+    """
+    key = "\x1f".join((
+        _normalize_text(account_type),
+        transaction_date or "",
+        _normalize_text(description),
+        str(int(amount)) if amount is not None else ""
+    ))
+    return hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+
+def make_fingerprint(base, ordinal):
+    """The nth (0-based) occurrence of an identical transaction gets ordinal n."""
+    return f"{base}:{ordinal}"
+
+# Sortable columns for paginated transaction queries. Expressions are
+# COALESCEd so keyset comparisons never have to deal with NULLs.
+TRANSACTION_SORT_COLUMNS = {
+    "transaction_date": "COALESCE(t.transaction_date, '')",
+    "amount": "COALESCE(t.amount, 0)",
+    "description": "COALESCE(t.description, '')",
+    "account_type": "COALESCE(t.account_type, '')",
+    "category": "COALESCE(c.name, '')",
+}
+
+# Relevance weights for transactions_fts columns: description, account
+# type, category name. bm25() scores are negative; lower is better.
+SEARCH_WEIGHTS = (4.0, 1.0, 2.0)
+
+_SEARCH_TERMS = re.compile(r'"([^"]*)"|([^\W_]+)')
+_SEARCH_WORDS = re.compile(r"[^\W_]+")
+
+# Imported transactions land here until assigned.
+DEFAULT_CATEGORY_ID = 1
+
 # ---------------- Transactions ----------------
 
 def get_all_transactions():
     conn = get_connection()
     df = pd.read_sql_query('''
         SELECT t.id, t.account_type, t.transaction_date, t.description,
-               t.amount, t.category, c.name AS category_name
+               t.amount / 100.0 AS amount, t.category, c.name AS category_name
         FROM transactions t
         LEFT JOIN categories c ON t.category = c.id
         ORDER BY t.transaction_date DESC
@@ -19,113 +73,356 @@ def get_all_transactions():
     logger.debug("Retrieved all transactions")
     return df
 
-def update_transaction_category(transaction_id, category_id):
-    conn = get_connection()
-    conn.execute("UPDATE transactions SET category = ? WHERE id = ?", (category_id, transaction_id))
-    conn.commit()
-    conn.close()
-    logger.info(f"Transaction {transaction_id} category updated to {category_id}")
+def build_search_query(text):
+    """
+    Turn free text into an FTS5 query. Quoted phrases match as phrases and
+    every other word as a prefix; all terms must match. Anything that is not
+    a letter or digit is dropped, so user input can never be FTS5 syntax.
+    Returns None when no terms remain.
+    """
+    terms = []
+    for phrase, word in _SEARCH_TERMS.findall(text or ""):
+        if word:
+            terms.append(f'"{word}"*')
+        elif _SEARCH_WORDS.search(phrase):
+            terms.append('"' + " ".join(_SEARCH_WORDS.findall(phrase)) + '"')
+    return " ".join(terms) or None
 
-def update_transaction_description(transaction_id, description):
-    conn = get_connection()
-    conn.execute("UPDATE transactions SET description = ? WHERE id = ?", (description, transaction_id))
-    conn.commit()
-    conn.close()
-    logger.info(f"Transaction {transaction_id} description updated")
+def build_transaction_filters(filters):
+    """Translate a filters dict into a WHERE clause and its parameters."""
+    clauses = []
+    params = []
 
-def insert_transaction(data):
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO transactions (account_type, transaction_date, description, amount, category)
-        VALUES (?, ?, ?, ?, ?)
-    ''', (
-        data["account_type"],
-        data["transaction_date"],
-        data["description"],
-        data["amount"],
-        data["category"]
-    ))
-    conn.commit()
-    new_id = cursor.lastrowid
-    conn.close()
-    logger.info(f"Transaction inserted with ID {new_id}")
-    return new_id
+    if filters.get("start_date"):
+        clauses.append("t.transaction_date >= ?")
+        params.append(filters["start_date"])
+    if filters.get("end_date"):
+        clauses.append("t.transaction_date < ?")
+        params.append(filters["end_date"])
+    if filters.get("category") is not None:
+        clauses.append("t.category = ?")
+        params.append(filters["category"])
+    if filters.get("account_type"):
+        clauses.append("t.account_type = ?")
+        params.append(filters["account_type"])
+    if filters.get("min_amount") is not None:
+        clauses.append("t.amount >= ?")
+        params.append(to_cents(filters["min_amount"]))
+    if filters.get("max_amount") is not None:
+        clauses.append("t.amount <= ?")
+        params.append(to_cents(filters["max_amount"]))
+    if filters.get("description"):
+        clauses.append("instr(lower(t.description), lower(?)) > 0")
+        params.append(filters["description"])
+    if filters.get("description_regex"):
+        clauses.append("t.description REGEXP ?")
+        params.append(filters["description_regex"])
+    if filters.get("ids"):
+        clauses.append("t.id IN (SELECT value FROM json_each(?))")
+        params.append(json.dumps(filters["ids"]))
+    if filters.get("search"):
+        search = build_search_query(filters["search"])
+        if search:
+            clauses.append("t.id IN (SELECT rowid FROM transactions_fts WHERE transactions_fts MATCH ?)")
+            params.append(search)
+        else:
+            clauses.append("0 = 1")  # nothing searchable, e.g. only punctuation
+
+    where = " AND ".join(clauses) if clauses else "1 = 1"
+    return where, params
+
+def get_transactions_page(filters, sort="transaction_date", order="desc", cursor=None, offset=0, limit=50):
+    """
+    Fetch one page of transactions. When a cursor (sort value, id) is given the
+    page starts right after it (keyset paging); otherwise offset is used.
+    """
+    sort_expr = TRANSACTION_SORT_COLUMNS[sort]
+    direction = "DESC" if order == "desc" else "ASC"
+    comparison = "<" if order == "desc" else ">"
+
+    where, params = build_transaction_filters(filters)
+    if cursor is not None:
+        where += f" AND ({sort_expr}, t.id) {comparison} (?, ?)"
+        params.extend(cursor)
+        offset = 0
 
-def get_transaction_by_id(transaction_id):
     conn = get_connection()
-    df = pd.read_sql_query('''
-        SELECT t.id, t.transaction_date, t.account_type,
-               t.description AS description, t.amount, c.name AS category_name
+    df = pd.read_sql_query(f'''
+        SELECT t.id, t.account_type, t.transaction_date, t.description,
+               t.amount / 100.0 AS amount, t.category, c.name AS category_name,
+               {sort_expr} AS sort_value
         FROM transactions t
         LEFT JOIN categories c ON t.category = c.id
-        WHERE t.id = ?
-    ''', conn, params=(transaction_id,))
+        WHERE {where}
+        ORDER BY {sort_expr} {direction}, t.id {direction}
+        LIMIT ? OFFSET ?
+    ''', conn, params=(*params, limit, offset))
     conn.close()
+    logger.debug(f"Retrieved transactions page (sort={sort} {order}, limit={limit})")
+    return df
 
-    if df.empty:
-        logger.warning(f"Transaction {transaction_id} not found")
-        return {}
-    logger.debug(f"Transaction {transaction_id} retrieved")
-    return df.iloc[0].to_dict()
+def search_transactions(filters, sort="relevance", offset=0, limit=50):
+    """
+    Fetch one page of transactions matching filters["search"] through the
+    full-text index, best match first (or newest first with sort="date").
+    """
+    query = build_search_query(filters.get("search"))
+    if query is None:
+        return pd.DataFrame(columns=[
+            "id", "account_type", "transaction_date", "description", "amount", "category", "category_name"
+        ])
 
-def delete_transaction_by_id(transaction_id):
-    conn = get_connection()
-    conn.execute("DELETE FROM transactions WHERE id = ?", (transaction_id,))
-    conn.commit()
-    conn.close()
-    logger.info(f"Transaction {transaction_id} deleted")
+    where, params = build_transaction_filters({k: v for k, v in filters.items() if k != "search"})
+    order_by = "score, t.id DESC" if sort == "relevance" else "t.transaction_date DESC, t.id DESC"
+    weights = ", ".join(str(weight) for weight in SEARCH_WEIGHTS)
 
-def clear_all_transactions():
     conn = get_connection()
-    conn.execute("DELETE FROM transactions")
-    conn.commit()
+    df = pd.read_sql_query(f'''
+        SELECT t.id, t.account_type, t.transaction_date, t.description,
+               t.amount / 100.0 AS amount, t.category, c.name AS category_name,
+               bm25(transactions_fts, {weights}) AS score
+        FROM transactions_fts
+        JOIN transactions t ON t.id = transactions_fts.rowid
+        LEFT JOIN categories c ON t.category = c.id
+        WHERE transactions_fts MATCH ? AND {where}
+        ORDER BY {order_by}
+        LIMIT ? OFFSET ?
+    ''', conn, params=(query, *params, limit, offset))
     conn.close()
-    logger.info("All transactions cleared")
+    logger.debug(f"Searched transactions for {query!r} ({len(df)} rows)")
+    return df.drop(columns=["score"])
 
-def get_all_transaction_months():
+def get_transactions_summary(filters):
+    """Count and total the transactions matching the filters."""
+    where, params = build_transaction_filters(filters)
     conn = get_connection()
-    df = pd.read_sql_query("SELECT transaction_date FROM transactions", conn)
+    row = conn.execute(f'''
+        SELECT COUNT(*) AS total, IFNULL(SUM(t.amount), 0) / 100.0 AS amount
+        FROM transactions t
+        LEFT JOIN categories c ON t.category = c.id
+        WHERE {where}
+    ''', params).fetchone()
     conn.close()
-    logger.debug("Retrieved all transaction months")
-    return df
+    logger.debug("Retrieved transactions summary")
+    return {"total": row["total"], "amount": round(row["amount"], 2)}
 
-def get_most_recent_transaction_month():
+def get_transaction_months():
+    """Every month with transactions, newest first, with its count and first and last date."""
     conn = get_connection()
-    df = pd.read_sql_query('''
-        SELECT strftime('%Y-%m', MAX(transaction_date)) AS latest_month
-        FROM transactions
-    ''', conn)
+    rows = conn.execute('''
+        SELECT year_month AS month, count, first_date, last_date
+        FROM transaction_months
+        ORDER BY year_month DESC
+    ''').fetchall()
     conn.close()
-    month = df.iloc[0]["latest_month"] if not df.empty else None
-    logger.debug(f"Most recent transaction month: {month}")
-    return month
+    logger.debug("Retrieved transaction months")
+    return [dict(row) for row in rows]
 
-def get_existing_transaction_records():
+# Column order of rows yielded by iter_transactions.
+EXPORT_COLUMNS = ("id", "transaction_date", "account_type", "description", "amount", "category", "category_name")
+
+def iter_transactions(filters, batch_size):
+    """
+    Yield the transactions matching filters, oldest first, as lists of at
+    most batch_size rows in EXPORT_COLUMNS order (amount in cents), read from
+    a single cursor. The connection is held until the generator is exhausted
+    or closed.
+    """
+    where, params = build_transaction_filters(filters)
     conn = get_connection()
     try:
-        df = pd.read_sql_query('''
-            SELECT account_type, transaction_date, description, amount 
-            FROM transactions
-        ''', conn)
-        logger.debug("Existing transaction records retrieved")
-    except Exception as e:
-        df = pd.DataFrame()
-        logger.error(f"Error retrieving existing transaction records: {e}", exc_info=True)
-    conn.close()
-    return df
+        cursor = conn.execute(f'''
+            SELECT t.id, t.transaction_date, t.account_type, t.description,
+                   t.amount, t.category, c.name AS category_name
+            FROM transactions t
+            LEFT JOIN categories c ON t.category = c.id
+            WHERE {where}
+            ORDER BY t.transaction_date, t.id
+        ''', params)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield rows
+    finally:
+        conn.close()
+
+def write_command(f):
+    """Run the decorated write on the writer thread, or in the given `uow` if there is one."""
+    @wraps(f)
+    def decorated(*args, uow=None, **kwargs):
+        if uow is not None:
+            return f(*args, uow=uow, **kwargs)
+        return writer.run(lambda unit: f(*args, uow=unit, **kwargs))
+    return decorated
+
+def _log_changes(uow, table, operation, ids):
+    """Append one change_log entry per row id, as part of uow's write."""
+    ids = [int(i) for i in ids]
+    if ids:
+        uow.execute(
+            "INSERT INTO change_log (table_name, row_id, operation) SELECT ?, value, ? FROM json_each(?)",
+            (table, operation, json.dumps(ids))
+        )
+
+def _transactions_changed(uow, operation, ids):
+    """Log the change; after commit, mark the columnar store stale before bumping the version."""
+    ids = list(ids)
+    _log_changes(uow, "transactions", operation, ids)
+    changed = ids if operation != "insert" else []
+    uow.after_commit(lambda: (columnar.mark_changed(changed), cache.bump("transactions")))
+
+@write_command
+def update_transaction_category(transaction_id, category_id, uow=None):
+    """
+    Returns the updated row ({id, category}), or None if the transaction
+    doesn't exist. Raises MissingReference if the category doesn't.
+    """
+    row = uow.execute(
+        "UPDATE transactions SET category = ? WHERE id = ? RETURNING id, category",
+        (category_id, transaction_id)
+    ).fetchone()
+    if row is None:
+        logger.warning(f"Transaction {transaction_id} not found")
+        return None
+    _transactions_changed(uow, "update", [transaction_id])
+    logger.info(f"Transaction {transaction_id} category updated to {category_id}")
+    return dict(row)
+
+@write_command
+def update_transaction_description(transaction_id, description, uow=None):
+    """Returns the updated row ({id, description}), or None if the transaction doesn't exist."""
+    row = uow.execute(
+        "UPDATE transactions SET description = ? WHERE id = ? RETURNING id, description",
+        (description, transaction_id)
+    ).fetchone()
+    if row is None:
+        logger.warning(f"Transaction {transaction_id} not found")
+        return None
+    _transactions_changed(uow, "update", [transaction_id])
+    logger.info(f"Transaction {transaction_id} description updated")
+    return dict(row)
+
+def recategorize_transactions(filters, category_id, dry_run=False):
+    """
+    Move every transaction matching the filters into category_id. Rows
+    already in that category are left alone. Returns how many rows changed
+    (or would change, with dry_run).
 
-def transaction_exists(transaction_id):
+    The matching ids are selected on a read connection first, so filters
+    such as description_regex run outside the writer; the write itself is a
+    single UPDATE by id.
+    """
+    where, params = build_transaction_filters(filters)
     conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT 1 FROM transactions WHERE id = ?", (transaction_id,))
-    exists = cursor.fetchone() is not None
+    ids = [row[0] for row in conn.execute(f'''
+        SELECT t.id FROM transactions t
+        LEFT JOIN categories c ON t.category = c.id
+        WHERE {where} AND t.category IS NOT ?
+    ''', (*params, category_id)).fetchall()]
     conn.close()
-    logger.debug(f"Transaction {transaction_id} existence check: {exists}")
-    return exists
+
+    if dry_run:
+        logger.debug(f"{len(ids)} transactions would move to category {category_id}")
+        return len(ids)
+
+    def move(uow):
+        moved = [row[0] for row in uow.execute('''
+            UPDATE transactions SET category = ?
+            WHERE id IN (SELECT value FROM json_each(?)) AND category IS NOT ?
+            RETURNING id
+        ''', (category_id, json.dumps(ids), category_id)).fetchall()]
+        _transactions_changed(uow, "update", moved)
+        return moved
+
+    moved = writer.run(move) if ids else []
+    logger.info(f"{len(moved)} transactions moved to category {category_id}")
+    return len(moved)
+
+def next_free_fingerprint(conn, base):
+    """Fingerprint with the lowest ordinal not yet used for this base."""
+    rows = conn.execute(
+        "SELECT fingerprint FROM transactions WHERE fingerprint >= ? AND fingerprint < ?",
+        (f"{base}:", f"{base};")
+    ).fetchall()
+    used = {int(row[0].rsplit(":", 1)[1]) for row in rows}
+    ordinal = 0
+    while ordinal in used:
+        ordinal += 1
+    return make_fingerprint(base, ordinal)
+
+@write_command
+def insert_transaction(data, uow=None):
+    """
+    Insert one transaction and return it as stored, amount in dollars and
+    with its category_name. Raises MissingReference for an unknown category.
+    """
+    amount = to_cents(data["amount"])
+    base = fingerprint_base(data["account_type"], data["transaction_date"], data["description"], amount)
+    row = uow.execute('''
+        INSERT INTO transactions (account_type, transaction_date, description, amount, category, fingerprint)
+        VALUES (?, ?, ?, ?, ?, ?)
+        RETURNING id, transaction_date, account_type, description, amount / 100.0 AS amount, category,
+                  (SELECT name FROM categories WHERE id = transactions.category) AS category_name
+    ''', (
+        data["account_type"],
+        data["transaction_date"],
+        data["description"],
+        amount,
+        data["category"],
+        next_free_fingerprint(uow.conn, base)
+    )).fetchone()
+    _transactions_changed(uow, "insert", [row["id"]])
+    logger.info(f"Transaction inserted with ID {row['id']}")
+    return dict(row)
+
+@write_command
+def delete_transaction_by_id(transaction_id, uow=None):
+    """Returns False if there was no such transaction."""
+    if uow.execute("DELETE FROM transactions WHERE id = ? RETURNING id", (transaction_id,)).fetchone() is None:
+        logger.warning(f"Transaction {transaction_id} not found")
+        return False
+    _transactions_changed(uow, "delete", [transaction_id])
+    logger.info(f"Transaction {transaction_id} deleted")
+    return True
+
+@write_command
+def clear_all_transactions(uow=None):
+    """Logged as a single 'reset' change, which sends every client to reload."""
+    uow.execute("DELETE FROM transactions")
+    uow.execute("DELETE FROM change_log WHERE table_name = 'transactions'")
+    uow.execute("INSERT INTO change_log (table_name, row_id, operation) VALUES ('transactions', 0, 'reset')")
+    uow.after_commit(lambda: (columnar.reset(), cache.bump("transactions")))
+    logger.info("All transactions cleared")
+
+@write_command
+def insert_transactions(df, uow=None):
+    """
+    Insert a DataFrame of fingerprinted transactions. Rows whose fingerprint
+    already exists are skipped; returns the number actually inserted.
+    """
+    columns = ["account_type", "transaction_date", "description", "amount", "category", "fingerprint"]
+    rows = df[columns].astype(object).where(df[columns].notna(), None).values.tolist()
+    # One statement for the whole frame: inside the writer's savepoint every
+    # statement gets its own journal, and FTS5 flushes its index at each one.
+    inserted = uow.execute('''
+        INSERT INTO transactions (account_type, transaction_date, description, amount, category, fingerprint)
+        SELECT json_extract(value, '$[0]'), json_extract(value, '$[1]'), json_extract(value, '$[2]'),
+               json_extract(value, '$[3]'), json_extract(value, '$[4]'), json_extract(value, '$[5]')
+        FROM json_each(?)
+        WHERE true
+        ON CONFLICT (fingerprint) DO NOTHING
+        RETURNING id
+    ''', (json.dumps(rows),)).fetchall()
+    _transactions_changed(uow, "insert", (row[0] for row in inserted))
+    logger.debug(f"Inserted {len(inserted)} of {len(df)} transactions")
+    return len(inserted)
 
 # ---------------- Categories ----------------
 
+class CategoryCycle(Exception):
+    """Raised when a category would be moved below itself."""
+
 def get_all_categories():
     conn = get_connection()
     df = pd.read_sql_query("SELECT id, name, parent_id, include_in_budget FROM categories", conn)
@@ -133,40 +430,106 @@ def get_all_categories():
     logger.debug("Retrieved all categories")
     return df
 
-def insert_category(name, parent_id=None):
-    conn = get_connection()
-    conn.execute('''
+@write_command
+def insert_category(name, parent_id=None, uow=None):
+    """
+    Returns the new row ({id, name, parent_id}). Raises MissingReference if
+    the parent doesn't exist.
+    """
+    row = uow.execute('''
         INSERT INTO categories (name, parent_id, include_in_budget)
         VALUES (?, ?, ?)
-    ''', (name, parent_id, 1))
-    conn.commit()
-    conn.close()
+        RETURNING id, name, parent_id
+    ''', (name, parent_id, 1)).fetchone()
+    _log_changes(uow, "categories", "insert", [row["id"]])
+    uow.after_commit(lambda: cache.bump("categories"))
     logger.info(f"Category '{name}' inserted with parent {parent_id}")
+    return dict(row)
 
-def delete_category(category_id):
-    conn = get_connection()
-    conn.execute("DELETE FROM categories WHERE id = ?", (category_id,))
-    conn.commit()
-    conn.close()
-    logger.info(f"Category {category_id} deleted")
+@write_command
+def delete_category(category_id, uow=None):
+    """
+    Delete a category in one transaction: its subcategories become top
+    level, its transactions move to the default category and its budget and
+    rules are removed. Returns False if there was no such category.
+    """
+    children = [row[0] for row in uow.execute(
+        "UPDATE categories SET parent_id = NULL WHERE parent_id = ? RETURNING id", (category_id,)
+    ).fetchall()]
+    moved = [row[0] for row in uow.execute(
+        "UPDATE transactions SET category = ? WHERE category = ? RETURNING id", (DEFAULT_CATEGORY_ID, category_id)
+    ).fetchall()]
+    budgets = [row[0] for row in uow.execute(
+        "DELETE FROM budgets WHERE category_id = ? RETURNING category_id", (category_id,)
+    ).fetchall()]
+    uow.execute("DELETE FROM categorization_rules WHERE category_id = ?", (category_id,))
+    if uow.execute("DELETE FROM categories WHERE id = ? RETURNING id", (category_id,)).fetchone() is None:
+        logger.warning(f"Category {category_id} not found")
+        return False
 
-def update_category_name(category_id, new_name):
-    conn = get_connection()
-    conn.execute("UPDATE categories SET name = ? WHERE id = ?", (new_name, category_id))
-    conn.commit()
-    conn.close()
+    _log_changes(uow, "categories", "update", children)
+    _log_changes(uow, "categories", "delete", [category_id])
+    _log_changes(uow, "budgets", "delete", budgets)
+    uow.after_commit(lambda: cache.bump("categories", "budgets", "rules"))
+    if moved:
+        _transactions_changed(uow, "update", moved)
+    logger.info(f"Category {category_id} deleted, {len(moved)} transactions moved to the default category")
+    return True
+
+@write_command
+def update_category_parent(category_id, parent_id, uow=None):
+    """
+    Move a category, with everything below it, under parent_id (top level
+    when None); the closure triggers re-link its subtree. Returns the updated
+    row ({id, parent_id}), or None if the category doesn't exist. Raises
+    MissingReference if the parent doesn't exist and CategoryCycle if it is
+    the category itself or one of its subcategories.
+    """
+    if parent_id is not None and uow.execute(
+        "SELECT 1 FROM category_closure WHERE ancestor = ? AND descendant = ?", (category_id, parent_id)
+    ).fetchone():
+        raise CategoryCycle(f"Category {parent_id} is inside category {category_id}")
+    row = uow.execute(
+        "UPDATE categories SET parent_id = ? WHERE id = ? RETURNING id, parent_id", (parent_id, category_id)
+    ).fetchone()
+    if row is None:
+        logger.warning(f"Category {category_id} not found")
+        return None
+    _log_changes(uow, "categories", "update", [category_id])
+    uow.after_commit(lambda: cache.bump("categories"))
+    logger.info(f"Category {category_id} moved under {parent_id}")
+    return dict(row)
+
+@write_command
+def update_category_name(category_id, new_name, uow=None):
+    """Returns the updated row ({id, name}), or None if the category doesn't exist."""
+    row = uow.execute(
+        "UPDATE categories SET name = ? WHERE id = ? RETURNING id, name", (new_name, category_id)
+    ).fetchone()
+    if row is None:
+        logger.warning(f"Category {category_id} not found")
+        return None
+    _log_changes(uow, "categories", "update", [category_id])
+    uow.after_commit(lambda: cache.bump("categories"))
     logger.info(f"Category {category_id} renamed to '{new_name}'")
+    return dict(row)
 
-def toggle_include_in_budget(category_id):
-    conn = get_connection()
-    conn.execute("""
+@write_command
+def toggle_include_in_budget(category_id, uow=None):
+    """Returns the updated row ({id, include_in_budget}), or None if the category doesn't exist."""
+    row = uow.execute("""
         UPDATE categories
         SET include_in_budget = CASE WHEN include_in_budget = 1 THEN 0 ELSE 1 END
         WHERE id = ?
-    """, (category_id,))
-    conn.commit()
-    conn.close()
+        RETURNING id, include_in_budget
+    """, (category_id,)).fetchone()
+    if row is None:
+        logger.warning(f"Category {category_id} not found")
+        return None
+    _log_changes(uow, "categories", "update", [category_id])
+    uow.after_commit(lambda: cache.bump("categories"))
     logger.info(f"Category {category_id} include_in_budget toggled")
+    return dict(row)
 
 def get_category(category_id):
     conn = get_connection()
@@ -184,67 +547,340 @@ def get_category(category_id):
 
 # ---------------- Budgets ----------------
 
-def update_budget_amount(category_id, amount):
-    conn = get_connection()
-    conn.execute('''
+@write_command
+def update_budget_amount(category_id, amount, uow=None):
+    """
+    Returns the stored row ({category_id, amount}). Raises MissingReference
+    if the category doesn't exist.
+    """
+    row = uow.execute('''
         INSERT INTO budgets (category_id, amount)
         VALUES (?, ?)
         ON CONFLICT(category_id) DO UPDATE SET amount = excluded.amount
-    ''', (category_id, amount))
-    conn.commit()
-    conn.close()
+        RETURNING category_id, amount
+    ''', (category_id, amount)).fetchone()
+    # Inserted or updated, it's the same to a client patching its view.
+    _log_changes(uow, "budgets", "update", [category_id])
+    uow.after_commit(lambda: cache.bump("budgets"))
     logger.info(f"Budget for category {category_id} updated to {amount}")
+    return dict(row)
 
-def get_budget_status(month):
+def get_budget_status(start_month, end_month=None):
+    """
+    Budget vs actual per category and month for months in [start_month, end_month].
+    `spent` is the category's own spending in cents; `rollup_spent` adds every
+    category below it, found through category_closure. `rollup_budget` sums
+    the budgets of the leaf categories below it. Categories without spending
+    in the range appear once with a NULL month. Every category is returned;
+    callers filter on include_in_budget.
+    """
     conn = get_connection()
-    query = '''
-        SELECT 
+    df = pd.read_sql_query('''
+        WITH spend AS (
+            SELECT category, year_month, SUM(ABS(total)) AS spent
+            FROM monthly_category_totals
+            WHERE year_month BETWEEN ? AND ?
+            GROUP BY category, year_month
+        ),
+        totals AS (
+            SELECT cl.ancestor AS category_id, s.year_month,
+                   SUM(CASE WHEN cl.depth = 0 THEN s.spent ELSE 0 END) AS own,
+                   SUM(s.spent) AS rollup
+            FROM spend s
+            JOIN category_closure cl ON cl.descendant = s.category
+            GROUP BY cl.ancestor, s.year_month
+        ),
+        leaf_budgets AS (
+            SELECT cl.ancestor AS category_id, SUM(b.amount) AS amount
+            FROM category_closure cl
+            JOIN budgets b ON b.category_id = cl.descendant
+            WHERE cl.depth > 0
+              AND NOT EXISTS (SELECT 1 FROM categories k WHERE k.parent_id = cl.descendant)
+            GROUP BY cl.ancestor
+        )
+        SELECT
             c.id AS category_id,
             c.name AS category,
             c.parent_id,
             IFNULL(b.amount, 0.00) AS budget,
-            IFNULL((
-                SELECT SUM(ABS(t.amount))
-                FROM transactions t
-                WHERE t.category = c.id
-                AND strftime('%Y-%m', t.transaction_date) = ?
-            ), 0.00) AS spent
+            IFNULL(lb.amount, 0.00) AS rollup_budget,
+            t.year_month AS month,
+            IFNULL(t.own, 0) AS spent,
+            IFNULL(t.rollup, 0) AS rollup_spent
         FROM categories c
-        LEFT JOIN categories p ON c.parent_id = p.id
         LEFT JOIN budgets b ON b.category_id = c.id
-        WHERE COALESCE(p.include_in_budget, c.include_in_budget) = 1
-    '''
-    df = pd.read_sql_query(query, conn, params=(month,))
+        LEFT JOIN leaf_budgets lb ON lb.category_id = c.id
+        LEFT JOIN totals t ON t.category_id = c.id
+        ORDER BY c.id, t.year_month
+    ''', conn, params=(start_month, end_month or start_month))
     conn.close()
-    logger.debug(f"Budget status retrieved for month {month}")
+    logger.debug(f"Budget status retrieved for {start_month} to {end_month or start_month}")
     return df
 
 # ---------------- Graphs & Summaries ----------------
 
-def get_graph_data_for_month():
+def get_graph_data_for_month(month=None):
+    """
+    Spending in cents for one month (or all months when month is None) per
+    top-level category, broken down by the subtree directly below it; a
+    top-level category's own spending is listed under its own name. Income
+    and expenses both count by absolute value.
+    """
     conn = get_connection()
     df = pd.read_sql_query('''
-        SELECT t.transaction_date, t.amount, c.name AS category_name,
-               c.id AS category_id, c.parent_id, p.name AS parent_name
-        FROM transactions t
-        LEFT JOIN categories c ON t.category = c.id
-        LEFT JOIN categories p ON c.parent_id = p.id
-        WHERE t.amount IS NOT NULL
+        WITH levels AS (
+            SELECT descendant AS id, MAX(depth) AS level
+            FROM category_closure
+            GROUP BY descendant
+        )
+        SELECT top.name AS top_category, sub.name AS category_name,
+               SUM(ABS(m.total)) AS amount
+        FROM monthly_category_totals m
+        JOIN levels lv ON lv.id = m.category
+        JOIN category_closure root ON root.descendant = m.category AND root.depth = lv.level
+        JOIN category_closure branch ON branch.descendant = m.category AND branch.depth = MAX(lv.level - 1, 0)
+        JOIN categories top ON top.id = root.ancestor
+        JOIN categories sub ON sub.id = branch.ancestor
+        WHERE ? IS NULL OR m.year_month = ?
+        GROUP BY top_category, category_name
+        ORDER BY top_category, category_name
+    ''', conn, params=(month, month))
+    conn.close()
+    logger.debug(f"Graph data retrieved for {month or 'all months'}")
+    return df
+
+def get_monthly_income_expenses():
+    """Income and expenses (cents) per month with transactions, oldest first, from monthly_category_totals."""
+    conn = get_connection()
+    df = pd.read_sql_query('''
+        SELECT year_month,
+               SUM(CASE WHEN sign > 0 THEN total ELSE 0 END) AS income,
+               SUM(CASE WHEN sign < 0 THEN total ELSE 0 END) AS expenses
+        FROM monthly_category_totals
+        GROUP BY year_month
+        ORDER BY year_month
     ''', conn)
     conn.close()
-    logger.debug("Graph data retrieved")
+    logger.debug("Monthly income and expenses retrieved")
     return df
 
-def get_available_months():
+# ---------------- Categorization Rules ----------------
+
+def get_all_rules():
     conn = get_connection()
-    df = pd.read_sql_query("SELECT transaction_date FROM transactions", conn)
+    df = pd.read_sql_query('''
+        SELECT id, category_id, priority, pattern, is_regex, account_type, min_amount, max_amount
+        FROM categorization_rules
+        ORDER BY priority DESC, id
+    ''', conn)
     conn.close()
-    logger.debug("Available months retrieved")
+    logger.debug("Retrieved categorization rules")
     return df
 
-def get_income_expense_by_month():
+@write_command
+def insert_rule(rule, uow=None):
+    cursor = uow.execute('''
+        INSERT INTO categorization_rules (category_id, priority, pattern, is_regex, account_type, min_amount, max_amount)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', (
+        rule["category_id"],
+        rule["priority"],
+        rule["pattern"],
+        int(rule["is_regex"]),
+        rule["account_type"],
+        None if rule["min_amount"] is None else to_cents(rule["min_amount"]),
+        None if rule["max_amount"] is None else to_cents(rule["max_amount"])
+    ))
+    uow.after_commit(lambda: cache.bump("rules"))
+    rule_id = cursor.lastrowid
+    logger.info(f"Categorization rule {rule_id} added for category {rule['category_id']}")
+    return rule_id
+
+@write_command
+def delete_rule(rule_id, uow=None):
+    cursor = uow.execute("DELETE FROM categorization_rules WHERE id = ?", (rule_id,))
+    uow.after_commit(lambda: cache.bump("rules"))
+    logger.info(f"Categorization rule {rule_id} deleted")
+    return cursor.rowcount > 0
+
+def get_transactions_in_category_batch(category_id, after_id, limit):
+    """Rows of one category with id > after_id, in id order, for batch processing."""
     conn = get_connection()
-    df = pd.read_sql_query("SELECT transaction_date, amount FROM transactions", conn)
+    df = pd.read_sql_query('''
+        SELECT id, account_type, description, amount, category
+        FROM transactions
+        WHERE category = ? AND id > ?
+        ORDER BY id
+        LIMIT ?
+    ''', conn, params=(category_id, after_id, limit))
     conn.close()
-    logger.debug("Income and expense by month retrieved")
     return df
+
+@write_command
+def set_transaction_categories(updates, uow=None):
+    """Apply (category, id) pairs with one statement (see insert_transactions)."""
+    uow.execute('''
+        UPDATE transactions SET category = json_extract(u.value, '$[0]')
+        FROM json_each(?) AS u
+        WHERE transactions.id = json_extract(u.value, '$[1]')
+    ''', (json.dumps(updates),))
+    _transactions_changed(uow, "update", (transaction_id for _, transaction_id in updates))
+    logger.debug(f"Updated categories of {len(updates)} transactions")
+
+# ---------------- Upload Jobs ----------------
+
+UPLOAD_JOB_FIELDS = (
+    "phase", "rows_processed", "inserted", "duplicates",
+    "error_count", "errors", "chunks_done", "message"
+)
+
+@write_command
+def insert_upload_job(job_id, filename, path, uow=None):
+    now = int(time.time())
+    uow.execute('''
+        INSERT INTO upload_jobs (id, filename, path, phase, created_at, updated_at)
+        VALUES (?, ?, ?, 'queued', ?, ?)
+    ''', (job_id, filename, path, now, now))
+    logger.info(f"Upload job {job_id} queued for {filename}")
+
+@write_command
+def update_upload_job(job_id, uow=None, **fields):
+    """Update job progress. Pass uow to write as part of the caller's work."""
+    unknown = set(fields) - set(UPLOAD_JOB_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown upload job fields: {', '.join(sorted(unknown))}")
+
+    if "errors" in fields:
+        fields["errors"] = json.dumps(fields["errors"])
+    fields["updated_at"] = int(time.time())
+
+    assignments = ", ".join(f"{name} = ?" for name in fields)
+    uow.execute(f"UPDATE upload_jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+    logger.debug(f"Upload job {job_id} updated: {fields.get('phase', 'progress')}")
+
+def get_upload_job(job_id):
+    conn = get_connection()
+    row = conn.execute("SELECT * FROM upload_jobs WHERE id = ?", (job_id,)).fetchone()
+    conn.close()
+
+    if not row:
+        logger.debug(f"Upload job {job_id} not found")
+        return None
+    job = dict(row)
+    job["errors"] = json.loads(job["errors"]) if job["errors"] else []
+    return job
+
+def get_unfinished_upload_jobs():
+    conn = get_connection()
+    rows = conn.execute('''
+        SELECT id, path, phase FROM upload_jobs
+        WHERE phase NOT IN ('completed', 'failed')
+        ORDER BY created_at
+    ''').fetchall()
+    conn.close()
+    return [dict(row) for row in rows]
+
+@write_command
+def delete_finished_upload_jobs(older_than, uow=None):
+    cursor = uow.execute('''
+        DELETE FROM upload_jobs
+        WHERE phase IN ('completed', 'failed') AND updated_at < ?
+    ''', (older_than,))
+    logger.debug(f"Removed {cursor.rowcount} finished upload jobs")
+
+# ---------------- Change Log ----------------
+
+# Current state of logged rows, keyed by their id (a budget's is its
+# category_id), for a JSON array of ids. Transactions come out as
+# /transactions/get returns them.
+CHANGE_ROW_QUERIES = {
+    "transactions": '''
+        SELECT t.id, t.account_type, t.transaction_date, t.description,
+               t.amount / 100.0 AS amount, t.category, c.name AS category_name
+        FROM transactions t
+        LEFT JOIN categories c ON t.category = c.id
+        WHERE t.id IN (SELECT value FROM json_each(?))
+    ''',
+    "categories": '''
+        SELECT id, name, parent_id, include_in_budget FROM categories
+        WHERE id IN (SELECT value FROM json_each(?))
+    ''',
+    "budgets": '''
+        SELECT category_id, amount FROM budgets
+        WHERE category_id IN (SELECT value FROM json_each(?))
+    '''
+}
+
+_CHANGE_LOG_VERSION = "SELECT IFNULL(MAX(seq), 0) FROM sqlite_sequence WHERE name = 'change_log'"
+
+def get_change_version():
+    """The newest change log version, kept even once its entry is compacted away."""
+    conn = get_connection()
+    version = conn.execute(_CHANGE_LOG_VERSION).fetchone()[0]
+    conn.close()
+    return version
+
+def get_changes(since, limit, upto=None, after=None):
+    """
+    (floor, version, entries): each row's latest change log entry in
+    (since, version], oldest first. version is `upto` when given (a client
+    paging through a fixed range), else the newest version. With `after`,
+    only entries past that version are returned: the next page.
+    """
+    conn = get_connection()
+    version = conn.execute(_CHANGE_LOG_VERSION).fetchone()[0] if upto is None else upto
+    entries = [dict(row) for row in conn.execute('''
+        SELECT c.version, c.table_name, c.row_id,
+               CASE WHEN c.operation = 'update' AND EXISTS (
+                   SELECT 1 FROM change_log i
+                   WHERE i.table_name = c.table_name AND i.row_id = c.row_id
+                     AND i.version > ? AND i.version < c.version AND i.operation = 'insert'
+               ) THEN 'insert' ELSE c.operation END AS operation
+        FROM change_log c
+        WHERE c.version > ? AND c.version <= ?
+          AND NOT EXISTS (
+              SELECT 1 FROM change_log later
+              WHERE later.table_name = c.table_name AND later.row_id = c.row_id
+                AND later.version > c.version AND later.version <= ?
+          )
+        ORDER BY c.version
+        LIMIT ?
+    ''', (since, since if after is None else after, version, version, limit)).fetchall()]
+    # Read after the entries, so a compaction running meanwhile is noticed.
+    floor = conn.execute("SELECT version FROM change_log_floor").fetchone()[0]
+    conn.close()
+    logger.debug(f"{len(entries)} changes since version {since}")
+    return floor, version, entries
+
+def get_rows_by_id(table, ids):
+    """Current rows of a logged table by id; ids of deleted rows are missing."""
+    conn = get_connection()
+    rows = conn.execute(CHANGE_ROW_QUERIES[table], (json.dumps(list(ids)),)).fetchall()
+    conn.close()
+    return {row[0]: dict(row) for row in rows}
+
+@write_command
+def compact_change_log(keep, uow=None):
+    """Keep only each row's latest entry, and at most the newest `keep`; returns the number removed."""
+    # An update that outlives its row's insert must still read as an insert.
+    uow.execute('''
+        UPDATE change_log SET operation = 'insert'
+        WHERE operation = 'update' AND EXISTS (
+            SELECT 1 FROM change_log AS earlier
+            WHERE earlier.table_name = change_log.table_name AND earlier.row_id = change_log.row_id
+              AND earlier.operation = 'insert' AND earlier.version < change_log.version
+        )
+    ''')
+    removed = uow.execute('''
+        DELETE FROM change_log WHERE version NOT IN (
+            SELECT MAX(version) FROM change_log GROUP BY table_name, row_id
+        )
+    ''').rowcount
+    cutoff = uow.execute(
+        "SELECT version FROM change_log ORDER BY version DESC LIMIT 1 OFFSET ?", (keep,)
+    ).fetchone()
+    if cutoff is not None:
+        removed += uow.execute("DELETE FROM change_log WHERE version <= ?", (cutoff[0],)).rowcount
+        uow.execute("UPDATE change_log_floor SET version = MAX(version, ?)", (cutoff[0],))
+    logger.info(f"Compacted the change log, {removed} entries removed")
+    return removed
@@ -1,20 +1,86 @@
 import db_queries
+import cache
 import pandas as pd
-import json
+import services.categories as categories_service
+import services.transactions as transactions_service
+from datetime import date
 
 
-def update_budget(category_id, amount):
+def update_budget(category_id, amount, uow=None):
     """Update the budget amount for a category."""
-    db_queries.update_budget_amount(category_id, amount)
+    return db_queries.update_budget_amount(category_id, amount, uow=uow)
+
+
+_NO_SPENDING = {"spent": 0.0, "rollup_spent": 0.0}
+
+
+def _dollars(cents):
+    return round(float(cents) / 100, 2)
+
+
+def _budget_rows(start_month, end_month):
+    """
+    db_queries.get_budget_status rows for budgeted categories, grouped by
+    category id, as ({category fields}, {month: {spent, rollup_spent}}).
+    """
+    df = db_queries.get_budget_status(start_month, end_month)
+    df = df[df["category_id"].isin(categories_service.get_tree().budgeted_ids())]
+
+    rows = {}
+    for row in df.itertuples(index=False):
+        if row.category_id not in rows:
+            rows[row.category_id] = ({
+                "category_id": int(row.category_id),
+                "category": row.category,
+                "parent_id": None if pd.isna(row.parent_id) else int(row.parent_id),
+                "budget": float(row.budget),
+                "rollup_budget": float(row.rollup_budget)
+            }, {})
+        if pd.notna(row.month):
+            rows[row.category_id][1][row.month] = {
+                "spent": _dollars(row.spent), "rollup_spent": _dollars(row.rollup_spent)
+            }
+    return list(rows.values())
 
 
 def get_budget_status(month):
     """Fetch the budget status for all categories for a given month."""
-    df = db_queries.get_budget_status(month)
+    return [{**fields, **spending.get(month, _NO_SPENDING)} for fields, spending in _budget_rows(month, month)]
+
+
+@cache.memoized("transactions", "categories", "budgets")
+def get_budget_page(month=None):
+    """
+    Everything the budget page needs: the months with transactions, the
+    selected month (latest if not given or unknown) and its budget status.
+    """
+    months = transactions_service.get_transaction_months()
+
+    if month not in months:
+        month = months[0] if months else None
+
+    return month, months, get_budget_status(month)
+
+
+def shift_month(month, offset):
+    """Return the YYYY-MM month `offset` months away from `month`."""
+    year, mon = map(int, month.split("-"))
+    index = year * 12 + (mon - 1) + offset
+    return f"{index // 12:04d}-{index % 12 + 1:02d}"
+
 
-    if df.empty:
-        return []
+def get_budget_history(end_month=None, months=12):
+    """Budget vs actual per category for each of the `months` months ending at end_month."""
+    if end_month is None:
+        end_month = transactions_service.get_most_recent_month() or date.today().strftime("%Y-%m")
+    start_month = shift_month(end_month, -(months - 1))
+    month_list = [shift_month(start_month, i) for i in range(months)]
 
-    df = df.where(pd.notnull(df), None)
-    return json.loads(df.to_json(orient='records'))
+    result = []
+    for fields, spending in _budget_rows(start_month, end_month):
+        result.append({
+            **fields,
+            "history": [{"month": m, **spending.get(m, _NO_SPENDING)} for m in month_list]
+        })
 
+    return {"months": month_list, "categories": result}
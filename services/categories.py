@@ -1,74 +1,174 @@
+import threading
 import pandas as pd
 import db_queries
+import cache
+
+# Transactions of a deleted category move here; it can't be deleted itself.
+DEFAULT_CATEGORY_ID = db_queries.DEFAULT_CATEGORY_ID
+CategoryCycle = db_queries.CategoryCycle
+
+
+class CategoryTree:
+    """
+    Read-only snapshot of the category hierarchy. Each node carries its depth
+    (0 for top level) and `budgeted`, the include_in_budget flag of its
+    top-level ancestor, which is what the budget page goes by.
+    """
+
+    def __init__(self, df, version=None):
+        self.version = version
+        self.nodes = {}
+        self.children = {}
+
+        for category_id, name, parent_id, include in df[["id", "name", "parent_id", "include_in_budget"]].itertuples(index=False):
+            self.nodes[int(category_id)] = {
+                "id": int(category_id),
+                "name": name,
+                "parent_id": None if pd.isna(parent_id) else int(parent_id),
+                "include_in_budget": None if pd.isna(include) else int(include)
+            }
+
+        for node in self.nodes.values():
+            if node["parent_id"] in self.nodes:
+                self.children.setdefault(node["parent_id"], []).append(node["id"])
+
+        # A category whose parent is missing (or part of a cycle) is treated as top level.
+        self.roots = [node["id"] for node in self.nodes.values() if node["parent_id"] not in self.nodes]
+        stack = [(root, 0, self.nodes[root]["include_in_budget"] == 1) for root in reversed(self.roots)]
+        while stack:
+            category_id, depth, budgeted = stack.pop()
+            node = self.nodes[category_id]
+            node["depth"] = depth
+            node["budgeted"] = budgeted
+            stack.extend((child, depth + 1, budgeted) for child in reversed(self.children.get(category_id, [])))
+        for node in self.nodes.values():
+            node.setdefault("depth", 0)
+            node.setdefault("budgeted", node["include_in_budget"] == 1)
+
+    def exists(self, category_id):
+        return category_id in self.nodes
+
+    def get(self, category_id):
+        return self.nodes.get(category_id)
+
+    def has_children(self, category_id):
+        return category_id in self.children
+
+    def child_nodes(self, category_id):
+        return [self.nodes[child] for child in self.children.get(category_id, [])]
+
+    def budgeted_ids(self):
+        return {category_id for category_id, node in self.nodes.items() if node["budgeted"]}
+
+    def descendants(self, category_id):
+        """Ids of every category below category_id, at any depth."""
+        found = []
+        stack = list(self.children.get(category_id, []))
+        while stack:
+            child = stack.pop()
+            found.append(child)
+            stack.extend(self.children.get(child, []))
+        return found
+
+    def path(self, category_id):
+        """Nodes from the top-level ancestor down to category_id; empty if unknown."""
+        node = self.nodes.get(category_id)
+        if node is None:
+            return []
+        path = [node]
+        for _ in range(node["depth"]):
+            node = self.nodes[node["parent_id"]]
+            path.append(node)
+        return path[::-1]
+
+    def walk(self):
+        """Every node, depth first, each parent before its subcategories."""
+        order = []
+        stack = list(reversed(self.roots))
+        while stack:
+            category_id = stack.pop()
+            order.append(self.nodes[category_id])
+            stack.extend(reversed(self.children.get(category_id, [])))
+        return order
+
+    def to_list(self):
+        return [
+            {key: node[key] for key in ("id", "name", "parent_id", "include_in_budget")}
+            for node in self.nodes.values()
+        ]
+
+    def to_nested(self):
+        def build(category_id):
+            node = self.nodes[category_id]
+            return {
+                "id": node["id"],
+                "name": node["name"],
+                "parent_id": node["parent_id"],
+                "subcategories": [build(child) for child in self.children.get(category_id, [])]
+            }
+        return [build(root) for root in self.roots]
+
+
+_tree = None
+_tree_lock = threading.Lock()
+
+
+def get_tree():
+    """
+    The process-wide CategoryTree, reloaded after any category write (the
+    "categories" data version in cache.py).
+    """
+    global _tree
+    version = cache.versions("categories")
+    tree = _tree
+    if tree is None or tree.version != version:
+        with _tree_lock:
+            if _tree is None or _tree.version != version:
+                _tree = CategoryTree(db_queries.get_all_categories(), version)
+            tree = _tree
+    return tree
 
 
 def get_categories():
     """Fetch all categories as a list of dictionaries."""
-    df = db_queries.get_all_categories()
-    
-    categories = []
-    for _, row in df.iterrows():
-        parent_id = None if pd.isna(row["parent_id"]) else int(row["parent_id"])
-        
-        categories.append({
-            "id": int(row["id"]),
-            "name": row["name"],
-            "parent_id": parent_id,
-            "include_in_budget": row["include_in_budget"]
-        })
-    
-    return categories
+    return get_tree().to_list()
 
-def get_categories_with_subcategories():
-    df = db_queries.get_all_categories()  # Returns a DataFrame
 
-    categories = []
-    id_to_cat = {}
+def get_categories_with_subcategories():
+    """Top-level categories, each with its subcategories nested below it."""
+    return get_tree().to_nested()
 
-    # Iterate over DataFrame rows
-    for _, row in df.iterrows():
-        cat = {
-            "id": row["id"],
-            "name": row["name"],
-            "parent_id": row["parent_id"],
-            "subcategories": []
-        }
-        id_to_cat[cat["id"]] = cat
-        if pd.isna(cat["parent_id"]):
-            categories.append(cat)
 
-    for _, row in df.iterrows():
-        if not pd.isna(row["parent_id"]):
-            parent = id_to_cat.get(row["parent_id"])
-            if parent:
-                child = {
-                    "id": row["id"],
-                    "name": row["name"],
-                    "parent_id": row["parent_id"]
-                }
-                parent["subcategories"].append(child)
+def add_category(name, parent_id=None, uow=None):
+    """Add a new category and return it."""
+    return db_queries.insert_category(name, parent_id, uow=uow)
 
-    return categories
 
+def delete_category(category_id, uow=None):
+    """
+    Delete a category by ID, moving its transactions to the default
+    category. False if there was no such category.
+    """
+    return db_queries.delete_category(category_id, uow=uow)
 
 
-def add_category(name, parent_id=None):
-    """Add a new category."""
-    db_queries.insert_category(name, parent_id)
+def move_category(category_id, parent_id, uow=None):
+    """
+    Move a category under parent_id, or to the top level when None; None if
+    there is no such category. Raises CategoryCycle if parent_id is
+    the category itself or below it.
+    """
+    return db_queries.update_category_parent(category_id, parent_id, uow=uow)
 
 
-def delete_category(category_id):
-    """Delete a category by ID."""
-    db_queries.delete_category(category_id)
+def update_category_name(category_id, new_name, uow=None):
+    """Rename a category; None if there is no such category."""
+    return db_queries.update_category_name(category_id, new_name, uow=uow)
 
 
-def update_category_name(category_id, new_name):
-    """Rename a category."""
-    db_queries.update_category_name(category_id, new_name)
-    
+def toggle_include_in_budget(category_id, uow=None):
+    return db_queries.toggle_include_in_budget(category_id, uow=uow)
 
-def toggle_include_in_budget(category_id):
-    db_queries.toggle_include_in_budget(category_id)
 
 def category_exists(category_id):
-    return db_queries.get_category(category_id) is not None
\ No newline at end of file
+    return get_tree().exists(category_id)
@@ -0,0 +1,116 @@
+import json
+import base64
+import time
+import logging
+import threading
+import db_queries
+import cache
+
+CHANGES_LIMIT = 1000
+CHANGE_LOG_RETAIN = 100000
+COMPACT_INTERVAL_SECONDS = 3600
+STREAM_HEARTBEAT_SECONDS = 15
+
+# Tables the change log covers; their cache versions are bumped after
+# every logged write, which is what the stream waits on.
+CHANGE_TABLES = ("transactions", "categories", "budgets")
+
+logger = logging.getLogger(__name__)
+
+_last_compaction = time.monotonic()
+_compaction_lock = threading.Lock()
+
+
+def current_version():
+    """The newest change log version; a client that loads everything now is synced to it."""
+    return db_queries.get_change_version()
+
+
+def compact(keep=CHANGE_LOG_RETAIN):
+    """Collapse the change log to one entry per row and keep the newest `keep`."""
+    global _last_compaction
+    with _compaction_lock:
+        _last_compaction = time.monotonic()
+    return db_queries.compact_change_log(keep)
+
+
+def _compact_if_due():
+    with _compaction_lock:
+        due = time.monotonic() - _last_compaction >= COMPACT_INTERVAL_SECONDS
+    if due:
+        compact()
+
+
+def encode_cursor(upto, after):
+    """Encode a position in a paged change feed as an opaque URL-safe string."""
+    return base64.urlsafe_b64encode(json.dumps([upto, after]).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor, since):
+    """(upto, after) from a cursor issued to a client at `since`. Raises ValueError if malformed."""
+    try:
+        upto, after = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except Exception as e:
+        raise ValueError("Invalid cursor") from e
+    if not all(type(value) is int for value in (upto, after)) or not since <= after < upto < 2**63:
+        raise ValueError("Invalid cursor")
+    return upto, after
+
+
+def get_changes(since, limit=CHANGES_LIMIT, cursor=None):
+    """
+    Changes after version `since`: {version, reset, changes, cursor}, each
+    change with its row as it is now. At most `limit` changes come at once;
+    while cursor is set, ask again with the same `since` and that cursor for
+    the next page. The client is at `version` once it has every page.
+    reset means the client can't catch up from `since` and should reload.
+    Raises ValueError for a malformed cursor.
+    """
+    _compact_if_due()
+    upto, after = decode_cursor(cursor, since) if cursor else (None, None)
+    floor, version, entries = db_queries.get_changes(since, limit + 1, upto, after)
+    if since < floor or since > version or any(e["operation"] == "reset" for e in entries):
+        logger.info(f"Change feed reset for a client at version {since} (now {version})")
+        return {"version": version, "reset": True, "changes": [], "cursor": None}
+
+    more = len(entries) > limit
+    entries = entries[:limit]
+    rows = {
+        table: db_queries.get_rows_by_id(table, [e["row_id"] for e in entries if e["table_name"] == table])
+        for table in {e["table_name"] for e in entries}
+    }
+    changes = [{
+        "version": e["version"],
+        "table": e["table_name"],
+        "id": e["row_id"],
+        "operation": e["operation"],
+        "row": rows[e["table_name"]].get(e["row_id"])
+    } for e in entries]
+    return {
+        "version": version,
+        "reset": False,
+        "changes": changes,
+        "cursor": encode_cursor(version, entries[-1]["version"]) if more else None
+    }
+
+
+def stream_changes(since, heartbeat=STREAM_HEARTBEAT_SECONDS):
+    """
+    Server-Sent Events: get_changes pages as writes commit, a heartbeat
+    comment when idle. Only a batch's last page carries an event id, so a
+    client reconnecting mid-batch resumes from the version before it.
+    """
+    seen = cache.versions(*CHANGE_TABLES)
+    while True:
+        feed = get_changes(since)
+        while feed["cursor"]:
+            yield f"data: {json.dumps(feed)}\n\n"
+            feed = get_changes(since, cursor=feed["cursor"])
+        if feed["reset"] or feed["changes"]:
+            yield f"id: {feed['version']}\ndata: {json.dumps(feed)}\n\n"
+        since = feed["version"]
+
+        latest = cache.wait_for_bump(seen, *CHANGE_TABLES, timeout=heartbeat)
+        if latest == seen:
+            yield ": heartbeat\n\n"
+        seen = latest
@@ -0,0 +1,123 @@
+import io
+import csv
+import json
+import logging
+import db_queries
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # optional; CSV and JSON Lines are always available
+    pa = pq = None
+
+EXPORT_BATCH_SIZE = 5000
+PARQUET_ROW_GROUP_SIZE = 50000
+
+MIMETYPES = {
+    "csv": "text/csv",
+    "jsonl": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet"
+}
+
+logger = logging.getLogger(__name__)
+
+
+def export_formats():
+    """Formats this install can export; parquet needs pyarrow."""
+    return [name for name in MIMETYPES if name != "parquet" or pq is not None]
+
+
+def _dollars(cents):
+    return None if cents is None else cents / 100
+
+
+def stream_csv(filters, batch_size=EXPORT_BATCH_SIZE):
+    """Yield the export as CSV text, header first, one piece per batch."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(db_queries.EXPORT_COLUMNS)
+    yield buffer.getvalue()
+
+    for rows in db_queries.iter_transactions(filters, batch_size):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(
+            (id_, date, account, description, "" if amount is None else f"{amount / 100:.2f}", category, name)
+            for id_, date, account, description, amount, category, name in rows
+        )
+        yield buffer.getvalue()
+
+
+def stream_jsonl(filters, batch_size=EXPORT_BATCH_SIZE):
+    """Yield the export as JSON Lines, one object per transaction."""
+    columns = db_queries.EXPORT_COLUMNS
+    amount = columns.index("amount")
+
+    for rows in db_queries.iter_transactions(filters, batch_size):
+        lines = []
+        for row in rows:
+            values = list(row)
+            values[amount] = _dollars(values[amount])
+            lines.append(json.dumps(dict(zip(columns, values))))
+        yield "\n".join(lines) + "\n"
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file that hands back whatever was written since the last take()."""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def take(self):
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def stream_parquet(filters, row_group_size=PARQUET_ROW_GROUP_SIZE):
+    """
+    Yield the export as a Parquet file, one row group per batch, so only a
+    single row group is ever held in memory.
+    """
+    schema = pa.schema([
+        ("id", pa.int64()),
+        ("transaction_date", pa.string()),
+        ("account_type", pa.string()),
+        ("description", pa.string()),
+        ("amount", pa.float64()),
+        ("category", pa.int64()),
+        ("category_name", pa.string())
+    ])
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema)
+    try:
+        for rows in db_queries.iter_transactions(filters, row_group_size):
+            columns = [list(column) for column in zip(*rows)]
+            columns[4] = [_dollars(cents) for cents in columns[4]]
+            writer.write_table(pa.Table.from_arrays(columns, schema=schema))
+            yield sink.take()
+    finally:
+        writer.close()
+    yield sink.take()
+
+
+def stream_export(filters, export_format):
+    """The generator producing an export in the given format."""
+    logger.info(f"Exporting transactions as {export_format}")
+    if export_format == "csv":
+        return stream_csv(filters)
+    if export_format == "jsonl":
+        return stream_jsonl(filters)
+    return stream_parquet(filters)
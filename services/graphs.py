@@ -1,72 +1,92 @@
-import db_queries
+import numpy as np
 import pandas as pd
+import columnar
+import db_queries
+import services.transactions as transactions_service
+
+# Summary granularity -> pandas period frequency.
+SUMMARY_GRANULARITIES = {"week": "W-SUN", "month": "M", "quarter": "Q", "year": "Y"}
+MAX_SUMMARY_PERIODS = 120
 
 
 def get_graph_data(month_filter=None):
     """Prepare graph data with category and subcategory breakdowns."""
-    df = db_queries.get_graph_data_for_month()
+    months = get_available_months()
 
-    if df.empty:
+    if not months:
         return {
             "months": [],
             "category_totals": {},
             "subcategory_totals": {}
         }
 
-    df["amount"] = abs(pd.to_numeric(df["amount"], errors="coerce"))
-
-    df["month"] = pd.to_datetime(df["transaction_date"]).dt.strftime("%Y-%m")
-    months = sorted(df["month"].unique(), reverse=True)
-
-    if month_filter and month_filter != "all" and month_filter in df["month"].values:
-        df = df[df["month"] == month_filter]
-
-    df["top_category"] = df.apply(
-        lambda row: row["parent_name"] if pd.notna(row["parent_name"]) else row["category_name"], axis=1
-    )
-
-    category_totals = df.groupby("top_category")["amount"].sum().round(2).to_dict()
+    # Unknown months fall back to all-time totals, as before.
+    df = db_queries.get_graph_data_for_month(month_filter if month_filter in months else None)
 
+    category_totals = {}
     subcategory_totals = {}
-    for top_cat, group in df.groupby("top_category"):
-        sub_breakdown = group.groupby("category_name")["amount"].sum().round(2).to_dict()
-        subcategory_totals[top_cat] = sub_breakdown
+    for top_cat, category, amount in df[["top_category", "category_name", "amount"]].itertuples(index=False):
+        category_totals[top_cat] = category_totals.get(top_cat, 0) + amount
+        subcategory_totals.setdefault(top_cat, {})[category] = round(amount / 100, 2)
 
     return {
         "months": months,
-        "category_totals": category_totals,
+        "category_totals": {name: round(amount / 100, 2) for name, amount in category_totals.items()},
         "subcategory_totals": subcategory_totals
     }
 
 
 def get_available_months():
     """Return available transaction months for filtering."""
-    df = db_queries.get_available_months()
-    if df.empty:
-        return []
-    df["month"] = pd.to_datetime(df["transaction_date"]).dt.strftime("%Y-%m")
-    return sorted(df["month"].unique(), reverse=True)
-
-
-def get_income_expense_summary():
-    """Return income and expense totals by month."""
-    df = db_queries.get_income_expense_by_month()
-    df["amount"] = pd.to_numeric(df["amount"], errors="coerce")
-
-    if df.empty:
-        return []
-
-    df["transaction_date"] = pd.to_datetime(df["transaction_date"], errors="coerce")
-    df = df.dropna(subset=["transaction_date"])
-    df["year_month"] = df["transaction_date"].dt.to_period("M")
+    return transactions_service.get_transaction_months()
+
+
+def get_income_expense_summary(periods=12, granularity="month"):
+    """
+    Income, expenses, net and running balance for the last `periods` weeks,
+    months, quarters or years up to the latest transaction. Periods without
+    transactions are included as zeros. Months and longer are summed from
+    monthly_category_totals; weeks, which cut across months, come from the
+    columnar store.
+    """
+    freq = SUMMARY_GRANULARITIES[granularity]
+    if granularity == "week":
+        columns = columnar.snapshot()
+        latest = columns.latest_day()
+        if latest is None:
+            return []
+        index = _period_index(columnar.day_label(latest), periods, freq)
+        boundaries = [columnar.day_number(start) for start in index.start_time]
+        boundaries.append(columnar.day_number((index[-1] + 1).start_time))
+        income, expenses, opening = columns.income_expenses(boundaries)
+        labels = index.start_time.strftime("%Y-%m-%d")
+    else:
+        df = db_queries.get_monthly_income_expenses()
+        if df.empty:
+            return []
+        index = _period_index(df["year_month"].iloc[-1], periods, freq)
+        period = pd.PeriodIndex(df["year_month"], freq="M").asfreq(freq)
+        in_range = period >= index[0]
+        totals = df[in_range].groupby(period[in_range])[["income", "expenses"]].sum().reindex(index, fill_value=0)
+        income, expenses = totals["income"].to_numpy(), totals["expenses"].to_numpy()
+        opening = int(df.loc[~in_range, "income"].sum() + df.loc[~in_range, "expenses"].sum())
+        labels = index.astype(str)
+
+    net = income + expenses
+    balance = opening + np.cumsum(net)
+    return [
+        {
+            "period": label,
+            "income": round(int(i) / 100, 2),
+            "expenses": round(int(e) / 100, 2),
+            "net": round(int(n) / 100, 2),
+            "balance": round(int(b) / 100, 2)
+        }
+        for label, i, e, n, b in zip(labels, income, expenses, net, balance)
+    ]
 
-    summary = df.groupby("year_month").apply(
-        lambda x: pd.Series({
-            "income": x.loc[x["amount"] > 0, "amount"].sum(),
-            "expenses": x.loc[x["amount"] < 0, "amount"].sum()
-        }),
-        include_groups=False
-    ).reset_index()
 
-    summary["month"] = summary["year_month"].astype(str)
-    return summary[["month", "income", "expenses"]].tail(12).to_dict(orient="records")
+def _period_index(latest, periods, freq):
+    """The `periods` periods of frequency freq ending with the one containing `latest`."""
+    end = pd.Period(latest, freq=freq)
+    return pd.period_range(end - (periods - 1), end, freq=freq)
@@ -0,0 +1,226 @@
+import re
+import logging
+import threading
+import numpy as np
+import pandas as pd
+import db_queries
+import cache
+import services.categories as categories_service
+
+APPLY_BATCH_SIZE = 5000
+
+# Group references and named groups would clash once patterns share a regex.
+_GROUP_REFERENCE = re.compile(r"\\\d|\(\?P[<=]|\(\?\(")
+
+logger = logging.getLogger(__name__)
+
+
+def _keyword_trie_pattern(keywords):
+    """
+    One regex matching any of `keywords` (lowercase) shaped as a trie, so each
+    position costs a walk down shared prefixes instead of one try per keyword.
+    Each keyword ends in an empty named group k<index> marking which matched;
+    longer keywords are tried first.
+    """
+    trie = {}
+    for index, keyword in enumerate(keywords):
+        node = trie
+        for char in keyword:
+            node = node.setdefault(char, {})
+        node[""] = index
+
+    def build(node):
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if "" in node:
+            branches.append(f"(?P<k{node['']}>)")
+        return branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+
+    return build(trie)
+
+
+class RuleMatcher:
+    """
+    Categorization rules compiled for vectorized matching. Rules are ranked by
+    priority (highest first, then oldest); a transaction gets the category of
+    the best-ranked rule whose every condition holds.
+
+    Keyword rules (case-insensitive substrings) share one trie-shaped regex
+    run once per distinct description. Regex rules without account type or
+    amount conditions share one alternation in rank order: it reports the
+    best-ranked of them that matches, and the rest could never win. Regex
+    rules with conditions, or whose patterns refer to groups, are each run
+    over the distinct descriptions. Account type and amount conditions are
+    then checked in bulk on the candidate (row, rule) pairs.
+    """
+
+    def __init__(self, rules, version=None):
+        self.version = version
+        self.count = len(rules)
+        self.category = rules["category_id"].to_numpy(dtype="int64")
+        self.account_type = np.array([
+            None if pd.isna(value) or not str(value).strip() else str(value).strip().lower()
+            for value in rules["account_type"]
+        ], dtype=object)
+        self.min_amount = pd.to_numeric(rules["min_amount"]).to_numpy(dtype="float64")
+        self.max_amount = pd.to_numeric(rules["max_amount"]).to_numpy(dtype="float64")
+
+        has_pattern = rules["pattern"].fillna("") != ""
+        is_regex = rules["is_regex"].astype(bool)
+        self.unconditional = np.flatnonzero(~has_pattern.to_numpy())
+
+        conditional = pd.notna(self.account_type) | ~np.isnan(self.min_amount) | ~np.isnan(self.max_amount)
+        combined = []
+        self.regexes = []
+        regex_rules = has_pattern & is_regex
+        for rank, pattern in zip(np.flatnonzero(regex_rules.to_numpy()), rules["pattern"][regex_rules]):
+            if conditional[rank] or _GROUP_REFERENCE.search(pattern):
+                self.regexes.append((rank, re.compile(pattern, re.IGNORECASE)))
+            else:
+                combined.append(f"(?P<r{rank}>{pattern})")
+        # A lookahead, so every position reports its best-ranked match.
+        self.regex_alternation = re.compile(f"(?={'|'.join(combined)})", re.IGNORECASE) if combined else None
+
+        # Rule ranks per distinct keyword. A match of a keyword implies a
+        # match of every keyword that is a prefix of it at the same position,
+        # so each keyword also carries those keywords' ranks.
+        keyword_rules = has_pattern & ~is_regex
+        by_keyword = {}
+        for rank, keyword in zip(np.flatnonzero(keyword_rules.to_numpy()), rules["pattern"][keyword_rules]):
+            by_keyword.setdefault(keyword.lower(), []).append(int(rank))
+        self.keywords = list(by_keyword)
+        self.keyword_ranks = [
+            sorted({rank for length in range(1, len(k) + 1) for rank in by_keyword.get(k[:length], [])})
+            for k in self.keywords
+        ]
+        # Keywords and descriptions are both lowercased, so no IGNORECASE.
+        self.keyword_regex = re.compile(f"(?={_keyword_trie_pattern(self.keywords)})") if self.keywords else None
+
+    def _pattern_matches(self, descriptions):
+        """(description index, rule rank) pairs for every pattern that matches."""
+        indexes, ranks = [], []
+
+        if self.keyword_regex is not None:
+            finditer = self.keyword_regex.finditer
+            for index, description in enumerate(descriptions):
+                found = {match.lastgroup for match in finditer(description.lower())}
+                for group in found:
+                    matched = self.keyword_ranks[int(group[1:])]
+                    indexes.extend([index] * len(matched))
+                    ranks.extend(matched)
+
+        if self.regex_alternation is not None:
+            finditer = self.regex_alternation.finditer
+            for index, description in enumerate(descriptions):
+                found = {match.lastgroup for match in finditer(description)}
+                if found:
+                    indexes.append(index)
+                    ranks.append(min(int(group[1:]) for group in found))
+
+        for rank, regex in self.regexes:
+            search = regex.search
+            hits = [index for index, description in enumerate(descriptions) if search(description)]
+            indexes.extend(hits)
+            ranks.extend([rank] * len(hits))
+
+        return pd.DataFrame({"desc": indexes, "rank": ranks}, dtype="int64").drop_duplicates()
+
+    def categorize(self, rows, default=None):
+        """
+        Categories for rows (account_type, description, amount in cents).
+        Rows no rule matches keep `default` (their current category if None).
+        """
+        result = (rows["category"] if default is None else pd.Series(default, index=rows.index)).to_numpy(copy=True)
+        if self.count == 0 or rows.empty:
+            return pd.Series(result, index=rows.index)
+
+        codes, descriptions = pd.factorize(rows["description"].fillna(""))
+        matches = self._pattern_matches(descriptions.tolist())
+
+        candidates = pd.DataFrame({"row": np.arange(len(rows)), "desc": codes}).merge(matches, on="desc")
+        if len(self.unconditional):
+            candidates = pd.concat([candidates, pd.DataFrame({
+                "row": np.repeat(np.arange(len(rows)), len(self.unconditional)),
+                "rank": np.tile(self.unconditional, len(rows))
+            })])
+        if candidates.empty:
+            return pd.Series(result, index=rows.index)
+
+        row = candidates["row"].to_numpy()
+        rank = candidates["rank"].to_numpy()
+        account = rows["account_type"].fillna("").str.strip().str.lower().to_numpy(dtype=object)[row]
+        amount = rows["amount"].to_numpy(dtype="float64")[row]
+
+        wanted_account = self.account_type[rank]
+        ok = pd.isna(wanted_account) | (wanted_account == account)
+        ok &= np.isnan(self.min_amount[rank]) | (amount >= self.min_amount[rank])
+        ok &= np.isnan(self.max_amount[rank]) | (amount <= self.max_amount[rank])
+
+        best = pd.Series(rank[ok]).groupby(row[ok]).min()
+        result[best.index.to_numpy()] = self.category[best.to_numpy()]
+        return pd.Series(result, index=rows.index)
+
+
+_matcher = None
+_matcher_lock = threading.Lock()
+
+
+def get_matcher():
+    """The compiled rules, rebuilt after any rule or category change."""
+    global _matcher
+    version = cache.versions("rules", "categories")
+    matcher = _matcher
+    if matcher is None or matcher.version != version:
+        with _matcher_lock:
+            if _matcher is None or _matcher.version != version:
+                rules = db_queries.get_all_rules()
+                # Rules pointing at deleted categories are ignored.
+                tree = categories_service.get_tree()
+                rules = rules[rules["category_id"].map(tree.exists).astype(bool)].reset_index(drop=True)
+                _matcher = RuleMatcher(rules, version)
+                logger.info(f"Compiled {len(rules)} categorization rules")
+            matcher = _matcher
+    return matcher
+
+
+def get_rules():
+    """All rules, best-ranked first, with amounts in dollars."""
+    df = db_queries.get_all_rules()
+    df["is_regex"] = df["is_regex"].astype(bool)
+    for column in ("min_amount", "max_amount"):
+        df[column] = df[column] / 100.0
+    return df.astype(object).where(df.notna(), None).to_dict(orient="records")
+
+
+def add_rule(rule):
+    return db_queries.insert_rule(rule)
+
+
+def delete_rule(rule_id):
+    return db_queries.delete_rule(rule_id)
+
+
+def apply_rules_to_uncategorized(batch_size=APPLY_BATCH_SIZE):
+    """
+    Run the rules over transactions still in the default category, one
+    committed batch at a time. Returns (checked, updated) counts.
+    """
+    matcher = get_matcher()
+    checked = updated = 0
+    last_id = 0
+
+    while True:
+        batch = db_queries.get_transactions_in_category_batch(db_queries.DEFAULT_CATEGORY_ID, last_id, batch_size)
+        if batch.empty:
+            break
+        last_id = int(batch["id"].iloc[-1])
+        checked += len(batch)
+
+        categories = matcher.categorize(batch)
+        changed = categories.to_numpy() != batch["category"].to_numpy()
+        if changed.any():
+            updates = list(zip(categories[changed].astype(int).tolist(), batch["id"][changed].astype(int).tolist()))
+            db_queries.set_transaction_categories(updates)
+            updated += len(updates)
+
+    logger.info(f"Rules applied to {checked} uncategorized transactions, {updated} updated")
+    return checked, updated
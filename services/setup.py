@@ -1,10 +1,17 @@
 # --- services/setup.py ---
 
+import math
+import logging
+import db_queries
 from storage import get_connection
 
+logger = logging.getLogger(__name__)
+
+MIGRATION_BATCH_SIZE = 5000
+
 
 def initialize_database():
-    """Create required tables if they don't exist."""
+    """Create required tables if they don't exist, then apply pending migrations."""
     conn = get_connection()
     cursor = conn.cursor()
 
@@ -18,6 +25,7 @@ def initialize_database():
         )
     ''')
 
+    # Original (version 0) layout; migrations below bring it up to date.
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS transactions (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -39,17 +47,672 @@ def initialize_database():
         )
     ''')
 
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS session_tokens (
-            token TEXT PRIMARY KEY,
-            created_at INTEGER NOT NULL,
-            expires_at INTEGER NOT NULL,
-            ip_address TEXT,
-            rate_limit INTEGER DEFAULT 100,
-            window_start INTEGER DEFAULT 0,
-            request_count INTEGER DEFAULT 0
+    # Session tokens are signed and verified in memory (see sessions.py);
+    # the old per-token table is no longer used.
+    cursor.execute("DROP TABLE IF EXISTS session_tokens")
+
+    conn.commit()
+
+    try:
+        apply_migrations(conn)
+    finally:
+        conn.close()
+
+
+def apply_migrations(conn):
+    """Run every migration newer than the database's PRAGMA user_version."""
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    # Older databases can hold references to deleted categories, which the
+    # table rebuilds below would trip over; version 8 repairs them, so
+    # foreign keys are only enforced again once migrations are done.
+    conn.execute("PRAGMA foreign_keys = OFF")
+    try:
+        for target, migration in enumerate(MIGRATIONS, start=1):
+            if version >= target:
+                continue
+            logger.info(f"Migrating database to schema version {target}")
+            migration(conn)
+            conn.execute(f"PRAGMA user_version = {target}")
+            conn.commit()
+            version = target
+    finally:
+        if conn.in_transaction:
+            conn.rollback()
+        conn.execute("PRAGMA foreign_keys = ON")
+
+
+def migrate_typed_transactions(conn):
+    """
+    Version 1: store amounts as INTEGER cents, add a stored year_month key
+    and index the date, category/month and dedup columns.
+
+    Rows are copied into a new table in id order, one batch per commit, so
+    the table is never loaded into memory and an interrupted migration
+    resumes from the last copied id. Amounts that aren't numbers become NULL.
+    """
+    invalid = {"count": 0, "example": None}
+
+    def legacy_cents(amount):
+        try:
+            value = float(amount)
+        except (TypeError, ValueError):
+            value = math.nan
+        if not math.isfinite(value):
+            if amount is not None:
+                invalid["count"] += 1
+                invalid["example"] = amount
+            return None
+        return db_queries.to_cents(value)
+
+    conn.create_function("legacy_cents", 1, legacy_cents, deterministic=True)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS transactions_v1 (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            account_type TEXT,
+            transaction_date TEXT,
+            description TEXT,
+            amount INTEGER,
+            category INTEGER DEFAULT 1,
+            year_month TEXT GENERATED ALWAYS AS (substr(transaction_date, 1, 7)) STORED,
+            FOREIGN KEY (category) REFERENCES categories(id)
         )
     ''')
+    conn.commit()
+
+    last_id = conn.execute("SELECT IFNULL(MAX(id), 0) FROM transactions_v1").fetchone()[0]
+    while True:
+        cursor = conn.execute('''
+            INSERT INTO transactions_v1 (id, account_type, transaction_date, description, amount, category)
+            SELECT id, account_type,
+                   COALESCE(date(transaction_date), transaction_date),
+                   description,
+                   legacy_cents(amount),
+                   category
+            FROM transactions
+            WHERE id > ?
+            ORDER BY id
+            LIMIT ?
+        ''', (last_id, MIGRATION_BATCH_SIZE))
+        if cursor.rowcount <= 0:
+            break
+        last_id = conn.execute("SELECT MAX(id) FROM transactions_v1").fetchone()[0]
+        conn.commit()
+        logger.info(f"Migrated transactions up to id {last_id}")
+    conn.commit()
+    if invalid["count"]:
+        logger.warning(
+            f"{invalid['count']} transactions had non-numeric amounts, stored as NULL (e.g. {invalid['example']!r})"
+        )
+
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'transactions'").fetchone()
+    sequence = row[0] if row else 0
+
+    # Swap tables atomically so a crash here can't leave the data half-renamed.
+    conn.execute("BEGIN")
+    conn.execute("DROP TABLE transactions")
+    conn.execute("ALTER TABLE transactions_v1 RENAME TO transactions")
+    # Keep AUTOINCREMENT from reusing ids of rows deleted before the migration.
+    conn.execute("DELETE FROM sqlite_sequence WHERE name = 'transactions'")
+    conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('transactions', MAX(?, ?))", (sequence, last_id))
+
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_transactions_date ON transactions (transaction_date)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_transactions_category_month ON transactions (category, year_month)")
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_transactions_dedup
+        ON transactions (account_type, transaction_date, description, amount)
+    ''')
+
+
+def migrate_monthly_category_totals(conn):
+    """
+    Version 2: per category, month and sign totals (cents) and counts, kept
+    in step with transactions by triggers so every write path is covered.
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS monthly_category_totals (
+            category INTEGER NOT NULL,
+            year_month TEXT NOT NULL,
+            sign INTEGER NOT NULL,
+            total INTEGER NOT NULL DEFAULT 0,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (category, year_month, sign)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_monthly_totals_month ON monthly_category_totals (year_month)")
+
+    # Uncategorised rows are keyed under category 0; rows without a date or
+    # amount are not counted.
+    add_new = '''
+        INSERT INTO monthly_category_totals (category, year_month, sign, total, count)
+        SELECT IFNULL(NEW.category, 0), NEW.year_month,
+               CASE WHEN NEW.amount > 0 THEN 1 WHEN NEW.amount < 0 THEN -1 ELSE 0 END,
+               NEW.amount, 1
+        WHERE NEW.year_month IS NOT NULL AND NEW.amount IS NOT NULL
+        ON CONFLICT (category, year_month, sign)
+        DO UPDATE SET total = total + excluded.total, count = count + 1;
+    '''
+    remove_old = '''
+        UPDATE monthly_category_totals
+        SET total = total - OLD.amount, count = count - 1
+        WHERE category = IFNULL(OLD.category, 0) AND year_month = OLD.year_month
+          AND sign = CASE WHEN OLD.amount > 0 THEN 1 WHEN OLD.amount < 0 THEN -1 ELSE 0 END;
+        DELETE FROM monthly_category_totals
+        WHERE category = IFNULL(OLD.category, 0) AND year_month = OLD.year_month AND count <= 0;
+    '''
+
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_transactions_totals_insert
+        AFTER INSERT ON transactions
+        BEGIN {add_new} END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_transactions_totals_delete
+        AFTER DELETE ON transactions
+        BEGIN {remove_old} END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_transactions_totals_update
+        AFTER UPDATE OF category, amount, transaction_date ON transactions
+        BEGIN {remove_old} {add_new} END
+    ''')
+
+    rebuild_monthly_category_totals(conn)
+
 
+def rebuild_monthly_category_totals(conn):
+    """Recompute monthly_category_totals from the transactions table."""
+    conn.execute("DELETE FROM monthly_category_totals")
+    conn.execute(f'''
+        INSERT INTO monthly_category_totals (category, year_month, sign, total, count)
+        {EXPECTED_MONTHLY_TOTALS}
+    ''')
+
+
+def migrate_transaction_fingerprints(conn):
+    """
+    Version 3: persist a fingerprint per transaction (normalized identity hash
+    plus occurrence ordinal) behind a UNIQUE index, replacing the dedup index.
+
+    Works in id-ordered batches, each committed on its own: hash the batch,
+    number identical transactions within it after the occurrences already
+    seen (the fingerprint_counts scratch table, keyed by hash), then add the
+    batch to those counts. Memory stays bounded by the batch size however
+    large the table. Re-running after an interruption starts over and
+    simply recomputes every fingerprint.
+    """
+    columns = [row["name"] for row in conn.execute("PRAGMA table_info(transactions)")]
+    if "fingerprint" not in columns:
+        conn.execute("ALTER TABLE transactions ADD COLUMN fingerprint TEXT")
+    # A run interrupted after creating the unique index would trip over it.
+    conn.execute("DROP INDEX IF EXISTS idx_transactions_fingerprint")
+    conn.execute("DROP TABLE IF EXISTS fingerprint_counts")
+    conn.execute("CREATE TABLE fingerprint_counts (base TEXT PRIMARY KEY, n INTEGER NOT NULL) WITHOUT ROWID")
     conn.commit()
-    conn.close()
+
+    conn.create_function("fingerprint_base", 4, db_queries.fingerprint_base, deterministic=True)
+    last_id = 0
+    while True:
+        batch_end = conn.execute('''
+            SELECT MAX(id) FROM (
+                SELECT id FROM transactions WHERE id > ? ORDER BY id LIMIT ?
+            )
+        ''', (last_id, MIGRATION_BATCH_SIZE)).fetchone()[0]
+        if batch_end is None:
+            break
+        batch = (last_id, batch_end)
+        conn.execute('''
+            UPDATE transactions
+            SET fingerprint = fingerprint_base(account_type, transaction_date, description, amount)
+            WHERE id > ? AND id <= ?
+        ''', batch)
+        conn.execute('''
+            UPDATE transactions
+            SET fingerprint = numbered.fingerprint || ':' || (IFNULL(counts.n, 0) + numbered.ordinal)
+            FROM (
+                SELECT id, fingerprint, ROW_NUMBER() OVER (PARTITION BY fingerprint ORDER BY id) - 1 AS ordinal
+                FROM transactions
+                WHERE id > ? AND id <= ?
+            ) AS numbered
+            LEFT JOIN fingerprint_counts counts ON counts.base = numbered.fingerprint
+            WHERE transactions.id = numbered.id
+        ''', batch)
+        conn.execute('''
+            INSERT INTO fingerprint_counts (base, n)
+            SELECT substr(fingerprint, 1, instr(fingerprint, ':') - 1), COUNT(*)
+            FROM transactions
+            WHERE id > ? AND id <= ?
+            GROUP BY 1
+            ON CONFLICT (base) DO UPDATE SET n = n + excluded.n
+        ''', batch)
+        conn.commit()
+        last_id = batch_end
+        logger.info(f"Fingerprinted transactions up to id {last_id}")
+
+    conn.execute("DROP TABLE fingerprint_counts")
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_transactions_fingerprint ON transactions (fingerprint)")
+    conn.execute("DROP INDEX IF EXISTS idx_transactions_dedup")
+
+
+def migrate_upload_jobs(conn):
+    """Version 4: persisted state for background upload jobs."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS upload_jobs (
+            id TEXT PRIMARY KEY,
+            filename TEXT,
+            path TEXT NOT NULL,
+            phase TEXT NOT NULL,
+            rows_processed INTEGER NOT NULL DEFAULT 0,
+            inserted INTEGER NOT NULL DEFAULT 0,
+            duplicates INTEGER NOT NULL DEFAULT 0,
+            error_count INTEGER NOT NULL DEFAULT 0,
+            errors TEXT,
+            chunks_done INTEGER NOT NULL DEFAULT 0,
+            message TEXT,
+            created_at INTEGER NOT NULL,
+            updated_at INTEGER NOT NULL
+        )
+    ''')
+
+
+def migrate_category_closure(conn):
+    """
+    Version 5: category_closure holds one row per (ancestor, descendant) pair
+    at any depth, including each category paired with itself at depth 0.
+    Triggers keep it in step with inserts, deletes and re-parenting, so a
+    subtree is a single indexed lookup however deep the hierarchy goes.
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS category_closure (
+            ancestor INTEGER NOT NULL,
+            descendant INTEGER NOT NULL,
+            depth INTEGER NOT NULL,
+            PRIMARY KEY (ancestor, descendant)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_category_closure_descendant ON category_closure (descendant, depth)")
+
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_categories_closure_insert
+        AFTER INSERT ON categories
+        BEGIN
+            INSERT INTO category_closure (ancestor, descendant, depth) VALUES (NEW.id, NEW.id, 0);
+            INSERT INTO category_closure (ancestor, descendant, depth)
+            SELECT ancestor, NEW.id, depth + 1 FROM category_closure WHERE descendant = NEW.parent_id;
+        END
+    ''')
+    # Deleting a category cuts every path through it; its subcategories keep
+    # their own subtrees and become top level, as they do in the UI.
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_categories_closure_delete
+        AFTER DELETE ON categories
+        BEGIN
+            DELETE FROM category_closure
+            WHERE descendant IN (SELECT descendant FROM category_closure WHERE ancestor = OLD.id)
+              AND ancestor IN (SELECT ancestor FROM category_closure WHERE descendant = OLD.id);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_categories_closure_move
+        AFTER UPDATE OF parent_id ON categories
+        WHEN NEW.parent_id IS NOT OLD.parent_id
+        BEGIN
+            DELETE FROM category_closure
+            WHERE descendant IN (SELECT descendant FROM category_closure WHERE ancestor = NEW.id)
+              AND ancestor IN (SELECT ancestor FROM category_closure WHERE descendant = NEW.id AND ancestor != NEW.id);
+            INSERT INTO category_closure (ancestor, descendant, depth)
+            SELECT a.ancestor, d.descendant, a.depth + d.depth + 1
+            FROM category_closure a, category_closure d
+            WHERE a.descendant = NEW.parent_id AND d.ancestor = NEW.id;
+        END
+    ''')
+
+    rebuild_category_closure(conn)
+
+
+def migrate_categorization_rules(conn):
+    """
+    Version 6: rules that assign a category to imported transactions.
+    A rule matches on a description keyword or regex, an account type and an
+    amount range (cents); any of these may be left empty.
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS categorization_rules (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            category_id INTEGER NOT NULL,
+            priority INTEGER NOT NULL DEFAULT 0,
+            pattern TEXT,
+            is_regex INTEGER NOT NULL DEFAULT 0,
+            account_type TEXT,
+            min_amount INTEGER,
+            max_amount INTEGER,
+            FOREIGN KEY (category_id) REFERENCES categories(id)
+        )
+    ''')
+
+
+def migrate_transaction_search(conn):
+    """
+    Version 7: transactions_fts, an FTS5 index of each transaction's
+    description, account type and category name keyed by transaction id.
+    Triggers on transactions and categories keep it current.
+    """
+    conn.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS transactions_fts USING fts5(
+            description, account_type, category,
+            tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '2 3'
+        )
+    ''')
+
+    add_new = '''
+        INSERT INTO transactions_fts (rowid, description, account_type, category)
+        VALUES (
+            NEW.id, IFNULL(NEW.description, ''), IFNULL(NEW.account_type, ''),
+            IFNULL((SELECT name FROM categories WHERE id = NEW.category), '')
+        );
+    '''
+    remove_old = "DELETE FROM transactions_fts WHERE rowid = OLD.id;"
+
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_transactions_fts_insert
+        AFTER INSERT ON transactions
+        BEGIN {add_new} END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_transactions_fts_delete
+        AFTER DELETE ON transactions
+        BEGIN {remove_old} END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_transactions_fts_update
+        AFTER UPDATE OF description, account_type, category ON transactions
+        BEGIN {remove_old} {add_new} END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_categories_fts_rename
+        AFTER UPDATE OF name ON categories
+        WHEN NEW.name IS NOT OLD.name
+        BEGIN
+            UPDATE transactions_fts SET category = NEW.name
+            WHERE rowid IN (SELECT id FROM transactions WHERE category = NEW.id);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_categories_fts_delete
+        AFTER DELETE ON categories
+        BEGIN
+            UPDATE transactions_fts SET category = ''
+            WHERE rowid IN (SELECT id FROM transactions WHERE category = OLD.id);
+        END
+    ''')
+
+    rebuild_transaction_search(conn)
+
+
+def migrate_foreign_keys(conn):
+    """
+    Version 8: foreign keys are enforced from here on. Make sure the default
+    category exists and repair references to categories deleted before
+    deletes cleaned up after themselves: such transactions move to the
+    default category, such subcategories become top level, and such
+    budgets and rules are dropped.
+    """
+    conn.execute(
+        "INSERT OR IGNORE INTO categories (id, name, parent_id, include_in_budget) VALUES (?, 'Unassigned', NULL, 1)",
+        (db_queries.DEFAULT_CATEGORY_ID,)
+    )
+    conn.execute('''
+        UPDATE transactions SET category = ?
+        WHERE category IS NOT NULL AND category NOT IN (SELECT id FROM categories)
+    ''', (db_queries.DEFAULT_CATEGORY_ID,))
+    conn.execute('''
+        UPDATE categories SET parent_id = NULL
+        WHERE parent_id IS NOT NULL AND parent_id NOT IN (SELECT id FROM categories)
+    ''')
+    conn.execute("DELETE FROM budgets WHERE category_id NOT IN (SELECT id FROM categories)")
+    conn.execute("DELETE FROM categorization_rules WHERE category_id NOT IN (SELECT id FROM categories)")
+
+    problems = conn.execute("PRAGMA foreign_key_check").fetchall()
+    if problems:
+        raise RuntimeError(f"{len(problems)} foreign key violations remain after repair")
+
+
+def migrate_change_log(conn):
+    """
+    Version 9: change_log, one entry per row written to transactions,
+    categories or budgets, numbered by a version that only ever grows
+    (AUTOINCREMENT never reuses one). change_log_floor holds the newest
+    version compaction has dropped; clients synced to an older version
+    have to reload.
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS change_log (
+            version INTEGER PRIMARY KEY AUTOINCREMENT,
+            table_name TEXT NOT NULL,
+            row_id INTEGER NOT NULL,
+            operation TEXT NOT NULL CHECK (operation IN ('insert', 'update', 'delete'))
+        )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_change_log_row ON change_log (table_name, row_id, version)")
+    conn.execute("CREATE TABLE IF NOT EXISTS change_log_floor (version INTEGER NOT NULL)")
+    conn.execute("INSERT INTO change_log_floor (version) SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM change_log_floor)")
+
+
+def migrate_transaction_months(conn):
+    """
+    Version 10: transaction_months, one row per month with transactions:
+    how many, and the first and last date. Kept current by triggers, so
+    listing months costs O(months) however long the history. Rows without
+    a valid date are not counted.
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS transaction_months (
+            year_month TEXT PRIMARY KEY,
+            count INTEGER NOT NULL,
+            first_date TEXT NOT NULL,
+            last_date TEXT NOT NULL
+        ) WITHOUT ROWID
+    ''')
+
+    add_new = '''
+        INSERT INTO transaction_months (year_month, count, first_date, last_date)
+        SELECT NEW.year_month, 1, NEW.transaction_date, NEW.transaction_date
+        WHERE julianday(NEW.transaction_date) IS NOT NULL
+        ON CONFLICT (year_month) DO UPDATE SET
+            count = count + 1,
+            first_date = MIN(first_date, excluded.first_date),
+            last_date = MAX(last_date, excluded.last_date);
+    '''
+    # Only a row on the month's first or last date moves its bounds; they
+    # are then looked up again over the month's range of the date index.
+    remove_old = '''
+        UPDATE transaction_months SET count = count - 1
+        WHERE year_month = OLD.year_month AND julianday(OLD.transaction_date) IS NOT NULL;
+        DELETE FROM transaction_months WHERE year_month = OLD.year_month AND count <= 0;
+        UPDATE transaction_months SET
+            first_date = (
+                SELECT MIN(transaction_date) FROM transactions
+                WHERE transaction_date >= OLD.year_month AND transaction_date < OLD.year_month || '~'
+                  AND julianday(transaction_date) IS NOT NULL
+            ),
+            last_date = (
+                SELECT MAX(transaction_date) FROM transactions
+                WHERE transaction_date >= OLD.year_month AND transaction_date < OLD.year_month || '~'
+                  AND julianday(transaction_date) IS NOT NULL
+            )
+        WHERE year_month = OLD.year_month AND OLD.transaction_date IN (first_date, last_date);
+    '''
+
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_transactions_months_insert
+        AFTER INSERT ON transactions
+        BEGIN {add_new} END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_transactions_months_delete
+        AFTER DELETE ON transactions
+        BEGIN {remove_old} END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_transactions_months_update
+        AFTER UPDATE OF transaction_date ON transactions
+        WHEN NEW.transaction_date IS NOT OLD.transaction_date
+        BEGIN {remove_old} {add_new} END
+    ''')
+
+    rebuild_transaction_months(conn)
+
+
+def migrate_change_log_reset(conn):
+    """
+    Version 11: allow 'reset' change_log entries, which stand for every row
+    of a table changing at once (clearing all transactions). SQLite can't
+    alter a CHECK constraint, so the table is rebuilt in one transaction and
+    its version sequence carried over.
+    """
+    conn.execute("BEGIN")
+    seq = conn.execute("SELECT IFNULL(MAX(seq), 0) FROM sqlite_sequence WHERE name = 'change_log'").fetchone()[0]
+    conn.execute('''
+        CREATE TABLE change_log_new (
+            version INTEGER PRIMARY KEY AUTOINCREMENT,
+            table_name TEXT NOT NULL,
+            row_id INTEGER NOT NULL,
+            operation TEXT NOT NULL CHECK (operation IN ('insert', 'update', 'delete', 'reset'))
+        )
+    ''')
+    conn.execute("INSERT INTO change_log_new SELECT version, table_name, row_id, operation FROM change_log")
+    conn.execute("DROP TABLE change_log")
+    conn.execute("ALTER TABLE change_log_new RENAME TO change_log")
+    conn.execute("CREATE INDEX idx_change_log_row ON change_log (table_name, row_id, version)")
+    conn.execute("DELETE FROM sqlite_sequence WHERE name = 'change_log'")
+    conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('change_log', ?)", (seq,))
+
+
+# Every (ancestor, descendant, depth) path through categories.parent_id.
+EXPECTED_CATEGORY_CLOSURE = '''
+    WITH RECURSIVE walk (ancestor, descendant, depth) AS (
+        SELECT id, id, 0 FROM categories
+        UNION ALL
+        SELECT w.ancestor, c.id, w.depth + 1
+        FROM walk w
+        JOIN categories c ON c.parent_id = w.descendant
+        WHERE w.depth < 64
+    )
+    SELECT ancestor, descendant, MIN(depth) AS depth FROM walk GROUP BY ancestor, descendant
+'''
+
+
+def rebuild_category_closure(conn):
+    """Recompute category_closure from categories.parent_id."""
+    conn.execute("DELETE FROM category_closure")
+    conn.execute(f"INSERT INTO category_closure (ancestor, descendant, depth) {EXPECTED_CATEGORY_CLOSURE}")
+
+
+# The indexed text of every transaction, as transactions_fts should hold it.
+EXPECTED_TRANSACTION_SEARCH = '''
+    SELECT t.id, IFNULL(t.description, '') AS description,
+           IFNULL(t.account_type, '') AS account_type, IFNULL(c.name, '') AS category
+    FROM transactions t
+    LEFT JOIN categories c ON c.id = t.category
+'''
+
+
+def rebuild_transaction_search(conn):
+    """Re-index every transaction in transactions_fts."""
+    conn.execute("DELETE FROM transactions_fts")
+    conn.execute(f"INSERT INTO transactions_fts (rowid, description, account_type, category) {EXPECTED_TRANSACTION_SEARCH}")
+    conn.execute("INSERT INTO transactions_fts (transactions_fts) VALUES ('optimize')")
+
+
+EXPECTED_MONTHLY_TOTALS = '''
+    SELECT IFNULL(category, 0) AS category, year_month,
+           CASE WHEN amount > 0 THEN 1 WHEN amount < 0 THEN -1 ELSE 0 END AS sign,
+           SUM(amount) AS total, COUNT(*) AS count
+    FROM transactions
+    WHERE year_month IS NOT NULL AND amount IS NOT NULL
+    GROUP BY 1, 2, 3
+'''
+
+
+# One row per month with validly dated transactions, as transaction_months should hold it.
+EXPECTED_TRANSACTION_MONTHS = '''
+    SELECT year_month, COUNT(*) AS count, MIN(transaction_date) AS first_date, MAX(transaction_date) AS last_date
+    FROM transactions
+    WHERE julianday(transaction_date) IS NOT NULL
+    GROUP BY year_month
+'''
+
+
+def rebuild_transaction_months(conn):
+    """Recompute transaction_months from the transactions table."""
+    conn.execute("DELETE FROM transaction_months")
+    conn.execute(f"INSERT INTO transaction_months (year_month, count, first_date, last_date) {EXPECTED_TRANSACTION_MONTHS}")
+
+
+def rebuild_aggregates():
+    """Rebuild every derived table. Returns {table: rows written}."""
+    conn = get_connection()
+    try:
+        rebuild_monthly_category_totals(conn)
+        rebuild_category_closure(conn)
+        rebuild_transaction_search(conn)
+        rebuild_transaction_months(conn)
+        counts = {
+            table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            for table in ("monthly_category_totals", "category_closure", "transactions_fts", "transaction_months")
+        }
+        conn.commit()
+    finally:
+        conn.close()
+    logger.info(f"Rebuilt derived tables: {counts}")
+    return counts
+
+
+def check_aggregates():
+    """
+    Compare monthly_category_totals, category_closure, transactions_fts and
+    transaction_months with fresh computations from their source tables.
+    Returns a list of mismatched rows, each tagged with its table; empty
+    when consistent.
+    """
+    checks = [
+        ("monthly_category_totals", EXPECTED_MONTHLY_TOTALS,
+         "SELECT category, year_month, sign, total, count FROM monthly_category_totals"),
+        ("category_closure", EXPECTED_CATEGORY_CLOSURE,
+         "SELECT ancestor, descendant, depth FROM category_closure"),
+        ("transactions_fts", EXPECTED_TRANSACTION_SEARCH,
+         "SELECT rowid, description, account_type, category FROM transactions_fts"),
+        ("transaction_months", EXPECTED_TRANSACTION_MONTHS,
+         "SELECT year_month, count, first_date, last_date FROM transaction_months"),
+    ]
+    mismatches = []
+    conn = get_connection()
+    try:
+        for table, expected, actual in checks:
+            rows = conn.execute(f'''
+                WITH expected AS ({expected}),
+                     actual AS ({actual})
+                SELECT 'expected' AS source, * FROM (SELECT * FROM expected EXCEPT SELECT * FROM actual)
+                UNION ALL
+                SELECT 'stored' AS source, * FROM (SELECT * FROM actual EXCEPT SELECT * FROM expected)
+            ''').fetchall()
+            mismatches.extend({"table": table, **dict(row)} for row in rows)
+    finally:
+        conn.close()
+    return mismatches
+
+
+# Ordered list; a migration's schema version is its position, starting at 1.
+MIGRATIONS = [
+    migrate_typed_transactions,
+    migrate_monthly_category_totals,
+    migrate_transaction_fingerprints,
+    migrate_upload_jobs,
+    migrate_category_closure,
+    migrate_categorization_rules,
+    migrate_transaction_search,
+    migrate_foreign_keys,
+    migrate_change_log,
+    migrate_transaction_months,
+    migrate_change_log_reset,
+]
@@ -1,5 +1,11 @@
 import db_queries
+import cache
 import pandas as pd
+import base64
+import json
+import math
+
+SORTABLE_COLUMNS = tuple(db_queries.TRANSACTION_SORT_COLUMNS)
 
 def get_transactions():
     """Fetch transactions with any additional processing."""
@@ -7,29 +13,138 @@ def get_transactions():
     return df
 
 
-def update_transaction_category(transaction_id, category_id):
-    """Assign a category to a transaction."""
-    db_queries.update_transaction_category(transaction_id, category_id)
+def _dictionary_encode(series):
+    """Distinct values plus one code per row; -1 marks a missing value."""
+    codes, values = pd.factorize(series)
+    return {"values": values.tolist(), "codes": codes.tolist()}
+
+
+def _nullable_ints(series):
+    return series.astype("Int64").astype(object).where(series.notna(), None).tolist()
+
+
+def to_columnar(df):
+    """
+    Encode transactions as one array per column: account type and category
+    name dictionary-encoded, dates as day offsets from the earliest date and
+    amounts as integer cents.
+    """
+    dates = pd.to_datetime(df["transaction_date"], format="%Y-%m-%d", errors="coerce")
+    base = dates.min()
+    base_date = None if pd.isna(base) else base.strftime("%Y-%m-%d")
+
+    return {
+        "format": "columnar",
+        "count": len(df),
+        "columns": {
+            "id": df["id"].tolist(),
+            "account_type": _dictionary_encode(df["account_type"]),
+            "transaction_date": {"base": base_date, "days": _nullable_ints((dates - base).dt.days)},
+            "description": df["description"].astype(object).where(df["description"].notna(), None).tolist(),
+            "amount_cents": _nullable_ints((df["amount"] * 100).round()),
+            "category": _nullable_ints(df["category"]),
+            "category_name": _dictionary_encode(df["category_name"])
+        }
+    }
+
+
+def encode_cursor(sort_value, transaction_id):
+    """Encode a keyset position as an opaque URL-safe string."""
+    raw = json.dumps([sort_value, transaction_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Decode a cursor produced by encode_cursor. Raises ValueError if malformed."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        sort_value, transaction_id = json.loads(base64.urlsafe_b64decode(padded))
+    except Exception as e:
+        raise ValueError("Invalid cursor") from e
+
+    if not _is_sql_value(transaction_id, int) or not _is_sql_value(sort_value, (str, int, float)):
+        raise ValueError("Invalid cursor")
+    return sort_value, transaction_id
+
+
+def _is_sql_value(value, types):
+    """Whether value is one of types and fits a SQLite column (64-bit ints, finite floats)."""
+    if isinstance(value, bool) or not isinstance(value, types):
+        return False
+    if isinstance(value, int):
+        return -2**63 <= value < 2**63
+    return not isinstance(value, float) or math.isfinite(value)
+
+
+def get_transactions_page(filters, sort="transaction_date", order="desc", cursor=None, offset=0, limit=50, columnar=False):
+    """
+    Fetch a page of transactions along with the total count and amount footer.
+    With columnar=True the rows are encoded by to_columnar.
+    """
+    position = decode_cursor(cursor) if cursor else None
 
+    # Fetch one extra row to find out whether another page follows.
+    df = db_queries.get_transactions_page(filters, sort, order, position, offset, limit + 1)
+    has_more = len(df) > limit
+    df = df.head(limit)
 
-def update_transaction_description(transaction_id, description):
-    """Update the transaction description."""
-    db_queries.update_transaction_description(transaction_id, description)
+    next_cursor = None
+    if has_more:
+        last = df.iloc[-1]
+        sort_value = last["sort_value"]
+        sort_value = sort_value.item() if hasattr(sort_value, "item") else sort_value
+        next_cursor = encode_cursor(sort_value, int(last["id"]))
 
+    df = df.drop(columns=["sort_value"])
+    rows = to_columnar(df) if columnar else json.loads(df.to_json(orient="records"))
+    summary = db_queries.get_transactions_summary(filters)
 
-def add_transaction(data):
-    """Add a new transaction and return its ID."""
-    return db_queries.insert_transaction(data)
+    return {
+        "total": summary["total"],
+        "rows": rows,
+        "next_cursor": next_cursor,
+        "footer": {"amount": summary["amount"]}
+    }
 
 
-def get_transaction(transaction_id):
-    """Retrieve a specific transaction by ID."""
-    return db_queries.get_transaction_by_id(transaction_id)
+def search_transactions(filters, sort="relevance", offset=0, limit=50):
+    """
+    Full-text search over description, account type and category name,
+    combined with the other filters. Returns a page like get_transactions_page.
+    """
+    df = db_queries.search_transactions(filters, sort, offset, limit)
+    summary = db_queries.get_transactions_summary(filters)
 
+    return {
+        "total": summary["total"],
+        "rows": json.loads(df.to_json(orient="records")),
+        "footer": {"amount": summary["amount"]}
+    }
 
-def delete_transaction(transaction_id):
-    """Delete a transaction."""
-    db_queries.delete_transaction_by_id(transaction_id)
+
+def update_transaction_category(transaction_id, category_id, uow=None):
+    """Assign a category to a transaction; None if there is no such transaction."""
+    return db_queries.update_transaction_category(transaction_id, category_id, uow=uow)
+
+
+def recategorize_transactions(filters, category_id, dry_run=False):
+    """Move every transaction matching filters to a category; returns the count."""
+    return db_queries.recategorize_transactions(filters, category_id, dry_run)
+
+
+def update_transaction_description(transaction_id, description, uow=None):
+    """Update the transaction description; None if there is no such transaction."""
+    return db_queries.update_transaction_description(transaction_id, description, uow=uow)
+
+
+def add_transaction(data, uow=None):
+    """Add a new transaction and return it as stored."""
+    return db_queries.insert_transaction(data, uow=uow)
+
+
+def delete_transaction(transaction_id, uow=None):
+    """Delete a transaction; False if there was no such transaction."""
+    return db_queries.delete_transaction_by_id(transaction_id, uow=uow)
 
 
 def clear_all_transactions():
@@ -37,19 +152,22 @@ def clear_all_transactions():
     db_queries.clear_all_transactions()
 
 
+@cache.memoized("transactions")
+def get_month_index():
+    """
+    Every month with transactions, newest first: {month, count, first_date,
+    last_date}. Read from the maintained transaction_months table; every
+    month list in the app comes from here.
+    """
+    return db_queries.get_transaction_months()
+
+
 def get_transaction_months():
-    """Fetch all months with transactions."""
-    df = db_queries.get_all_transaction_months()
-    df["transaction_date"] = pd.to_datetime(df["transaction_date"], errors="coerce")
-    df = df.dropna()
-    months = df["transaction_date"].dt.to_period("M").astype(str).unique().tolist()
-    months.sort(reverse=True)
-    return months
+    """Fetch all months with transactions, newest first."""
+    return [row["month"] for row in get_month_index()]
 
 
 def get_most_recent_month():
     """Get the latest transaction month."""
-    return db_queries.get_most_recent_transaction_month()
-
-def transaction_exists(transaction_id):
-    return db_queries.transaction_exists(transaction_id) is not None
\ No newline at end of file
+    months = get_month_index()
+    return months[0]["month"] if months else None
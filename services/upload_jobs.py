@@ -0,0 +1,114 @@
+import os
+import time
+import uuid
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import db_queries
+import services.uploads as uploads_service
+from storage import DB_PATH
+
+UPLOAD_DIR = os.environ.get("UPLOAD_DIR", os.path.join(os.path.dirname(DB_PATH) or ".", "uploads"))
+MAX_WORKERS = 2
+MAX_PENDING_JOBS = 8
+FINISHED_JOB_RETENTION_SECONDS = 7 * 24 * 3600
+
+logger = logging.getLogger(__name__)
+
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="upload-job")
+_slots = threading.BoundedSemaphore(MAX_PENDING_JOBS)
+
+
+class UploadQueueFull(Exception):
+    """Raised when MAX_PENDING_JOBS uploads are already queued or running."""
+
+
+def submit_upload(file):
+    """Store an uploaded file and queue it for import. Returns the job id."""
+    if not _slots.acquire(blocking=False):
+        raise UploadQueueFull()
+
+    try:
+        job_id = uuid.uuid4().hex
+        os.makedirs(UPLOAD_DIR, exist_ok=True)
+        path = os.path.join(UPLOAD_DIR, f"{job_id}.csv")
+        file.save(path)
+        db_queries.insert_upload_job(job_id, file.filename, path)
+    except Exception:
+        _slots.release()
+        raise
+
+    _executor.submit(_run_job, job_id, path)
+    return job_id
+
+
+def get_job_status(job_id):
+    """Return a job's progress, or None if it doesn't exist."""
+    job = db_queries.get_upload_job(job_id)
+    if job is None:
+        return None
+    job.pop("path", None)
+    return job
+
+
+def resume_pending_jobs():
+    """Re-queue jobs left unfinished by a restart and drop old finished ones."""
+    db_queries.delete_finished_upload_jobs(int(time.time()) - FINISHED_JOB_RETENTION_SECONDS)
+
+    for job in db_queries.get_unfinished_upload_jobs():
+        if not os.path.exists(job["path"]):
+            db_queries.update_upload_job(job["id"], phase="failed", message="Uploaded file is missing")
+            continue
+        if not _slots.acquire(blocking=False):
+            logger.warning(f"Upload queue full; job {job['id']} left queued")
+            continue
+        logger.info(f"Resuming upload job {job['id']} from phase {job['phase']}")
+        _executor.submit(_run_job, job["id"], job["path"])
+
+
+def _run_job(job_id, path):
+    try:
+        job = db_queries.get_upload_job(job_id)
+
+        # Validation writes nothing, so it is simply redone after a restart.
+        if job["phase"] in ("queued", "validating"):
+            db_queries.update_upload_job(job_id, phase="validating", rows_processed=0)
+            result = uploads_service.validate_csv(
+                path, on_progress=lambda rows: db_queries.update_upload_job(job_id, rows_processed=rows)
+            )
+
+            if result["rows"] == 0:
+                db_queries.update_upload_job(job_id, phase="failed", message="CSV is empty or invalid")
+                return
+            if result["error_count"]:
+                db_queries.update_upload_job(
+                    job_id, phase="failed", message="Invalid data in CSV",
+                    error_count=result["error_count"], errors=result["errors"]
+                )
+                return
+
+            db_queries.update_upload_job(job_id, phase="importing", rows_processed=0)
+            job = db_queries.get_upload_job(job_id)
+
+        totals = {key: job[key] for key in ("rows_processed", "inserted", "duplicates")}
+
+        def record_chunk(uow, index, rows, inserted):
+            totals["rows_processed"] += rows
+            totals["inserted"] += inserted
+            totals["duplicates"] += rows - inserted
+            db_queries.update_upload_job(job_id, uow=uow, chunks_done=index + 1, **totals)
+
+        uploads_service.import_csv(path, skip_chunks=job["chunks_done"], on_chunk=record_chunk)
+        db_queries.update_upload_job(job_id, phase="completed")
+        logger.info(f"Upload job {job_id} inserted {totals['inserted']} new transactions")
+    except ValueError as e:
+        logger.warning(f"Upload job {job_id} CSV parsing failed: {e}")
+        db_queries.update_upload_job(job_id, phase="failed", message="Invalid CSV format")
+    except Exception as e:
+        logger.error(f"Upload job {job_id} failed: {e}", exc_info=True)
+        db_queries.update_upload_job(job_id, phase="failed", message="Internal server error")
+    finally:
+        _slots.release()
+        job = db_queries.get_upload_job(job_id)
+        if job and job["phase"] in ("completed", "failed") and os.path.exists(path):
+            os.remove(path)
@@ -1,70 +1,172 @@
+import numpy as np
 import pandas as pd
 import db_queries
-
-
-def parse_uploaded_csv(file):
-    """Parse and sanitize uploaded CSV file."""
-    df = pd.read_csv(file, dtype=str, index_col=False)
-
-    # Clean up headers
-    df.columns = [col.strip() for col in df.columns]
-
-    # Rename and filter only needed columns
-    expected_columns = {
-        "Account Type": "account_type",
-        "Transaction Date": "transaction_date",
-        "Description 1": "description1",
-        "Description 2": "description2",
-        "CAD$": "amount"
-    }
-
-    df = df.rename(columns=expected_columns)
-    df = df[list(expected_columns.values())]
-
-    # Convert date
-    df["transaction_date"] = pd.to_datetime(
-        df["transaction_date"], format="%m/%d/%Y", errors="coerce"
-    )
-
-    return df
-
-
-def choose_description(row):
-    """Apply description preference logic."""
-    desc1 = row.get("description1", "") or ""
-    desc2 = row.get("description2", "") or ""
-
-    if "IDP PURCHASE" in desc1:
-        return desc2
-    elif any(term in desc1 for term in ["MISC PAYMENT", "BILL PAYMENT", "PAYROLL DEPOSIT"]):
-        return f"{desc1} {desc2}".strip()
-    else:
-        return desc1
-
-
-def insert_unique_transactions(df):
-    """Insert only new transactions, avoiding duplicates."""
-    existing = db_queries.get_existing_transaction_records()
-
-    # Merge description fields
-    df["description"] = df.apply(choose_description, axis=1)
-    df = df[["account_type", "transaction_date", "description", "amount"]]
-    df["category"] = 1  # Default category
-
-    if existing.empty:
-        insert_count = len(df)
-        df.to_sql("transactions", db_queries.get_connection(), if_exists="append", index=False)
-        return insert_count
-
-    new_df = df.merge(
-        existing, on=["account_type", "transaction_date", "description", "amount"],
-        how="left", indicator=True
+import services.rules as rules_service
+from writer import writer
+from validation import MAX_AMOUNT, date_regex_mdy
+
+# CSV header -> column name. Only these columns are read from the upload.
+EXPECTED_COLUMNS = {
+    "Account Type": "account_type",
+    "Transaction Date": "transaction_date",
+    "Description 1": "description1",
+    "Description 2": "description2",
+    "CAD$": "amount"
+}
+
+CHUNK_SIZE = 10000
+MAX_REPORTED_ERRORS = 100
+
+COMBINED_DESCRIPTION_TERMS = r"MISC PAYMENT|BILL PAYMENT|PAYROLL DEPOSIT"
+
+
+def read_csv_chunks(file, chunksize=CHUNK_SIZE):
+    """
+    Stream the upload in fixed-size chunks of the expected columns only.
+    Yields (first_line_number, chunk). Raises ValueError if columns are missing.
+    """
+    reader = pd.read_csv(
+        file,
+        dtype=str,
+        index_col=False,
+        usecols=lambda col: col.strip() in EXPECTED_COLUMNS,
+        chunksize=chunksize
     )
-    new_df = new_df[new_df["_merge"] == "left_only"].drop(columns=["_merge"])
-
-    insert_count = len(new_df)
-
-    if insert_count > 0:
-        new_df.to_sql("transactions", db_queries.get_connection(), if_exists="append", index=False)
 
-    return insert_count
+    line = 2  # line 1 is the header
+    for chunk in reader:
+        chunk.columns = [col.strip() for col in chunk.columns]
+        missing = set(EXPECTED_COLUMNS) - set(chunk.columns)
+        if missing:
+            raise ValueError(f"Missing columns: {', '.join(sorted(missing))}")
+
+        chunk = chunk.rename(columns=EXPECTED_COLUMNS)
+        yield line, chunk
+        line += len(chunk)
+
+
+def choose_descriptions(df):
+    """Apply description preference logic to a whole chunk."""
+    desc1 = df["description1"].fillna("")
+    desc2 = df["description2"].fillna("")
+
+    return pd.Series(np.select(
+        [
+            desc1.str.contains("IDP PURCHASE", regex=False),
+            desc1.str.contains(COMBINED_DESCRIPTION_TERMS, regex=True)
+        ],
+        [desc2, (desc1 + " " + desc2).str.strip()],
+        default=desc1
+    ), index=df.index)
+
+
+def normalize_chunk(chunk, first_line):
+    """
+    Validate and normalize a raw chunk. Returns (rows, errors): the valid rows
+    ready for insert and a list of per-row error reports.
+    """
+    raw_dates = chunk["transaction_date"].fillna("").str.strip()
+    raw_amounts = chunk["amount"].fillna("").str.strip()
+
+    dates = pd.to_datetime(raw_dates, format="%m/%d/%Y", errors="coerce")
+    amounts = pd.to_numeric(raw_amounts, errors="coerce")
+
+    bad_date = ~raw_dates.str.match(date_regex_mdy.pattern) | dates.isna()
+    bad_amount = ~(amounts.abs() <= MAX_AMOUNT)  # also catches blanks, NaN and infinities
+
+    errors = []
+    lines = first_line + np.arange(len(chunk))
+    for field, mask, values, message in (
+        ("transaction_date", bad_date, raw_dates, "Invalid date, expected MM/DD/YYYY"),
+        ("amount", bad_amount, raw_amounts, "Invalid amount")
+    ):
+        for line, value in zip(lines[mask.to_numpy()], values[mask]):
+            errors.append({"row": int(line), "field": field, "value": value, "error": message})
+
+    valid = ~(bad_date | bad_amount)
+    rows = pd.DataFrame({
+        "account_type": chunk["account_type"][valid].fillna("").str.strip(),
+        "transaction_date": dates[valid].dt.strftime("%Y-%m-%d"),
+        "description": choose_descriptions(chunk[valid]),
+        "amount": (amounts[valid] * 100).round().astype("int64"),  # Stored as cents
+        "category": db_queries.DEFAULT_CATEGORY_ID
+    })
+
+    errors.sort(key=lambda e: e["row"])
+    return rows, errors
+
+
+def assign_fingerprints(rows, seen):
+    """
+    Add a fingerprint column: the row's normalized identity hash plus its
+    occurrence ordinal within the upload, so repeated identical purchases
+    stay distinct while re-uploading the same file matches them exactly.
+
+    `seen` carries per-identity counts from earlier chunks of the same file,
+    so its size grows with the number of distinct transactions, not rows.
+    """
+    bases = pd.Series([
+        db_queries.fingerprint_base(*values)
+        for values in zip(rows["account_type"], rows["transaction_date"], rows["description"], rows["amount"])
+    ], index=rows.index, dtype=object)
+
+    earlier = pd.Series([seen.get(base, 0) for base in bases], index=rows.index, dtype="int64")
+    ordinals = earlier + bases.groupby(bases).cumcount()
+    for base, count in bases.value_counts().items():
+        seen[base] = seen.get(base, 0) + int(count)
+
+    rows = rows.copy()
+    rows["fingerprint"] = bases + ":" + ordinals.astype(str)
+    return rows
+
+
+def validate_csv(path, on_progress=None, chunksize=CHUNK_SIZE):
+    """
+    First pass over a stored upload: validate every row without writing.
+    Returns a dict with rows, error_count and the first MAX_REPORTED_ERRORS
+    per-row errors. on_progress(rows_so_far) is called after each chunk.
+    """
+    result = {"rows": 0, "error_count": 0, "errors": []}
+
+    with open(path, "rb") as file:
+        for first_line, chunk in read_csv_chunks(file, chunksize):
+            _, errors = normalize_chunk(chunk, first_line)
+            result["rows"] += len(chunk)
+            result["error_count"] += len(errors)
+            room = MAX_REPORTED_ERRORS - len(result["errors"])
+            result["errors"].extend(errors[:max(room, 0)])
+
+            if on_progress:
+                on_progress(result["rows"])
+
+    return result
+
+
+def import_csv(path, skip_chunks=0, on_chunk=None, chunksize=CHUNK_SIZE):
+    """
+    Second pass: fingerprint and insert each chunk of a validated upload.
+    Each chunk is one command for the writer, committed on its own, so
+    progress survives a restart.
+
+    Chunks before skip_chunks were committed by an earlier run; they are
+    re-read only to keep fingerprint ordinals aligned. on_chunk(uow, index,
+    rows, inserted) runs as part of each chunk's command.
+    """
+    seen = {}
+    matcher = rules_service.get_matcher()
+    with open(path, "rb") as file:
+        for index, (first_line, chunk) in enumerate(read_csv_chunks(file, chunksize)):
+            rows, _ = normalize_chunk(chunk, first_line)
+            rows = assign_fingerprints(rows, seen)
+            if index < skip_chunks:
+                continue
+
+            # Rules run here, on the upload's thread; the writer only inserts.
+            rows["category"] = matcher.categorize(rows)
+
+            def write_chunk(uow, index=index, rows=rows, size=len(chunk)):
+                inserted = db_queries.insert_transactions(rows, uow=uow)
+                if on_chunk:
+                    on_chunk(uow, index, size, inserted)
+
+            writer.run(write_chunk)
@@ -0,0 +1,142 @@
+import os
+import hmac
+import time
+import base64
+import hashlib
+import secrets
+import logging
+import threading
+from storage import DB_PATH
+
+SESSION_SECRET = os.environ.get("SESSION_SECRET")
+SECRET_PATH = os.environ.get(
+    "SESSION_SECRET_PATH", os.path.join(os.path.dirname(DB_PATH) or ".", "session_secret.key")
+)
+
+DEFAULT_RATE_LIMIT = 100  # requests per minute
+SESSION_EXPIRY_SECONDS = 3600
+BUCKET_SWEEP_SECONDS = 300
+
+logger = logging.getLogger(__name__)
+
+
+def _load_secret():
+    """Use SESSION_SECRET if set, otherwise a key persisted next to the database."""
+    if SESSION_SECRET:
+        return SESSION_SECRET.encode()
+
+    try:
+        with open(SECRET_PATH, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        pass
+
+    key = secrets.token_bytes(32)
+    try:
+        fd = os.open(SECRET_PATH, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(key)
+        logger.info(f"Session secret created at {SECRET_PATH}")
+        return key
+    except FileExistsError:
+        # Another process created it first; use theirs.
+        with open(SECRET_PATH, "rb") as f:
+            return f.read()
+
+
+_secret = None
+
+
+def _get_secret():
+    global _secret
+    if _secret is None:
+        _secret = _load_secret()
+    return _secret
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+def _b64decode(value):
+    return base64.urlsafe_b64decode(value + "=" * (-len(value) % 4))
+
+
+def _sign(payload):
+    return _b64encode(hmac.new(_get_secret(), payload.encode(), hashlib.sha256).digest())
+
+
+class TokenBucketLimiter:
+    """
+    In-process token bucket per client. Each bucket holds up to `capacity`
+    requests and refills continuously at capacity per `period` seconds.
+    """
+
+    def __init__(self, capacity=DEFAULT_RATE_LIMIT, period=60, sweep_interval=BUCKET_SWEEP_SECONDS):
+        self.capacity = capacity
+        self.refill_rate = capacity / period
+        self.sweep_interval = sweep_interval
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._last_sweep = time.monotonic()
+
+    def allow(self, key):
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.get(key, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - last) * self.refill_rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+
+            if now - self._last_sweep >= self.sweep_interval:
+                self._sweep(now)
+        return allowed
+
+    def _sweep(self, now):
+        # A bucket idle long enough to have refilled is the same as no bucket.
+        full_after = self.capacity / self.refill_rate
+        stale = [key for key, (_, last) in self._buckets.items() if now - last >= full_after]
+        for key in stale:
+            del self._buckets[key]
+        self._last_sweep = now
+        logger.debug(f"Swept {len(stale)} idle rate limit buckets")
+
+
+limiter = TokenBucketLimiter()
+
+
+def create_session_token(ip_address):
+    """Issue a signed token carrying its expiry and the client's address."""
+    expires_at = int(time.time()) + SESSION_EXPIRY_SECONDS
+    payload = f"{expires_at}|{ip_address or ''}|{secrets.token_hex(8)}"
+    encoded = _b64encode(payload.encode())
+    logger.debug(f"Session token created for IP {ip_address}")
+    return f"{encoded}.{_sign(encoded)}"
+
+
+def validate_and_track_token(token):
+    """
+    Verify a token's signature and expiry and charge one request against the
+    client's rate limit. Returns "valid", "invalid", "expired" or "rate_limit".
+    """
+    try:
+        encoded, signature = token.split(".")
+        if not hmac.compare_digest(signature, _sign(encoded)):
+            raise ValueError("Bad signature")
+        expires_at, ip_address, _ = _b64decode(encoded).decode().split("|")
+        expires_at = int(expires_at)
+    except (ValueError, TypeError, UnicodeDecodeError):
+        logger.warning("Invalid session token")
+        return "invalid"
+
+    if expires_at < time.time():
+        logger.info("Expired session token rejected")
+        return "expired"
+
+    if not limiter.allow(ip_address):
+        logger.warning(f"Rate limit exceeded for IP {ip_address}")
+        return "rate_limit"
+
+    return "valid"
@@ -5,7 +5,8 @@ document.addEventListener("DOMContentLoaded", () => {
         e.preventDefault();
 
         const name = document.getElementById("category-name").value.trim();
-        const parentId = document.getElementById("parent-category").value || null;
+        const parentValue = document.getElementById("parent-category").value;
+        const parentId = parentValue ? parseInt(parentValue, 10) : null;
 
         if (!name) return;
 
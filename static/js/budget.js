@@ -1,29 +1,32 @@
 function updateParentValues(parentId) {
     let totalBudget = 0;
-    let totalSpent = 0;
 
+    // A child that is itself a parent shows its rolled-up budget in bold.
     $(`.budget-row[data-parent-id='${parentId}']`).each(function () {
-        const budgetInput = $(this).find('.budget-input').val();
-        const spentText = $(this).find('.budget-cell').eq(3).text().replace('$', '');
-
-        const budget = parseFloat(budgetInput) || 0;
-        const spent = parseFloat(spentText) || 0;
-
-        totalBudget += budget;
-        totalSpent += spent;
+        const input = $(this).find('.budget-input');
+        const budget = input.length ? input.val() : $(this).find('.budget-cell').eq(1).text().replace('$', '');
+        totalBudget += parseFloat(budget) || 0;
     });
 
     const parentRow = $(`.budget-row[data-category-id='${parentId}']`);
 
+    // Spent already rolls up the parent's own and its subcategories' spending.
+    const totalSpent = parseFloat(parentRow.find('.budget-cell').eq(3).text().replace('$', '')) || 0;
+
     parentRow.find('.budget-cell').eq(1).html(`<b>$${totalBudget.toFixed(2)}</b>`);
-    parentRow.find('.budget-cell').eq(3).text(`$${totalSpent.toFixed(2)}`);
 
     const diff = totalBudget - totalSpent;
     const diffCell = parentRow.find('.budget-cell').eq(4);
     diffCell.text(`$${diff.toFixed(2)}`);
 
     applyDiffHighlight(parentRow, diff);
-    calculateBudgetTotals();
+
+    const grandparentId = parentRow.data('parent-id');
+    if (grandparentId) {
+        updateParentValues(grandparentId);
+    } else {
+        calculateBudgetTotals();
+    }
 }
 
 function applyDiffHighlight(row, diff) {
@@ -83,7 +86,7 @@ $(document).on('click', '.toggle-arrow', function () {
     const isVisible = children.is(':visible');
 
     if (isVisible) {
-        children.addClass('d-none');
+        hideDescendants(categoryId);
         arrow.removeClass('bi-chevron-down').addClass('bi-chevron-right');
     } else {
         children.removeClass('d-none');
@@ -91,6 +94,14 @@ $(document).on('click', '.toggle-arrow', function () {
     }
 });
 
+function hideDescendants(categoryId) {
+    $(`.budget-row[data-parent-id='${categoryId}']`).each(function () {
+        $(this).addClass('d-none');
+        $(this).find('.toggle-arrow').removeClass('bi-chevron-down').addClass('bi-chevron-right');
+        hideDescendants($(this).data('category-id'));
+    });
+}
+
 $('#budgetMonth').on('change', function () {
     const selectedMonth = $(this).val();
     window.location.href = `/budget?month=${encodeURIComponent(selectedMonth)}`;
@@ -104,31 +115,58 @@ function setParentBudget(parentId) {
     openSetTotalModal(parentId, function (categoryId, amount) {
         console.log("Modal confirmed for:", categoryId, "Amount:", amount);
 
-        const children = $(`.budget-row[data-parent-id='${categoryId}']`);
+        // Split across direct subcategories that take a budget of their own.
+        const children = $(`.budget-row[data-parent-id='${categoryId}']`).filter(function () {
+            return $(this).find('.budget-input').length > 0;
+        });
         const childCount = children.length;
         if (childCount === 0) return;
 
         const dividedAmount = (amount / childCount).toFixed(2);
+        const updates = [];
 
         children.each(function () {
             $(this).find('.budget-input').val(dividedAmount);
-            saveBudgetValue($(this).data('category-id'), dividedAmount, false); // Suppress per-child toasts
+            updates.push({ category_id: $(this).data('category-id'), amount: parseFloat(dividedAmount) });
         });
 
         updateParentValues(categoryId);
         calculateBudgetTotals();
-        showToast("Budget amount updated.", "success");
+        saveBudgetValues(updates);
     }, totalBudget);
 }
 
+// Save several budgets in one request; either all are saved or none are.
+function saveBudgetValues(updates) {
+    $.ajax({
+        url: '/batch',
+        method: 'POST',
+        contentType: 'application/json',
+        headers: { 'X-Session-Token': SESSION_TOKEN },
+        data: JSON.stringify({
+            operations: updates.map(body => ({ path: '/budget/update', body: body }))
+        }),
+        success: function () {
+            showToast("Budget amount updated.", "success");
+        },
+        error: function (xhr) {
+            let msg = "Error saving budget values.";
+            try {
+                const response = JSON.parse(xhr.responseText);
+                if (response && response.error) msg = response.error;
+            } catch (_) { }
+            showToast(msg, 'error');
+        }
+    });
+}
+
 
 function calculateBudgetTotals() {
     let totalBudget = 0;
     let totalSpent = 0;
 
-    document.querySelectorAll('.budget-row').forEach(row => {
-        if (row.classList.contains('parent-row')) return;
-
+    // Top-level rows already include their subcategories' budgets and spending.
+    document.querySelectorAll('.budget-row[data-category-id]:not([data-parent-id])').forEach(row => {
         const budget = parseFloat(row.querySelector('.budget-input')?.value || row.querySelector('b')?.textContent.replace('$', '') || 0);
         const spent = parseFloat(row.querySelectorAll('.budget-cell')[3]?.textContent.replace('$', '') || 0);
 
@@ -48,7 +48,7 @@ document.addEventListener("DOMContentLoaded", () => {
             const remainingChildren = parentSubList?.querySelectorAll(".subcategory-row");
 
             if (!remainingChildren || remainingChildren.length === 0) {
-                const parentRow = document.querySelector(`.category-row input[data-id="${parentId}"]`)?.closest(".category-row");
+                const parentRow = document.querySelector(`input.editable[data-id="${parentId}"]`)?.closest(".category-row, .subcategory-row");
                 const icon = parentRow?.querySelector(`.toggle-icon[data-bs-target="#subcategory-${parentId}"]`);
                 const subList = document.getElementById(`subcategory-${parentId}`);
 
@@ -31,12 +31,11 @@ function populateMonthOptions(months) {
 
 function loadCharts() {
   const month = document.getElementById("monthGraphFilter").value;
-  const payload = month === "all" ? {} : { month };
+  const query = month && month !== "all" ? `?month=${encodeURIComponent(month)}` : "";
 
-  fetch("/graphs/get/monthly", {
-    method: "POST",
-    headers: { "Content-Type": "application/json", 'X-Session-Token': SESSION_TOKEN },
-    body: JSON.stringify(payload)
+  fetch(`/graphs/get/monthly${query}`, {
+    method: "GET",
+    headers: { 'X-Session-Token': SESSION_TOKEN }
   })
   .then(res => res.json().then(body => ({ status: res.status, body })))
   .then(({ status, body }) => {
@@ -146,7 +145,7 @@ function renderSubcategoryChart(data) {
 }
 
 function renderIncomeExpenseChart(data) {
-  const labels = data.map(entry => entry.month);
+  const labels = data.map(entry => entry.period);
   const incomes = data.map(entry => entry.income);
   const expenses = data.map(entry => Math.abs(entry.expenses));
 
@@ -193,18 +192,24 @@ function renderIncomeExpenseChart(data) {
   });
 }
 
-fetch("/graphs/get/summary", {
-  headers: { 'X-Session-Token': SESSION_TOKEN }
-})
-.then(res => res.json().then(body => ({ status: res.status, body })))
-.then(({ status, body }) => {
-  if (status === 200) {
-    renderIncomeExpenseChart(body);
-  } else {
-    showToast(body.error || "Failed to load income/expense summary.", "error");
-  }
-})
-.catch(() => showToast("An error occurred loading income/expense summary.", "error"));
+function loadIncomeExpenseSummary() {
+  const granularity = document.getElementById("summaryGranularity").value;
+
+  fetch(`/graphs/get/summary?granularity=${granularity}&periods=12`, {
+    headers: { 'X-Session-Token': SESSION_TOKEN }
+  })
+  .then(res => res.json().then(body => ({ status: res.status, body })))
+  .then(({ status, body }) => {
+    if (status === 200) {
+      renderIncomeExpenseChart(body);
+    } else {
+      showToast(body.error || "Failed to load income/expense summary.", "error");
+    }
+  })
+  .catch(() => showToast("An error occurred loading income/expense summary.", "error"));
+}
+
+loadIncomeExpenseSummary();
 
 // On page load
 const savedMonth = localStorage.getItem('selectedGraphMonth');
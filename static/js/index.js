@@ -26,7 +26,7 @@ function addTransaction() {
   .then(res => res.json().then(body => ({ status: res.status, body })))
   .then(({ status, body }) => {
     if (status === 200) {
-      $('#transactionTable').bootstrapTable('refresh', { silent: true });
+      syncChanges();
       clearTransactionForm();
       showToast('Transaction added successfully.', 'success');
     } else {
@@ -49,7 +49,7 @@ function assignCategory(transactionId, categoryId) {
   })
   .then(res => {
     if (res.status === 204) {
-      $('#transactionTable').bootstrapTable('refresh', { silent: true });
+      syncChanges();
       showToast('Category updated successfully.', 'success');
     } else {
       return res.json().then(body => {
@@ -85,7 +85,7 @@ function saveDescriptionEdit(inputElement, rowId) {
   })
   .then(res => {
       if (res.status === 204) {
-          $('#transactionTable').bootstrapTable('refresh', { silent: true });
+          syncChanges();
           showToast('Description updated.', 'success');
       } else {
           return res.json().then(body => {
@@ -99,6 +99,46 @@ function saveDescriptionEdit(inputElement, rowId) {
 
 }
 
+// Apply what changed since the last sync to the table instead of reloading
+// it. Edits to rows on the current page are patched in place; anything
+// that moves rows between pages (adds, deletes) still refreshes the page.
+// Large batches of changes come in pages, followed by their cursor.
+function syncChanges() {
+  const table = $('#transactionTable');
+  const since = changeVersion;
+  const changes = [];
+
+  const fetchPage = cursor => {
+    const query = cursor ? `since=${since}&cursor=${encodeURIComponent(cursor)}` : `since=${since}`;
+    return fetch(`/changes?${query}`, { headers: { 'X-Session-Token': SESSION_TOKEN } })
+      .then(res => res.json())
+      .then(body => {
+        if (!body.success) {
+          throw new Error(body.error);
+        }
+        changes.push(...body.changes.filter(change => change.table === 'transactions'));
+        return body.cursor && !body.reset ? fetchPage(body.cursor) : body;
+      });
+  };
+
+  fetchPage(null)
+    .then(body => {
+      changeVersion = body.version;
+      if (body.reset || changes.some(change => change.operation !== 'update' || !change.row)) {
+        table.bootstrapTable('refresh', { silent: true });
+        return;
+      }
+      changes.forEach(change => {
+        if (table.bootstrapTable('getRowByUniqueId', change.id)) {
+          table.bootstrapTable('updateByUniqueId', { id: change.id, row: change.row, replace: true });
+        }
+      });
+    })
+    .catch(() => {
+      table.bootstrapTable('refresh', { silent: true });
+    });
+}
+
 function clearTransactionForm() {
   document.getElementById("accountType").value = "";
   document.getElementById("transactionDate").value = "";
@@ -112,26 +152,24 @@ function amountFormatter(value) {
   return isNaN(num) ? "$0.00" : `$${num.toFixed(2)}`;
 }
 
-function totalAmountFormatter(data) {
-  const total = data.reduce((sum, row) => {
-    const amount = parseFloat(row.amount);
-    return sum + (isNaN(amount) ? 0 : amount);
-  }, 0);
-  return `$${total.toFixed(2)}`;
+function totalAmountFormatter() {
+  // The server totals every row matching the current filters, not just this page.
+  const total = parseFloat(tableFooter.amount);
+  return `$${(isNaN(total) ? 0 : total).toFixed(2)}`;
 }
 
 function categoryFormatter(value, row) {
   let html = `<select class="form-select form-select-sm" onchange="assignCategory(${row.id}, this.value)">`;
 
-  categories.forEach(cat => {
-    const selected = cat.id === row.category ? "selected" : "";
-    html += `<option value="${cat.id}" ${selected}>${cat.name}</option>`;
-
-    (cat.subcategories || []).forEach(sub => {
-      const subSelected = sub.id === row.category ? "selected" : "";
-      html += `<option value="${sub.id}" ${subSelected}>&nbsp;&nbsp;&#10551; ${sub.name}</option>`;
+  const addOptions = (cats, depth) => {
+    cats.forEach(cat => {
+      const selected = cat.id === row.category ? "selected" : "";
+      const prefix = depth ? `${"&nbsp;&nbsp;".repeat(depth)}&#10551; ` : "";
+      html += `<option value="${cat.id}" ${selected}>${prefix}${cat.name}</option>`;
+      addOptions(cat.subcategories || [], depth + 1);
     });
-  });
+  };
+  addOptions(categories, 0);
 
   html += "</select>";
   return html;
@@ -160,7 +198,7 @@ window.actionEvents = {
       fetch(`/transaction/delete/${row.id}`, { method: 'DELETE', headers: { 'X-Session-Token': SESSION_TOKEN } })
         .then(res => {
           if (res.status === 204) {
-            $('#transactionTable').bootstrapTable('refresh', { silent: true });
+            syncChanges();
             showToast('Transaction deleted', 'success');
           } else {
             return res.json().then(body => {
@@ -248,9 +286,9 @@ dropArea.addEventListener('drop', e => {
   })
   .then(res => res.json().then(body => ({ status: res.status, body })))
   .then(({ status, body }) => {
-    if (status === 200) {
-      showToast('File uploaded successfully.', 'success');
-      window.location.reload();
+    if (status === 202) {
+      showToast('File uploaded, importing...', 'success');
+      pollUploadStatus(body.job_id);
     } else {
       showToast(body.error || 'Upload failed.', 'error');
     }
@@ -260,9 +298,32 @@ dropArea.addEventListener('drop', e => {
   });
 });
 
+// Poll a background upload job until it completes or fails
+function pollUploadStatus(jobId) {
+  fetch(`/upload/status/${jobId}`, { headers: { 'X-Session-Token': SESSION_TOKEN } })
+  .then(res => res.json().then(body => ({ status: res.status, body })))
+  .then(({ status, body }) => {
+    if (status !== 200) {
+      showToast(body.error || 'Upload failed.', 'error');
+    } else if (body.phase === 'completed') {
+      showToast(`Imported ${body.inserted} transactions (${body.duplicates} duplicates skipped).`, 'success');
+      window.location.reload();
+    } else if (body.phase === 'failed') {
+      const firstError = (body.errors || [])[0];
+      const detail = firstError ? ` (row ${firstError.row}: ${firstError.error})` : '';
+      showToast((body.message || 'Upload failed.') + detail, 'error');
+    } else {
+      setTimeout(() => pollUploadStatus(jobId), 1000);
+    }
+  })
+  .catch(() => {
+    showToast('Lost track of the upload, refresh to see its results.', 'error');
+  });
+}
+
 // On change
 $('#monthFilter').on('change', function() {
     selectedMonth = $(this).val();
     localStorage.setItem('selectedMonthFilter', selectedMonth);
-    $('#transactionTable').bootstrapTable('refresh', { silent: true });
+    $('#transactionTable').bootstrapTable('refresh', { silent: true, pageNumber: 1 });
 });
\ No newline at end of file
@@ -1,95 +1,150 @@
 import sqlite3
 import os
-import time
-import secrets
+import re
+import queue
 import logging
+import threading
 
 DB_PATH = os.environ.get("DB_PATH", "data/transactions.db")
 CONFIG_PATH = os.environ.get("CONFIG_PATH", "data/settings.json")
 
-DEFAULT_RATE_LIMIT = 100  # requests per minute
-SESSION_EXPIRY_SECONDS = 3600
+POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 8))
+CACHED_STATEMENTS = 256
+
+# Applied once when a connection is opened; pooled connections keep them.
+CONNECTION_PRAGMAS = (
+    ("journal_mode", "WAL"),
+    ("synchronous", "NORMAL"),     # safe with WAL, avoids an fsync per commit
+    ("cache_size", -20000),        # ~20 MB page cache
+    ("mmap_size", 268435456),      # 256 MB memory-mapped I/O
+    ("temp_store", "MEMORY"),
+    ("foreign_keys", "ON"),        # category references are checked by SQLite
+)
 
 logger = logging.getLogger(__name__)
 
+_pool = queue.LifoQueue(maxsize=POOL_SIZE)
+_local = threading.local()
+
+
+class PooledConnection(sqlite3.Connection):
+    """
+    sqlite3 connection whose close() hands it back to the pool. Inside a
+    request scope the connection stays checked out until the scope ends.
+    """
+
+    def close(self):
+        if getattr(_local, "conn", None) is self:
+            return
+        _checkin(self)
+
+
+def _regexp(pattern, value):
+    """SQL REGEXP operator: `value REGEXP pattern` searches value for pattern."""
+    return value is not None and re.search(pattern, value) is not None
+
+
+def _open_connection(factory=PooledConnection, isolation_level=""):
+    conn = sqlite3.connect(
+        DB_PATH,
+        timeout=5,
+        factory=factory,
+        isolation_level=isolation_level,
+        cached_statements=CACHED_STATEMENTS,
+        check_same_thread=False
+    )
+    conn.row_factory = sqlite3.Row
+    conn.create_function("REGEXP", 2, _regexp, deterministic=True)
+    for name, value in CONNECTION_PRAGMAS:
+        conn.execute(f"PRAGMA {name} = {value}")
+    logger.debug("Database connection established")
+    return conn
+
+
+def _checkout():
+    try:
+        return _pool.get_nowait()
+    except queue.Empty:
+        return _open_connection()
+
+
+def _checkin(conn):
+    try:
+        if conn.in_transaction:
+            conn.rollback()
+            logger.warning("Rolled back uncommitted transaction on connection release")
+        _pool.put_nowait(conn)
+    except queue.Full:
+        sqlite3.Connection.close(conn)
+    except sqlite3.Error as e:
+        logger.error(f"Discarding broken database connection: {e}")
+        sqlite3.Connection.close(conn)
+
+
 def get_connection():
+    """
+    Return a pooled connection. Within a request scope every call returns the
+    same connection; elsewhere each call checks out its own until close().
+    """
     try:
-        conn = sqlite3.connect(DB_PATH, timeout=5)
-        conn.row_factory = sqlite3.Row
-        logger.debug("Database connection established")
-        return conn
+        if getattr(_local, "scoped", False):
+            if _local.conn is None:
+                _local.conn = _checkout()
+            return _local.conn
+        return _checkout()
     except Exception as e:
         logger.error(f"Failed to connect to database: {e}", exc_info=True)
         raise
 
-def create_session_token(ip_address):
-    token = secrets.token_hex(128)
-    now = int(time.time())
-    conn = get_connection()
-    conn.execute("""
-        INSERT INTO session_tokens (token, created_at, expires_at, ip_address, rate_limit)
-        VALUES (?, ?, ?, ?, ?)
-    """, (token, now, now + SESSION_EXPIRY_SECONDS, ip_address, DEFAULT_RATE_LIMIT))
-    conn.commit()
-    conn.close()
-    logger.info(f"Session token created for IP {ip_address}")
-    return token
-
-def validate_and_track_token(token):
-    conn = get_connection()
-    row = conn.execute("""
-        SELECT expires_at, window_start, request_count, rate_limit FROM session_tokens WHERE token = ?
-    """, (token,)).fetchone()
-
-    if not row:
-        logger.warning(f"Invalid session token: {token}")
-        return "invalid"
-
-    now = int(time.time())
-    if row["expires_at"] < now:
-        conn.execute("DELETE FROM session_tokens WHERE token = ?", (token,))
-        conn.commit()
-        conn.close()
-        logger.info(f"Expired session token removed: {token}")
-        return "expired"
-
-    window_start = row["window_start"]
-    request_count = row["request_count"]
-    rate_limit = row["rate_limit"]
-
-    current_window = now - (now % 60)
-    if window_start != current_window:
-        request_count = 1
-        window_start = current_window
-    else:
-        if request_count >= rate_limit:
-            conn.close()
-            logger.warning(f"Rate limit exceeded for token: {token}")
-            return "rate_limit"
-        request_count += 1
-
-    conn.execute("""
-        UPDATE session_tokens SET window_start = ?, request_count = ? WHERE token = ?
-    """, (window_start, request_count, token))
-    conn.commit()
-    conn.close()
-    logger.debug(f"Session token {token} validated and updated")
-    return "valid"
-
-def get_active_token_for_ip(ip_address):
-    now = int(time.time())
-    conn = get_connection()
-    row = conn.execute("""
-        SELECT token FROM session_tokens
-        WHERE ip_address = ? AND expires_at > ?
-        ORDER BY created_at DESC
-        LIMIT 1
-    """, (ip_address, now)).fetchone()
-    conn.close()
-
-    if row:
-        logger.debug(f"Active token retrieved for IP {ip_address}")
-        return row["token"]
-    else:
-        logger.debug(f"No active token found for IP {ip_address}")
-        return None
+
+def open_write_connection():
+    """An unpooled autocommit connection for the writer thread, which issues BEGIN itself."""
+    return _open_connection(factory=sqlite3.Connection, isolation_level=None)
+
+
+def open_request_scope():
+    """Share one connection across all queries until close_request_scope()."""
+    _local.scoped = True
+    _local.conn = None
+
+
+def close_request_scope(exc=None):
+    """Return the request's connection to the pool, rolling back anything uncommitted."""
+    conn = getattr(_local, "conn", None)
+    _local.scoped = False
+    _local.conn = None
+    if conn is not None:
+        _checkin(conn)
+
+
+class MissingReference(Exception):
+    """A write referred to a row that does not exist (a foreign key failed)."""
+
+
+class UnitOfWork:
+    """A command's handle on the writer's transaction; after_commit callbacks run after COMMIT."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.callbacks = []
+
+    def execute(self, sql, params=()):
+        try:
+            return self.conn.execute(sql, params)
+        except sqlite3.IntegrityError as e:
+            if "FOREIGN KEY" in str(e):
+                raise MissingReference(str(e)) from e
+            raise
+
+    def after_commit(self, callback):
+        self.callbacks.append(callback)
+
+
+def close_all_connections():
+    """Close every idle pooled connection."""
+    while True:
+        try:
+            conn = _pool.get_nowait()
+        except queue.Empty:
+            break
+        sqlite3.Connection.close(conn)
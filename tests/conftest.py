@@ -0,0 +1,56 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# Point storage at a scratch database before any app module reads DB_PATH.
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ["DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="budget-tests-"), "transactions.db")
+
+import cache
+import columnar
+import db_queries
+import storage
+import services.setup as setup_service
+
+DATA_TABLES = ("transactions", "budgets", "categorization_rules", "categories", "change_log", "upload_jobs")
+
+
+@pytest.fixture
+def db():
+    """A migrated database, emptied again after the test (bar the default category)."""
+    setup_service.initialize_database()
+    yield
+    conn = storage.get_connection()
+    try:
+        for table in DATA_TABLES:
+            conn.execute(f"DELETE FROM {table}")
+        conn.execute(
+            "INSERT INTO categories (id, name, parent_id, include_in_budget) VALUES (?, 'Unassigned', NULL, 1)",
+            (db_queries.DEFAULT_CATEGORY_ID,)
+        )
+        conn.commit()
+    finally:
+        conn.close()
+    columnar.reset()
+    cache.bump("transactions", "categories", "budgets", "rules")
+
+
+@pytest.fixture
+def category(db):
+    """Id of a budgeted category."""
+    import services.categories as categories_service
+    return categories_service.add_category("Groceries")["id"]
+
+
+@pytest.fixture
+def client(db, monkeypatch):
+    """A Flask test client sending a valid session token, with a fresh rate limit."""
+    import app as app_module
+    import sessions
+    monkeypatch.setattr(sessions, "limiter", sessions.TokenBucketLimiter())
+    client = app_module.app.test_client()
+    client.environ_base["HTTP_X_SESSION_TOKEN"] = sessions.create_session_token("127.0.0.1")
+    return client
@@ -0,0 +1,50 @@
+import pytest
+
+import services.budgets as budgets_service
+import services.categories as categories_service
+
+
+def batch(client, body):
+    response = client.post("/batch", json=body)
+    return response.status_code, response.get_json()
+
+
+@pytest.mark.parametrize("body", [
+    [1, 2],
+    "operations",
+    {"operations": "all"},
+    {"operations": []},
+    {"operations": [1]},
+    {"operations": [{"method": 5, "path": "/budget/update"}]},
+    {"operations": [{"method": "POST", "path": 5}]},
+    {"operations": [{"path": "/budget/update", "body": [1]}]},
+    {"operations": [{"method": "GET", "path": "/budget/update"}]},
+])
+def test_malformed_batches_get_a_400(client, body):
+    status, response = batch(client, body)
+    assert status == 400 and not response["success"]
+
+
+def test_a_failing_operation_rolls_back_the_earlier_ones(client, category):
+    status, response = batch(client, {"operations": [
+        {"path": "/budget/update", "body": {"category_id": category, "amount": 250}},
+        {"path": "/categories/add", "body": {"name": "Dining"}},
+        {"path": "/categories/update", "body": {"id": 9999, "new_name": "Ghost"}},
+    ]})
+
+    assert (status, response["index"]) == (404, 2)
+    budgets = {row["category_id"]: row for row in budgets_service.get_budget_status(None)}
+    assert budgets[category]["budget"] == 0.0
+    assert "Dining" not in [row["name"] for row in categories_service.get_categories()]
+
+
+def test_operations_apply_in_order(client, category):
+    status, response = batch(client, {"operations": [
+        {"method": "post", "path": "/categories/add", "body": {"name": "Dining", "parent_id": category}},
+        {"path": "/budget/update", "body": {"category_id": category, "amount": 250}},
+    ]})
+
+    assert status == 200
+    assert [result.get("name") for result in response["results"]] == ["Dining", None]
+    budgets = {row["category_id"]: row for row in budgets_service.get_budget_status(None)}
+    assert budgets[category]["budget"] == 250.0
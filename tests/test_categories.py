@@ -0,0 +1,110 @@
+import pytest
+
+import db_queries
+import storage
+import services.budgets as budgets_service
+import services.categories as categories_service
+import services.setup as setup_service
+import services.transactions as transactions_service
+
+
+def add_category(name, parent_id=None):
+    return categories_service.add_category(name, parent_id)["id"]
+
+
+def spend(category, amount):
+    transactions_service.add_transaction({
+        "account_type": "Visa", "transaction_date": "2024-03-10",
+        "description": "Shop", "amount": amount, "category": category
+    })
+
+
+def test_tree_handles_any_depth(db):
+    top = add_category("Home")
+    middle = add_category("Utilities", top)
+    leaf = add_category("Power", middle)
+    deepest = add_category("Solar", leaf)
+
+    tree = categories_service.get_tree()
+    assert sorted(tree.descendants(top)) == sorted([middle, leaf, deepest])
+    assert [node["id"] for node in tree.path(deepest)] == [top, middle, leaf, deepest]
+    assert tree.get(deepest)["depth"] == 3
+    assert [node["id"] for node in tree.walk() if node["id"] != db_queries.DEFAULT_CATEGORY_ID] == [top, middle, leaf, deepest]
+
+
+def test_budgets_roll_up_through_every_level(db):
+    top = add_category("Home")
+    middle = add_category("Utilities", top)
+    leaf = add_category("Power", middle)
+    other = add_category("Water", middle)
+    budgets_service.update_budget(leaf, 100)
+    budgets_service.update_budget(other, 50)
+    spend(leaf, -30)
+    spend(other, -20)
+    spend(middle, -5)
+
+    status = {row["category_id"]: row for row in budgets_service.get_budget_status("2024-03")}
+    assert status[top]["rollup_budget"] == 150
+    assert status[top]["rollup_spent"] == 55.0
+    assert status[middle]["spent"] == 5.0
+    assert status[middle]["rollup_spent"] == 55.0
+    assert status[leaf]["rollup_spent"] == 30.0
+
+
+def test_deleting_a_category_reparents_and_reassigns(db):
+    top = add_category("Home")
+    middle = add_category("Utilities", top)
+    leaf = add_category("Power", middle)
+    spend(middle, -5)
+
+    assert categories_service.delete_category(middle)
+
+    tree = categories_service.get_tree()
+    assert not tree.exists(middle)
+    assert tree.get(leaf)["parent_id"] is None and tree.get(leaf)["depth"] == 0
+    assert tree.descendants(top) == []
+    assert len(db_queries.get_transactions_in_category_batch(db_queries.DEFAULT_CATEGORY_ID, 0, 10)) == 1
+
+
+def closure_rows():
+    conn = storage.get_connection()
+    try:
+        stored = conn.execute("SELECT ancestor, descendant, depth FROM category_closure ORDER BY 1, 2").fetchall()
+        expected = conn.execute(f"SELECT * FROM ({setup_service.EXPECTED_CATEGORY_CLOSURE}) ORDER BY 1, 2").fetchall()
+    finally:
+        conn.close()
+    return [tuple(row) for row in stored], [tuple(row) for row in expected]
+
+
+def test_moving_a_category_relinks_its_subtree(db):
+    home = add_category("Home")
+    utilities = add_category("Utilities", home)
+    power = add_category("Power", utilities)
+    car = add_category("Car")
+    budgets_service.update_budget(power, 80)
+    spend(power, -25)
+
+    assert categories_service.move_category(utilities, car) == {"id": utilities, "parent_id": car}
+
+    stored, expected = closure_rows()
+    assert stored == expected
+    assert (car, power, 2) in stored and (home, power, 2) not in stored
+    status = {row["category_id"]: row for row in budgets_service.get_budget_status("2024-03")}
+    assert status[car]["rollup_spent"] == 25.0 and status[car]["rollup_budget"] == 80
+    assert status[home]["rollup_spent"] == 0.0 and status[home]["rollup_budget"] == 0
+
+    categories_service.move_category(utilities, None)
+    stored, expected = closure_rows()
+    assert stored == expected
+    assert [row for row in stored if row[1] == power] == [(utilities, power, 1), (power, power, 0)]
+
+
+def test_a_category_cannot_move_below_itself(db):
+    home = add_category("Home")
+    utilities = add_category("Utilities", home)
+
+    for parent in (home, utilities):
+        with pytest.raises(categories_service.CategoryCycle):
+            categories_service.move_category(home, parent)
+    assert categories_service.move_category(999, home) is None
+    assert closure_rows()[0] == closure_rows()[1]
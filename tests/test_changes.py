@@ -0,0 +1,106 @@
+import pytest
+
+import storage
+import services.changes as changes_service
+import services.transactions as transactions_service
+
+
+def add(category, description="Coffee", amount=-4):
+    return transactions_service.add_transaction({
+        "account_type": "Visa",
+        "transaction_date": "2024-03-10",
+        "description": description,
+        "amount": amount,
+        "category": category
+    })
+
+
+def log_size():
+    conn = storage.get_connection()
+    try:
+        return conn.execute("SELECT COUNT(*) FROM change_log").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_changes_carry_each_rows_latest_state(category):
+    since = changes_service.current_version()
+    row = add(category)
+    transactions_service.update_transaction_description(row["id"], "Tea")
+    gone = add(category, "Cake")
+    transactions_service.delete_transaction(gone["id"])
+
+    feed = changes_service.get_changes(since)
+    assert not feed["reset"]
+    assert feed["version"] == changes_service.current_version()
+    by_id = {change["id"]: change for change in feed["changes"] if change["table"] == "transactions"}
+    assert by_id[row["id"]]["operation"] == "insert"
+    assert by_id[row["id"]]["row"]["description"] == "Tea"
+    assert by_id[gone["id"]]["operation"] == "delete"
+    assert by_id[gone["id"]]["row"] is None
+
+    assert changes_service.get_changes(feed["version"])["changes"] == []
+
+
+def test_clearing_transactions_logs_one_reset(category):
+    for i in range(20):
+        add(category, f"Row {i}")
+    since = changes_service.current_version()
+    size = log_size()
+
+    transactions_service.clear_all_transactions()
+
+    assert log_size() == size - 20 + 1
+    feed = changes_service.get_changes(since)
+    assert feed["reset"] and feed["version"] == since + 1
+    assert not changes_service.get_changes(feed["version"])["reset"]
+
+
+def test_clients_behind_a_compaction_reset(category):
+    since = changes_service.current_version()
+    for i in range(5):
+        add(category, f"Row {i}")
+
+    changes_service.compact(keep=2)
+
+    assert changes_service.get_changes(since)["reset"]
+    latest = changes_service.current_version()
+    assert len(changes_service.get_changes(latest - 2)["changes"]) == 2
+
+
+def read_rest(since, limit, first):
+    """The pages of changes from `since` that follow the page `first`."""
+    pages = [first]
+    while pages[-1]["cursor"]:
+        pages.append(changes_service.get_changes(since, limit=limit, cursor=pages[-1]["cursor"]))
+    return pages
+
+
+def test_more_changes_than_the_limit_come_in_pages(category):
+    since = changes_service.current_version()
+    rows = [add(category, f"Row {i}") for i in range(7)]
+    transactions_service.update_transaction_description(rows[0]["id"], "Edited")
+    version = changes_service.current_version()
+
+    first = changes_service.get_changes(since, limit=3)
+    # Written between pages: left for the next sync, not this one.
+    late = add(category, "Late")
+    pages = read_rest(since, 3, first)
+
+    assert [len(page["changes"]) for page in pages] == [3, 3, 1]
+    assert not any(page["reset"] for page in pages)
+    assert {page["version"] for page in pages} == {version}
+    changes = [change for page in pages for change in page["changes"]]
+    assert sorted(change["id"] for change in changes) == sorted(row["id"] for row in rows)
+    assert {change["operation"] for change in changes} == {"insert"}
+    assert next(c for c in changes if c["id"] == rows[0]["id"])["row"]["description"] == "Edited"
+
+    follow_up = changes_service.get_changes(version, limit=3)
+    assert [change["id"] for change in follow_up["changes"]] == [late["id"]]
+    assert follow_up["cursor"] is None
+
+
+@pytest.mark.parametrize("cursor", ["junk", changes_service.encode_cursor(5, 9), changes_service.encode_cursor(9, -1)])
+def test_malformed_change_cursors_are_rejected(client, cursor):
+    response = client.get("/changes", query_string={"since": 3, "cursor": cursor})
+    assert response.status_code == 400
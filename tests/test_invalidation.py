@@ -0,0 +1,90 @@
+import cache
+import columnar
+import services.budgets as budgets_service
+import services.transactions as transactions_service
+
+
+def add(category, amount, day="2024-03-10"):
+    return transactions_service.add_transaction({
+        "account_type": "Visa",
+        "transaction_date": day,
+        "description": f"Shop {amount}",
+        "amount": amount,
+        "category": category
+    })
+
+
+def spent(category, month="2024-03"):
+    _, _, status = budgets_service.get_budget_page(month)
+    return next(row["spent"] for row in status if row["category_id"] == category)
+
+
+@cache.memoized("transactions")
+def stored_rows():
+    return len(columnar.snapshot())
+
+
+def read_between_invalidation_steps(monkeypatch):
+    """Run memoized reads right after the first of mark_changed/reset/bump."""
+    state = {"read": False}
+
+    def after(f):
+        def wrapped(*args):
+            result = f(*args)
+            if not state["read"]:
+                state["read"] = True
+                budgets_service.get_budget_page("2024-03")
+                stored_rows()
+            return result
+        return wrapped
+
+    monkeypatch.setattr(columnar, "mark_changed", after(columnar.mark_changed))
+    monkeypatch.setattr(columnar, "reset", after(columnar.reset))
+    monkeypatch.setattr(cache, "bump", after(cache.bump))
+    return state
+
+
+def test_reads_follow_inserts(category):
+    add(category, -10)
+    assert spent(category) == 10.0
+    add(category, -5)
+    assert spent(category) == 15.0
+
+
+def test_read_during_invalidation_is_not_cached_as_current(category, monkeypatch):
+    add(category, -10)
+    assert spent(category) == 10.0
+
+    state = read_between_invalidation_steps(monkeypatch)
+    add(category, -5)
+    assert state["read"]
+    assert spent(category) == 15.0
+
+
+def test_read_during_clear_is_not_cached_as_current(category, monkeypatch):
+    add(category, -10)
+    assert spent(category) == 10.0
+
+    assert stored_rows() == 1
+
+    read_between_invalidation_steps(monkeypatch)
+    transactions_service.clear_all_transactions()
+    assert stored_rows() == 0
+
+
+def test_updates_reach_the_columnar_store(category):
+    import services.categories as categories_service
+    import services.graphs as graphs_service
+    other = categories_service.add_category("Dining")["id"]
+    row = add(category, -10)
+    assert spent(category) == 10.0
+    assert graphs_service.get_income_expense_summary(1, "week")[0]["expenses"] == -10.0
+
+    transactions_service.update_transaction_category(row["id"], other)
+    assert spent(category) == 0.0
+    assert spent(other) == 10.0
+
+    transactions_service.delete_transaction(row["id"])
+    assert spent(other) == 0.0
+    assert len(columnar.snapshot()) == 0
+    assert graphs_service.get_income_expense_summary(1, "week") == []
@@ -0,0 +1,184 @@
+import sqlite3
+
+import db_queries
+import storage
+import services.categories as categories_service
+import services.setup as setup_service
+import services.transactions as transactions_service
+
+# The original schema, as databases from before the first migration have it.
+BASELINE_SCHEMA = '''
+    CREATE TABLE categories (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        parent_id INTEGER,
+        include_in_budget INTEGER,
+        FOREIGN KEY (parent_id) REFERENCES categories(id)
+    );
+    CREATE TABLE transactions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        account_type TEXT,
+        transaction_date TEXT,
+        description TEXT,
+        amount TEXT,
+        category INTEGER DEFAULT 1,
+        FOREIGN KEY (category) REFERENCES categories(id)
+    );
+    CREATE TABLE budgets (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        category_id INTEGER UNIQUE,
+        amount REAL NOT NULL,
+        FOREIGN KEY (category_id) REFERENCES categories(id)
+    );
+'''
+
+
+def baseline_db(path, transactions):
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    conn.executescript(BASELINE_SCHEMA)
+    conn.executemany("INSERT INTO categories (id, name, parent_id, include_in_budget) VALUES (?, ?, ?, 1)", [
+        (1, "Unassigned", None), (2, "Food", None), (3, "Groceries", 2), (4, "Orphan", 99)
+    ])
+    conn.executemany('''
+        INSERT INTO transactions (account_type, transaction_date, description, amount, category)
+        VALUES (?, ?, ?, ?, ?)
+    ''', transactions)
+    conn.execute("INSERT INTO budgets (category_id, amount) VALUES (3, 200), (99, 50)")
+    conn.commit()
+    return conn
+
+
+def test_migrations_upgrade_a_baseline_database(tmp_path):
+    conn = baseline_db(tmp_path / "old.db", [
+        ("Visa", "2024-01-05", "Market", "12.50", 3),
+        ("Visa", "2024-01-05", "Market", "12.5", 3),
+        ("Visa", "2024-02-01", "Refund", "-3", 2),
+        ("Visa", "2024-02-03", "Broken", "abc", 2),
+        ("Visa", "2024-02-09", "Gone", "7", 42),
+    ])
+
+    setup_service.apply_migrations(conn)
+
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == len(setup_service.MIGRATIONS)
+    rows = {row["description"]: row for row in conn.execute("SELECT * FROM transactions")}
+    assert rows["Refund"]["amount"] == -300
+    assert rows["Broken"]["amount"] is None
+    assert rows["Gone"]["category"] == db_queries.DEFAULT_CATEGORY_ID
+    assert rows["Market"]["year_month"] == "2024-01"
+
+    base = db_queries.fingerprint_base("Visa", "2024-01-05", "Market", 1250)
+    fingerprints = [row[0] for row in conn.execute("SELECT fingerprint FROM transactions ORDER BY id")]
+    assert fingerprints[:2] == [db_queries.make_fingerprint(base, 0), db_queries.make_fingerprint(base, 1)]
+    assert len(set(fingerprints)) == len(fingerprints)
+
+    assert conn.execute("SELECT parent_id FROM categories WHERE id = 4").fetchone()[0] is None
+    assert [row[0] for row in conn.execute("SELECT category_id FROM budgets")] == [3]
+    assert conn.execute("PRAGMA foreign_key_check").fetchall() == []
+
+    months = [tuple(row) for row in conn.execute("SELECT * FROM transaction_months ORDER BY year_month")]
+    assert months == [("2024-01", 2, "2024-01-05", "2024-01-05"), ("2024-02", 3, "2024-02-01", "2024-02-09")]
+    matches = conn.execute("SELECT rowid FROM transactions_fts WHERE transactions_fts MATCH 'groceries'").fetchall()
+    assert len(matches) == 2
+
+    totals = conn.execute("SELECT category, year_month, sign, total, count FROM monthly_category_totals ORDER BY 1, 2, 3")
+    assert [tuple(row) for row in totals] == [(1, "2024-02", 1, 700, 1), (2, "2024-02", -1, -300, 1), (3, "2024-01", 1, 2500, 2)]
+    closure = conn.execute("SELECT ancestor, descendant, depth FROM category_closure WHERE descendant = 3 ORDER BY depth")
+    assert [tuple(row) for row in closure] == [(3, 3, 0), (2, 3, 1)]
+    assert "transactions_v1" not in {row[0] for row in conn.execute("SELECT name FROM sqlite_master")}
+    conn.close()
+
+
+def test_fingerprint_ordinals_carry_across_batches(tmp_path, monkeypatch):
+    monkeypatch.setattr(setup_service, "MIGRATION_BATCH_SIZE", 2)
+    descriptions = ["Market", "Cafe", "Market", "Market", "Cafe", "Rent", "Market"]
+    conn = baseline_db(tmp_path / "old.db", [("Visa", "2024-01-05", d, "4", 2) for d in descriptions])
+
+    setup_service.apply_migrations(conn)
+
+    fingerprints = [row[0] for row in conn.execute("SELECT fingerprint FROM transactions ORDER BY id")]
+    ordinals = [int(fingerprint.rsplit(":", 1)[1]) for fingerprint in fingerprints]
+    assert ordinals == [0, 0, 1, 2, 1, 0, 3]
+    assert "fingerprint_counts" not in {row[0] for row in conn.execute("SELECT name FROM sqlite_master")}
+
+    # Re-running, as after an interruption, recomputes the same fingerprints.
+    setup_service.migrate_transaction_fingerprints(conn)
+    assert [row[0] for row in conn.execute("SELECT fingerprint FROM transactions ORDER BY id")] == fingerprints
+    conn.close()
+
+
+def test_migrations_are_a_no_op_when_current(tmp_path):
+    conn = baseline_db(tmp_path / "old.db", [("Visa", "2024-01-05", "Market", "1", 3)])
+    setup_service.apply_migrations(conn)
+    schema = conn.execute("SELECT sql FROM sqlite_master ORDER BY name").fetchall()
+
+    setup_service.apply_migrations(conn)
+
+    assert conn.execute("SELECT sql FROM sqlite_master ORDER BY name").fetchall() == schema
+    assert conn.execute("SELECT COUNT(*) FROM transactions").fetchone()[0] == 1
+    conn.close()
+
+
+def test_triggers_keep_derived_tables_in_sync(category):
+    other = categories_service.add_category("Dining")["id"]
+    rows = [
+        transactions_service.add_transaction({
+            "account_type": "Visa",
+            "transaction_date": day,
+            "description": f"Shop {i}",
+            "amount": -10 * (i + 1),
+            "category": category
+        })
+        for i, day in enumerate(["2024-01-31", "2024-02-01", "2024-02-15", "2024-03-01"])
+    ]
+    transactions_service.update_transaction_category(rows[0]["id"], other)
+    transactions_service.update_transaction_description(rows[1]["id"], "Renamed")
+    transactions_service.delete_transaction(rows[2]["id"])
+    categories_service.update_category_name(other, "Restaurants")
+    categories_service.delete_category(category)
+
+    assert setup_service.check_aggregates() == []
+    assert transactions_service.get_transaction_months() == ["2024-03", "2024-02", "2024-01"]
+
+    transactions_service.clear_all_transactions()
+    assert setup_service.check_aggregates() == []
+    assert transactions_service.get_transaction_months() == []
+
+
+def monthly_totals():
+    conn = storage.get_connection()
+    try:
+        stored = conn.execute("SELECT category, year_month, sign, total, count FROM monthly_category_totals ORDER BY 1, 2, 3")
+        expected = conn.execute(f"SELECT * FROM ({setup_service.EXPECTED_MONTHLY_TOTALS}) ORDER BY 1, 2, 3")
+        return [tuple(row) for row in stored], [tuple(row) for row in expected]
+    finally:
+        conn.close()
+
+
+def test_monthly_totals_match_a_fresh_group_by(category):
+    other = categories_service.add_category("Dining")["id"]
+    rows = [
+        transactions_service.add_transaction({
+            "account_type": "Visa",
+            "transaction_date": day,
+            "description": f"Shop {i}",
+            "amount": amount,
+            "category": category
+        })
+        for i, (day, amount) in enumerate([("2024-01-31", -12.5), ("2024-02-01", 40), ("2024-02-15", -7), ("2024-02-20", -3)])
+    ]
+    stored, expected = monthly_totals()
+    assert stored == expected
+    assert (category, "2024-02", -1, -1000, 2) in stored
+
+    transactions_service.update_transaction_category(rows[0]["id"], other)
+    transactions_service.delete_transaction(rows[2]["id"])
+    stored, expected = monthly_totals()
+    assert stored == expected
+    assert (category, "2024-01", -1) not in [row[:3] for row in stored]
+
+    moved = transactions_service.recategorize_transactions({"start_date": "2024-02-01", "end_date": "2024-03-01"}, other)
+    assert moved == 2
+    stored, expected = monthly_totals()
+    assert stored == expected
+    assert {row[0] for row in stored} == {other}
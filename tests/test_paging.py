@@ -0,0 +1,81 @@
+import base64
+import json
+
+import pytest
+
+import services.transactions as transactions_service
+
+
+def add(category, day, description, amount=-5):
+    return transactions_service.add_transaction({
+        "account_type": "Visa", "transaction_date": day, "description": description,
+        "amount": amount, "category": category
+    })["id"]
+
+
+def page(client, **args):
+    response = client.get("/transactions/get", query_string={"limit": 3, **args})
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def walk(client, on_page=None, **args):
+    """Ids of every row, following next_cursor from the first page."""
+    ids = []
+    body = page(client, **args)
+    while True:
+        ids.extend(row["id"] for row in body["rows"])
+        if on_page:
+            on_page(len(ids))
+        if body["next_cursor"] is None:
+            return ids
+        body = page(client, cursor=body["next_cursor"], **args)
+
+
+@pytest.mark.parametrize("sort, order", [("transaction_date", "desc"), ("transaction_date", "asc"), ("amount", "asc")])
+def test_pages_keep_a_stable_order_when_values_tie(client, category, sort, order):
+    ids = [add(category, "2024-03-10", f"Shop {i}") for i in range(7)] + [add(category, "2024-03-11", "Later", -9)]
+
+    walked = walk(client, sort=sort, order=order)
+
+    assert sorted(walked) == sorted(ids)
+    assert walked == [row["id"] for row in page(client, sort=sort, order=order, limit=100)["rows"]]
+
+
+def encode(value):
+    return base64.urlsafe_b64encode(json.dumps(value).encode()).decode().rstrip("=")
+
+
+@pytest.mark.parametrize("cursor", [
+    "not a cursor!",
+    encode([1]),
+    encode({"sort": "2024-03-10", "id": 1}),
+    encode(["2024-03-10", "1"]),
+    encode(["2024-03-10", True]),
+    encode(["2024-03-10", 10 ** 30]),
+    encode([10 ** 30, 1]),
+    encode([None, 1]),
+    base64.urlsafe_b64encode(b'[Infinity, 1]').decode(),
+])
+def test_malformed_or_forged_cursors_get_a_400(client, category, cursor):
+    add(category, "2024-03-10", "Shop")
+    response = client.get("/transactions/get", query_string={"limit": 3, "cursor": cursor, "sort": "amount"})
+    assert response.status_code == 400
+
+
+def test_rows_inserted_between_pages_are_neither_repeated_nor_skipped(client, category):
+    ids = [add(category, f"2024-03-{day:02d}", f"Shop {day}") for day in range(1, 10)]
+    inserted = {}
+
+    def insert_after_first_page(seen):
+        if not inserted:
+            # One row sorting before the current position, one after it.
+            inserted["newer"] = add(category, "2024-03-30", "Newer")
+            inserted["older"] = add(category, "2024-02-01", "Older")
+
+    walked = walk(client, on_page=insert_after_first_page)
+
+    assert len(walked) == len(set(walked))
+    assert walked[:3] == ids[::-1][:3]
+    assert inserted["newer"] not in walked
+    assert walked[3:] == ids[::-1][3:] + [inserted["older"]]
@@ -0,0 +1,77 @@
+import pytest
+
+import services.categories as categories_service
+import services.transactions as transactions_service
+
+ROWS = [
+    ("Visa", "2024-03-01", "GROCER Market 12", -40),
+    ("Visa", "2024-03-15", "Coffee Corner", -4),
+    ("Chequing", "2024-03-20", "Grocer Market 12", -60),
+    ("Visa", "2024-04-02", "GROCER Market 99", -25),
+    ("Visa", "2024-03-22", "Payroll", 2000),
+]
+
+
+@pytest.fixture
+def rows(category):
+    return [
+        transactions_service.add_transaction({
+            "account_type": account, "transaction_date": day, "description": description,
+            "amount": amount, "category": category
+        })["id"]
+        for account, day, description, amount in ROWS
+    ]
+
+
+def recategorize(client, target, body):
+    response = client.post("/transactions/recategorize", json={"category_id": target, **body})
+    return response.status_code, response.get_json()
+
+
+def categories_of(ids):
+    stored = {row["id"]: row["category"] for row in transactions_service.get_transactions().to_dict("records")}
+    return [stored[i] for i in ids]
+
+
+def test_preview_counts_without_moving(client, rows, category):
+    target = categories_service.add_category("Food")["id"]
+    body = {"filter": {"description_regex": "^GROCER"}}
+
+    assert recategorize(client, target, {**body, "preview": True}) == (200, {"success": True, "count": 2})
+    assert categories_of(rows) == [category] * 5
+
+    assert recategorize(client, target, body) == (200, {"success": True, "updated": 2})
+    assert categories_of(rows) == [target, category, category, target, category]
+    # Rows already in the target category are not counted again.
+    assert recategorize(client, target, {**body, "preview": True}) == (200, {"success": True, "count": 0})
+
+
+@pytest.mark.parametrize("filters, moved", [
+    ({"month": "2024-03", "description": "market"}, [0, 2]),
+    ({"month": "2024-03", "description_regex": "Market \\d+$", "account_type": "Visa"}, [0]),
+    ({"max_amount": -30, "description_regex": "(?i)grocer"}, [0, 2]),
+    ({"min_amount": -30, "max_amount": 0}, [1, 3]),
+    ({"account_type": "Chequing", "description_regex": "Coffee"}, []),
+])
+def test_filters_combine(client, rows, filters, moved):
+    target = categories_service.add_category("Food")["id"]
+
+    status, body = recategorize(client, target, {"filter": filters})
+
+    assert status == 200 and body["updated"] == len(moved)
+    assert [i for i, category in enumerate(categories_of(rows)) if category == target] == moved
+
+
+def test_ids_move_only_those_rows(client, rows, category):
+    target = categories_service.add_category("Food")["id"]
+    assert recategorize(client, target, {"ids": rows[1:3]}) == (200, {"success": True, "updated": 2})
+    assert categories_of(rows) == [category, target, target, category, category]
+
+
+@pytest.mark.parametrize("pattern", ["(a+)+$", "(a|ab)*c", "((x*))+", "[unclosed", "a" * 101])
+def test_unsafe_patterns_are_rejected_before_running(client, rows, category, pattern):
+    status, body = recategorize(client, category, {"filter": {"description_regex": pattern}})
+    assert status == 400 and not body["success"]
+
+    response = client.get("/transactions/get", query_string={"limit": 10, "description_regex": pattern})
+    assert response.status_code == 400
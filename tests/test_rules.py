@@ -0,0 +1,140 @@
+import pandas as pd
+
+import db_queries
+import services.categories as categories_service
+import services.rules as rules_service
+import services.transactions as transactions_service
+import services.uploads as uploads_service
+from services.rules import RuleMatcher
+
+DEFAULT = db_queries.DEFAULT_CATEGORY_ID
+
+
+def rules(*specs):
+    columns = ["category_id", "priority", "pattern", "is_regex", "account_type", "min_amount", "max_amount"]
+    defaults = {"priority": 0, "pattern": None, "is_regex": 0, "account_type": None, "min_amount": None, "max_amount": None}
+    return pd.DataFrame([{**defaults, **spec} for spec in specs], columns=columns)
+
+
+def rows(*specs):
+    return pd.DataFrame([
+        {"account_type": "Visa", "amount": -1000, "category": DEFAULT, **spec} for spec in specs
+    ])
+
+
+def test_no_rules_keep_every_category():
+    result = RuleMatcher(rules()).categorize(rows({"description": "Coffee"}, {"description": "Tea"}))
+    assert result.tolist() == [DEFAULT, DEFAULT]
+
+
+def test_keywords_and_regexes_match_case_insensitively():
+    matcher = RuleMatcher(rules(
+        {"category_id": 10, "pattern": "coffee"},
+        {"category_id": 11, "pattern": r"^uber\b", "is_regex": 1},
+    ))
+    result = matcher.categorize(rows(
+        {"description": "Corner COFFEE Bar"}, {"description": "Uber trip"}, {"description": "Ubereats"}
+    ))
+    assert result.tolist() == [10, 11, DEFAULT]
+
+
+def test_best_ranked_matching_rule_wins():
+    # Rules come best-ranked first, as get_all_rules() returns them.
+    matcher = RuleMatcher(rules(
+        {"category_id": 12, "pattern": "shop", "account_type": "Chequing", "priority": 9},
+        {"category_id": 11, "pattern": "shopping", "priority": 5},
+        {"category_id": 10, "pattern": "shop"},
+        {"category_id": 13, "pattern": "shop", "min_amount": 0},
+    ))
+    result = matcher.categorize(rows(
+        {"description": "Shopping mall"},
+        {"description": "Shop", "account_type": "chequing "},
+        {"description": "Shop"},
+        {"description": "Shop", "amount": 500},
+    ))
+    assert result.tolist() == [11, 12, 10, 10]
+
+
+def test_unconditional_rules_and_amount_bounds():
+    matcher = RuleMatcher(rules(
+        {"category_id": 10, "min_amount": -2000, "max_amount": -500},
+        {"category_id": 11, "account_type": "Savings"},
+    ))
+    result = matcher.categorize(rows(
+        {"description": "A"}, {"description": "B", "amount": -100}, {"description": "C", "amount": 0, "account_type": "Savings"}
+    ))
+    assert result.tolist() == [10, DEFAULT, 11]
+
+
+def rule(category_id, pattern, **fields):
+    return {"category_id": category_id, "priority": 0, "pattern": pattern, "is_regex": False,
+            "account_type": None, "min_amount": None, "max_amount": None, **fields}
+
+
+def test_imports_apply_rules_and_work_without_any(category, tmp_path):
+    path = tmp_path / "a.csv"
+    path.write_text(
+        "Account Type,Transaction Date,Description 1,Description 2,CAD$\n"
+        "Visa,04/27/2025,Coffee,,-4.00\n"
+        "Visa,04/28/2025,Groceries store,,-40.00\n"
+    )
+    uploads_service.import_csv(path)
+    assert len(db_queries.get_transactions_in_category_batch(DEFAULT, 0, 10)) == 2
+
+    transactions_service.clear_all_transactions()
+    rules_service.add_rule(rule(category, "grocer"))
+    uploads_service.import_csv(path)
+    remaining = db_queries.get_transactions_in_category_batch(DEFAULT, 0, 10)
+    assert remaining["description"].tolist() == ["Coffee"]
+
+
+def test_apply_rules_to_uncategorized(category):
+    other = categories_service.add_category("Cafes")["id"]
+    for description in ("Coffee", "Coffee beans", "Rent"):
+        transactions_service.add_transaction({
+            "account_type": "Visa", "transaction_date": "2024-03-10",
+            "description": description, "amount": -5, "category": DEFAULT
+        })
+    rules_service.add_rule(rule(other, "coffee"))
+    rules_service.add_rule(rule(category, "coffee beans", priority=1))
+
+    assert rules_service.apply_rules_to_uncategorized(batch_size=2) == (3, 2)
+    assert db_queries.get_transactions_in_category_batch(DEFAULT, 0, 10)["description"].tolist() == ["Rent"]
+    assert rules_service.apply_rules_to_uncategorized() == (1, 0)
+
+
+def test_rules_for_deleted_categories_are_ignored(category):
+    rules_service.add_rule(rule(category, "coffee"))
+    assert rules_service.get_matcher().count == 1
+    categories_service.delete_category(category)
+    assert rules_service.get_matcher().count == 0
+
+
+def test_regex_rules_share_one_alternation_without_changing_the_winner():
+    matcher = RuleMatcher(rules(
+        {"category_id": 12, "pattern": r"market \d+", "is_regex": 1, "account_type": "Chequing"},
+        {"category_id": 11, "pattern": r"(super|mini)market", "is_regex": 1},
+        {"category_id": 10, "pattern": r"market", "is_regex": 1},
+        {"category_id": 13, "pattern": r"(\w)\1", "is_regex": 1},
+    ))
+    assert matcher.regex_alternation is not None
+    assert [rank for rank, _ in matcher.regexes] == [0, 3]
+
+    result = matcher.categorize(rows(
+        {"description": "Market 12", "account_type": "Chequing"},
+        {"description": "Market 12"},
+        {"description": "the supermarket"},
+        {"description": "Coffee"},
+        {"description": "Tea"},
+    ))
+    assert result.tolist() == [12, 10, 11, 13, DEFAULT]
+
+
+def test_rule_routes_reject_bad_bodies_and_slow_patterns(client, category):
+    for body in ([1, 2], "rule", {"category_id": category, "pattern": "(a+)+$", "is_regex": True}):
+        response = client.post("/rules/add", json=body)
+        assert response.status_code == 400
+
+    response = client.post("/transactions/recategorize", json=[category])
+    assert response.status_code == 400
+    assert rules_service.get_rules() == []
@@ -0,0 +1,78 @@
+import pytest
+
+import sessions
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(sessions.time, "monotonic", clock)
+    return clock
+
+
+@pytest.fixture
+def limiter(monkeypatch):
+    limiter = sessions.TokenBucketLimiter()
+    monkeypatch.setattr(sessions, "limiter", limiter)
+    return limiter
+
+
+def test_a_fresh_token_is_valid(limiter):
+    token = sessions.create_session_token("10.0.0.1")
+    assert sessions.validate_and_track_token(token) == "valid"
+
+
+@pytest.mark.parametrize("tamper", [
+    lambda encoded, signature: f"{encoded}x.{signature}",
+    lambda encoded, signature: f"{encoded}.{sessions.create_session_token('10.0.0.1').split('.')[1]}",
+    lambda encoded, signature: f"{sessions._b64encode(b'9999999999|10.0.0.1|00')}.{signature}",
+    lambda encoded, signature: encoded,
+    lambda encoded, signature: "",
+])
+def test_a_tampered_token_is_invalid(limiter, tamper):
+    encoded, signature = sessions.create_session_token("10.0.0.1").split(".")
+    assert sessions.validate_and_track_token(tamper(encoded, signature)) == "invalid"
+
+
+def test_an_expired_token_is_rejected(limiter, monkeypatch):
+    monkeypatch.setattr(sessions, "SESSION_EXPIRY_SECONDS", -1)
+    token = sessions.create_session_token("10.0.0.1")
+    assert sessions.validate_and_track_token(token) == "expired"
+
+
+def test_the_bucket_rejects_when_empty_and_refills(clock):
+    limiter = sessions.TokenBucketLimiter(capacity=3, period=60)
+
+    assert [limiter.allow("a") for _ in range(4)] == [True, True, True, False]
+    assert limiter.allow("b")  # buckets are per client
+
+    clock.now += 20  # one request's worth
+    assert [limiter.allow("a") for _ in range(2)] == [True, False]
+
+    clock.now += 600  # refills only up to capacity
+    assert [limiter.allow("a") for _ in range(4)] == [True, True, True, False]
+
+
+def test_idle_buckets_are_swept(clock):
+    limiter = sessions.TokenBucketLimiter(capacity=3, period=60, sweep_interval=10)
+    limiter.allow("a")
+    clock.now += 61
+    limiter.allow("b")
+    assert set(limiter._buckets) == {"b"}
+
+
+def test_requests_over_the_limit_get_a_429(client, monkeypatch):
+    monkeypatch.setattr(sessions, "limiter", sessions.TokenBucketLimiter(capacity=2))
+    statuses = [client.get("/changes", query_string={"since": 0}).status_code for _ in range(3)]
+    assert statuses == [200, 200, 429]
+
+    client.environ_base.pop("HTTP_X_SESSION_TOKEN")
+    assert client.get("/changes", query_string={"since": 0}).status_code == 403
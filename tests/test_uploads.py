@@ -0,0 +1,65 @@
+import storage
+import services.uploads as uploads_service
+
+HEADER = "Account Type,Account Number,Transaction Date,Cheque Number,Description 1,Description 2,CAD$,USD$\n"
+
+
+def write_csv(path, lines):
+    path.write_text(HEADER + "".join(f"{line}\n" for line in lines))
+    return path
+
+
+def import_csv(path, chunksize=uploads_service.CHUNK_SIZE):
+    inserted = []
+    uploads_service.import_csv(path, on_chunk=lambda uow, index, size, count: inserted.append(count), chunksize=chunksize)
+    return sum(inserted)
+
+
+def stored():
+    conn = storage.get_connection()
+    try:
+        return conn.execute("SELECT description, amount, fingerprint FROM transactions ORDER BY id").fetchall()
+    finally:
+        conn.close()
+
+
+def test_reimporting_a_file_inserts_nothing(db, tmp_path):
+    path = write_csv(tmp_path / "a.csv", [
+        "Visa,1,04/26/2025,,C-IDP PURCHASE-1,Royal Market,-148.59,",
+        "Visa,1,04/27/2025,,Coffee,,-4.00,",
+    ])
+    assert import_csv(path) == 2
+    assert import_csv(path) == 0
+    assert [(row[0], row[1]) for row in stored()] == [("Royal Market", -14859), ("Coffee", -400)]
+
+
+def test_identical_rows_are_kept_apart_by_ordinal(db, tmp_path):
+    lines = ["Visa,1,04/27/2025,,Coffee,,-4.00,"] * 3
+    path = write_csv(tmp_path / "a.csv", lines)
+
+    # Chunks of two: the third copy's ordinal comes from the earlier chunk.
+    assert import_csv(path, chunksize=2) == 3
+    assert len({row[2] for row in stored()}) == 3
+
+    more = write_csv(tmp_path / "b.csv", lines + lines[:1])
+    assert import_csv(more) == 1
+
+
+def test_fingerprints_ignore_case_and_spacing(db, tmp_path):
+    assert import_csv(write_csv(tmp_path / "a.csv", ["Visa,1,04/27/2025,,Coffee  Shop,,-4.00,"])) == 1
+    assert import_csv(write_csv(tmp_path / "b.csv", ["VISA ,1,04/27/2025,,coffee shop,,-4,"])) == 0
+
+
+def test_invalid_rows_are_reported_not_imported(db, tmp_path):
+    path = write_csv(tmp_path / "a.csv", [
+        "Visa,1,2025-04-27,,Bad date,,-4.00,",
+        "Visa,1,04/27/2025,,Bad amount,,abc,",
+        "Visa,1,04/27/2025,,Good,,-4.00,",
+        "Visa,1,04/27/2025,,Huge amount,,1e300,",
+    ])
+    report = uploads_service.validate_csv(path)
+    assert report["rows"] == 4 and report["error_count"] == 3
+    assert [(error["row"], error["field"]) for error in report["errors"]] == [
+        (2, "transaction_date"), (3, "amount"), (5, "amount")
+    ]
+    assert import_csv(path) == 1
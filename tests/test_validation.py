@@ -0,0 +1,54 @@
+import pytest
+
+import validation
+
+TRANSACTION = {"account_type": "Visa", "transaction_date": "2024-03-10", "description": "Shop"}
+
+
+@pytest.mark.parametrize("value", ["inf", "-inf", "nan", 1e300, "1e400", validation.MAX_AMOUNT + 1, "x", None])
+def test_unusable_amounts_are_rejected(value):
+    assert not validation.validate_number(value)
+
+
+@pytest.mark.parametrize("value", [0, -12.5, "4.99", validation.MAX_AMOUNT, -validation.MAX_AMOUNT])
+def test_amounts_in_range_are_accepted(value):
+    assert validation.validate_number(value)
+
+
+@pytest.mark.parametrize("value", ["inf", "nan", 1e300])
+def test_out_of_range_amounts_get_a_400_everywhere(client, category, value):
+    response = client.post("/transaction/add", json={**TRANSACTION, "amount": value, "category": category})
+    assert response.status_code == 400
+
+    response = client.get("/transactions/get", query_string={"limit": 10, "min_amount": value})
+    assert response.status_code == 400
+
+    response = client.post("/rules/add", json={"category_id": category, "min_amount": value})
+    assert response.status_code == 400
+
+    response = client.post("/transactions/recategorize", json={"category_id": category, "filter": {"max_amount": value}})
+    assert response.status_code == 400
+
+
+def test_in_range_amounts_still_work(client, category):
+    response = client.post("/transaction/add", json={**TRANSACTION, "amount": -validation.MAX_AMOUNT, "category": category})
+    assert response.status_code == 200
+    response = client.get("/transactions/get", query_string={"limit": 10, "min_amount": -validation.MAX_AMOUNT})
+    assert response.status_code == 200
+    assert response.get_json()["total"] == 1
+
+
+@pytest.mark.parametrize("value, valid", [
+    ("2024-03", True), ("1900-01", True), ("1899-12", False), ("0001-01", False), ("2024-13", False), ("2024-3", False)
+])
+def test_months_start_at_a_sane_year(value, valid):
+    assert validation.validate_month(value) == valid
+
+
+def test_budget_history_rejects_ancient_months(client):
+    response = client.get("/budget/history", query_string={"end": "0001-01", "months": 60})
+    assert response.status_code == 400
+
+    response = client.get("/budget/history", query_string={"end": "1900-01", "months": 60})
+    assert response.status_code == 200
+    assert response.get_json()["months"][0] == "1895-02"
@@ -0,0 +1,123 @@
+import threading
+
+import pytest
+
+import storage
+import writer as writer_module
+from writer import Writer
+
+
+def insert_category(name):
+    def command(uow):
+        return uow.execute("INSERT INTO categories (name) VALUES (?) RETURNING id", (name,)).fetchone()[0]
+    return command
+
+
+def category_names():
+    conn = storage.get_connection()
+    try:
+        return {row[0] for row in conn.execute("SELECT name FROM categories")}
+    finally:
+        conn.close()
+
+
+def blocked(release, started=None):
+    """A command that holds the writer until `release` is set."""
+    def command(uow):
+        if started is not None:
+            started.set()
+        release.wait(5)
+    return command
+
+
+def test_queued_commands_commit_as_one_group(db):
+    w = Writer(window=0)
+    statements = []
+    started, release = threading.Event(), threading.Event()
+
+    def first(uow):
+        uow.conn.set_trace_callback(statements.append)
+        blocked(release, started)(uow)
+
+    w.submit(first)
+    started.wait(5)
+    futures = [w.submit(insert_category(f"c{i}")) for i in range(5)]
+    release.set()
+
+    assert len({future.result(5) for future in futures}) == 5
+    assert category_names() >= {f"c{i}" for i in range(5)}
+    assert statements.count("COMMIT") == 1
+
+
+def test_failing_command_is_rolled_back_alone(db):
+    w = Writer(window=0)
+    started, release = threading.Event(), threading.Event()
+
+    def failing(uow):
+        uow.execute("INSERT INTO categories (name) VALUES ('doomed')")
+        raise ValueError("no")
+
+    w.submit(blocked(release, started))
+    started.wait(5)
+    before, bad, after = w.submit(insert_category("before")), w.submit(failing), w.submit(insert_category("after"))
+    release.set()
+
+    with pytest.raises(ValueError):
+        bad.result(5)
+    before.result(5), after.result(5)
+    names = category_names()
+    assert {"before", "after"} <= names and "doomed" not in names
+
+
+def test_after_commit_callbacks_run_before_the_result(db):
+    w = Writer(window=0)
+    calls = []
+
+    def command(uow):
+        uow.after_commit(lambda: calls.append("callback"))
+        return "result"
+
+    assert w.run(command) == "result"
+    assert calls == ["callback"]
+
+
+def test_writer_survives_a_broken_connection(db):
+    w = Writer(window=0)
+
+    def close_connection(uow):
+        uow.conn.close()
+
+    with pytest.raises(Exception):
+        w.run(close_connection)
+    assert w.run(insert_category("recovered"))
+    assert "recovered" in category_names()
+
+
+def test_writer_survives_failing_to_open_a_connection(db, monkeypatch):
+    w = Writer(window=0)
+    attempts = []
+
+    def flaky_open():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise OSError("disk unavailable")
+        return storage.open_write_connection()
+
+    monkeypatch.setattr(writer_module, "open_write_connection", flaky_open)
+    with pytest.raises(OSError):
+        w.run(insert_category("first"))
+    assert w.run(insert_category("second"))
+    assert category_names() >= {"second"} and "first" not in category_names()
+
+
+def test_run_times_out(db):
+    w = Writer(window=0, timeout=0.05)
+    started, release = threading.Event(), threading.Event()
+    w.submit(blocked(release, started))
+    started.wait(5)
+
+    with pytest.raises(TimeoutError):
+        w.run(insert_category("late"))
+    release.set()
+    assert w.run(insert_category("on time"))
+    assert "late" not in category_names()
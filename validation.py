@@ -1,4 +1,5 @@
 import re
+import math
 from datetime import datetime
 
 def validate_positive_int(value):
@@ -19,12 +20,84 @@ def sanitize_string(value, max_length=255):
         return clean
     return None
 
+# Largest amount accepted, in dollars either way. Keeps cents, and totals of
+# millions of them, well inside SQLite's 64-bit integers.
+MAX_AMOUNT = 1_000_000_000
+
 def validate_number(value):
     try:
-        float(value)
-        return True
+        number = float(value)
     except (ValueError, TypeError):
         return False
+    return math.isfinite(number) and abs(number) <= MAX_AMOUNT
+
+def validate_regex(value):
+    """
+    Validates a regular expression clients may run against every
+    transaction: it must compile and have no repeated group that itself
+    repeats or alternates, like (a+)+ or (a|ab)*, as those can take
+    exponential time to fail a match.
+    """
+    if not isinstance(value, str):
+        return False
+    try:
+        re.compile(value)
+    except re.error:
+        return False
+    return not _has_nested_repetition(value)
+
+def _has_nested_repetition(pattern):
+    # One flag per open group: whether it contains a repetition or alternation.
+    groups = [False]
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if char == "\\":
+            i += 1
+        elif char == "[":
+            # Skip the character class; a ] right after [ or [^ is literal.
+            i += 2 if pattern[i + 1:i + 2] == "^" else 1
+            i += 1 if pattern[i:i + 1] == "]" else 0
+            while pattern[i] != "]":
+                i += 2 if pattern[i] == "\\" else 1
+        elif char == "(":
+            groups.append(False)
+        elif char == ")":
+            risky = groups.pop()
+            if risky and pattern[i + 1:i + 2] in ("*", "+", "{"):
+                return True
+            groups[-1] = groups[-1] or risky
+        elif char in "*+{|":
+            groups[-1] = True
+        i += 1
+    return False
+
+# YYYY-MM and YYYY-MM-DD formats
+month_regex = re.compile(r"^\d{4}-\d{2}$")
+iso_date_regex = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+
+# Earliest year accepted in a month, so month arithmetic such as budget
+# history's look-back never leaves the calendar.
+MIN_YEAR = 1900
+
+def validate_month(value):
+    """Validates a YYYY-MM month string from MIN_YEAR on."""
+    if not isinstance(value, str) or not month_regex.match(value):
+        return False
+    try:
+        return datetime.strptime(value, "%Y-%m").year >= MIN_YEAR
+    except ValueError:
+        return False
+
+def validate_iso_date(value):
+    """Validates a YYYY-MM-DD date string."""
+    if not isinstance(value, str) or not iso_date_regex.match(value):
+        return False
+    try:
+        datetime.strptime(value, "%Y-%m-%d")
+        return True
+    except ValueError:
+        return False
 
 # MM/DD/YYYY format, allows leading zeros
 date_regex_mdy = re.compile(r"^(0[1-9]|1[0-2])/([0-2][0-9]|3[01])/(\d{4})$")
@@ -0,0 +1,154 @@
+import os
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import Future
+from storage import UnitOfWork, open_write_connection
+
+# How long a group waits for more commands before committing. Commands
+# already queued always join, so 0 still groups writes that arrive together.
+COMMIT_WINDOW = float(os.environ.get("WRITE_COMMIT_WINDOW_MS", 0)) / 1000
+MAX_GROUP_SIZE = 500
+# How long run() waits for a command's result before giving up on it.
+WRITE_TIMEOUT = float(os.environ.get("WRITE_TIMEOUT_SECONDS", 30))
+
+logger = logging.getLogger(__name__)
+
+
+class Writer:
+    """
+    Owns the only write connection. Queued commands run one group per transaction,
+    each in its own savepoint, and get their results once the group commits.
+    """
+
+    def __init__(self, window=COMMIT_WINDOW, max_group=MAX_GROUP_SIZE, timeout=WRITE_TIMEOUT):
+        self.window = window
+        self.max_group = max_group
+        self.timeout = timeout
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._unit = None
+
+    def submit(self, command):
+        """Queue command(uow); returns a Future for its result."""
+        if self._thread is None:
+            self._start()
+        future = Future()
+        self._queue.put((command, future))
+        return future
+
+    def run(self, command):
+        """Run command(uow) and wait for its committed result; inside a command, join its work."""
+        if threading.current_thread() is self._thread:
+            return command(self._unit)
+        future = self.submit(command)
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            # Only a command that hasn't started can still be called off.
+            future.cancel()
+            logger.error(f"Write command timed out after {self.timeout}s")
+            raise
+
+    def _start(self):
+        with self._start_lock:
+            if self._thread is None:
+                thread = threading.Thread(target=self._loop, name="db-writer", daemon=True)
+                thread.start()
+                self._thread = thread
+
+    def _loop(self):
+        conn = None
+        while True:
+            item = self._queue.get()
+            taken = []  # futures of every command taken from the queue
+            try:
+                if conn is None:
+                    conn = open_write_connection()
+                self._run_group(conn, item, taken)
+            except Exception as e:
+                logger.error(f"Write group of {len(taken)} commands failed: {e}", exc_info=True)
+                conn = self._recover(conn)
+                for future in taken or [item[1]]:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _recover(self, conn):
+        """Roll back a failed group; returns None if the connection had to be dropped."""
+        if conn is None:
+            return None
+        try:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            return conn
+        except Exception as e:
+            logger.error(f"Reopening the write connection after a failed rollback: {e}", exc_info=True)
+            try:
+                conn.close()
+            except Exception:
+                pass
+            return None
+
+    def _next(self, deadline):
+        """The next queued command, waiting until deadline at most; None if none came."""
+        try:
+            return self._queue.get_nowait()
+        except queue.Empty:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            try:
+                return self._queue.get(timeout=remaining)
+            except queue.Empty:
+                return None
+
+    def _run_group(self, conn, item, taken):
+        """Run item and whatever queues behind it as one transaction; raises if it fails."""
+        done = []  # (future, result, error, callbacks)
+        deadline = time.monotonic() + self.window
+        conn.execute("BEGIN IMMEDIATE")
+        while item is not None:
+            command, future = item
+            taken.append(future)
+            if future.set_running_or_notify_cancel():
+                done.append((future, *self._execute(conn, command)))
+            if len(taken) >= self.max_group:
+                break
+            item = self._next(deadline)
+        conn.execute("COMMIT")
+
+        logger.debug(f"Committed a group of {len(done)} write commands")
+        for future, result, error, callbacks in done:
+            if error is not None:
+                future.set_exception(error)
+                continue
+            for callback in callbacks:
+                try:
+                    callback()
+                except Exception as e:
+                    logger.error(f"After-commit callback failed: {e}", exc_info=True)
+            future.set_result(result)
+
+    def _execute(self, conn, command):
+        """Run one command in a savepoint. Returns (result, error, callbacks)."""
+        unit = self._unit = UnitOfWork(conn)
+        conn.execute("SAVEPOINT command")
+        try:
+            result = command(unit)
+        except Exception as e:
+            if not conn.in_transaction:
+                # SQLite abandoned the whole transaction (e.g. disk full);
+                # the group's earlier commands are lost with it.
+                raise
+            conn.execute("ROLLBACK TO command")
+            conn.execute("RELEASE command")
+            return None, e, []
+        finally:
+            self._unit = None
+        conn.execute("RELEASE command")
+        return result, None, unit.callbacks
+
+
+writer = Writer()